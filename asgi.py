@@ -0,0 +1,233 @@
+"""ASGI variant of the Flask app for high-concurrency deployments.
+
+    uvicorn asgi:application --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -c serve.py asgi:application
+
+Uses the same Flask app, url_map, hooks and views as backend.py, so every
+JSON contract is identical. The difference is how the LLM-bound views
+(registered with @flow_view) run: their generator is driven on the server's
+event loop, and each yielded call is awaited. LLM calls go to the gateway's
+async API. Credit checks run in a worker thread. A request waiting on OpenAI
+holds no thread, so one process can keep thousands of extension requests in
+flight.
+
+Every other route (auth, credits, email, debug) and CORS preflights go
+through the regular WSGI app in a worker thread, as they would under
+gunicorn.
+
+Streamed (SSE) bodies are still produced by stream_completion's blocking
+generator. It is pumped from one dedicated thread per stream, because
+stream_with_context must push and pop its context from the same thread.
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import sys
+import threading
+
+from backend import app
+from view_flow import FLOWS, run_async
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+async def read_body(receive):
+    chunks = []
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        more = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope (PEP 3333 fields Flask relies on)"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'asgi.scope': scope,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def flow_endpoint(environ):
+    """The @flow_view function this request routes to, if any"""
+    if environ['REQUEST_METHOD'] == 'OPTIONS':
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except Exception:
+        return None
+    return FLOWS.get(endpoint)
+
+
+async def pump_in_thread(iterable):
+    """Iterate a blocking iterable from one thread, yielding its items here"""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    done = object()
+    cancelled = threading.Event()
+
+    def pump():
+        try:
+            for item in iterable:
+                loop.call_soon_threadsafe(items.put_nowait, item)
+                if cancelled.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(items.put_nowait, e)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            loop.call_soon_threadsafe(items.put_nowait, done)
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(pump,), daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            item = await items.get()
+            if item is done:
+                finished = True
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        # Let the pump finish closing the iterable (and its request context).
+        # Wait for its marker, not the thread: it can still be alive after
+        # queuing `done`, and nothing else would ever arrive
+        while not finished:
+            finished = await items.get() is done
+
+
+async def send_response(send, status, headers, body_iter):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    async for chunk in body_iter:
+        if chunk:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def dispatch_flow(environ, flow, send):
+    """Flask's full_dispatch_request, with the view's slow calls awaited"""
+    ctx = app.request_context(environ)
+    ctx.push()
+    error = None
+    try:
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await run_async(flow(**(ctx.request.view_args or {})))
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        response = app.finalize_request(rv)
+    except Exception as e:
+        error = e
+        response = app.handle_exception(e)
+
+    try:
+        if response.is_streamed:
+            body = pump_in_thread(response.response)
+        else:
+            body = _single(response.get_data())
+        await send_response(send, response.status_code, response.headers.to_wsgi_list(), body)
+    finally:
+        response.close()
+        ctx.pop(error)
+
+
+async def _single(data):
+    yield data
+
+
+async def dispatch_wsgi(environ, send):
+    """Run any non-flow route through the plain WSGI app"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def run():
+        yield from app.wsgi_app(environ, start_response)
+
+    chunks = pump_in_thread(run())
+    first = None
+    async for chunk in chunks:
+        first = chunk
+        break
+
+    async def body():
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    await send_response(send, started.get('status', 500), started.get('headers', []), body())
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            from serve import shutdown_app
+            try:
+                await asyncio.to_thread(shutdown_app)
+            except Exception as e:
+                logging.warning(f"Shutdown cleanup failed: {e}")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    environ = build_environ(scope, await read_body(receive))
+    flow = flow_endpoint(environ)
+    if flow is not None:
+        await dispatch_flow(environ, flow, send)
+    else:
+        await dispatch_wsgi(environ, send)
@@ -0,0 +1,108 @@
+"""Caches that take Firestore reads off the authenticated request path.
+
+verify_auth_token used to decode the JWT and read users/{uid} on every
+request, and check_and_deduct_credits then read the same document again in
+its transaction. With these caches a warm request only pays for the credit
+transaction itself.
+
+  - TokenCache: sha256(token) -> uid, kept no longer than the JWT's exp
+  - UserProfileCache: uid -> user document, short TTL, updated in place when
+    our own credit transactions change the balance and invalidated on failure
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# AUTH CACHE CONFIGURATION
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '10000'))
+AUTH_TOKEN_MAX_TTL = float(os.getenv('AUTH_TOKEN_MAX_TTL', '3600'))
+AUTH_PROFILE_CACHE_SIZE = int(os.getenv('AUTH_PROFILE_CACHE_SIZE', '10000'))
+AUTH_PROFILE_TTL = float(os.getenv('AUTH_PROFILE_TTL', '15'))
+
+
+class _ExpiringLRU:
+    """Thread-safe LRU where every entry carries its own expiry time"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenCache:
+    """Decoded-token cache keyed on a hash of the raw token"""
+
+    def __init__(self, max_entries=AUTH_TOKEN_CACHE_SIZE, max_ttl=AUTH_TOKEN_MAX_TTL):
+        self.max_ttl = max_ttl
+        self._entries = _ExpiringLRU(max_entries)
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        return self._entries.get(self._key(token))
+
+    def set(self, token, user_id, exp=None):
+        expires = time.time() + self.max_ttl
+        if exp:
+            expires = min(expires, float(exp))
+        if expires > time.time():
+            self._entries.set(self._key(token), user_id, expires)
+
+
+class UserProfileCache:
+    """Short-lived copy of users/{uid} documents"""
+
+    def __init__(self, max_entries=AUTH_PROFILE_CACHE_SIZE, ttl=AUTH_PROFILE_TTL):
+        self.ttl = ttl
+        self._entries = _ExpiringLRU(max_entries)
+
+    def get(self, user_id):
+        data = self._entries.get(user_id)
+        return dict(data) if data is not None else None
+
+    def set(self, user_id, data):
+        self._entries.set(user_id, dict(data), time.time() + self.ttl)
+
+    def update_credits(self, user_id, credits):
+        """Apply a balance we just committed ourselves"""
+        data = self._entries.get(user_id)
+        if data is not None:
+            data = dict(data, credits=credits)
+            self._entries.set(user_id, data, time.time() + self.ttl)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id)
+
+
+token_cache = TokenCache()
+profile_cache = UserProfileCache()
@@ -1,11 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-from openai import OpenAI
 import logging
 import os
 import json
 import requests  # ADD THIS LINE
 import hashlib
+import hmac
 import base64
 import json
 
@@ -28,9 +28,51 @@ CORS(app,
 
 # REMOVED: @app.after_request and @app.before_request functions (were causing duplicate headers)
 
-logging.basicConfig(level=logging.INFO)
+# LOGGING (queued, structured, sampled per category - see structured_logging.py)
+from structured_logging import get_logger, log_payload, render_log_metrics, setup_logging
+setup_logging()
+request_log = get_logger('request')
+payload_log = get_logger('payload')
+auth_log = get_logger('auth')
+credits_log = get_logger('credits')
+mail_log = get_logger('mailgun')
+
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+# TRACING (per-phase spans, GET /metrics and OTLP export - see tracing.py)
+from tracing import annotate_request, finish_request, render_metrics, start_request, tag_response, traced
+
+@app.before_request
+def start_request_span():
+    if request.method != 'OPTIONS' and request.endpoint != 'metrics':
+        g.request_span = start_request(request.endpoint or 'unmatched', request.headers.get('traceparent'), **{
+            'http.request.method': request.method,
+            'http.route': request.url_rule.rule if request.url_rule else request.path,
+        })
+
+@app.after_request
+def tag_request_span(response):
+    root = g.get('request_span')
+    if root is not None and tag_response(root, response):
+        g.pop('request_span')  # the stream finishes it after its last event
+    return response
+
+@app.teardown_request
+def finish_request_span(exc):
+    finish_request(g.pop('request_span', None), exc)
+
+# SHARED LLM GATEWAY (pooled async client - see llm_gateway.py)
+from llm_gateway import get_gateway
+llm = get_gateway()
+
+# STRUCTURED OUTPUT PARSING (see json_stream.py)
+from json_stream import extract_json, find_json
+extract_json = traced('parse')(extract_json)
+find_json = traced('parse')(find_json)
+
+# TOKEN BUDGETS (see token_budget.py)
+from token_budget import trim_turns
+SYNTHESIS_INPUT_TOKENS = int(os.getenv('SYNTHESIS_INPUT_TOKENS', '3000'))
 
 # MAILGUN CONFIGURATION - ADD THIS ENTIRE SECTION
 MAILGUN_API_KEY = os.getenv('MAILGUN_API_KEY', '')
@@ -39,8 +81,12 @@ MAILGUN_BASE_URL = os.getenv('MAILGUN_BASE_URL', 'https://api.mailgun.net/v3')
 FRONTEND_BASE_URL = os.getenv('FRONTEND_BASE_URL', 'https://solthron.com')
 VERIFICATION_BASE_URL = os.getenv('VERIFICATION_BASE_URL', 'https://afaque.pythonanywhere.com')
 
-print(f"🔑 Mailgun API key loaded: {'✅' if MAILGUN_API_KEY else '❌'}")
-print(f"🌐 Mailgun domain: {MAILGUN_DOMAIN}")
+mail_log.info(f"🔑 Mailgun API key loaded: {'✅' if MAILGUN_API_KEY else '❌'}")
+mail_log.info(f"🌐 Mailgun domain: {MAILGUN_DOMAIN}")
+
+# Sends go through a background worker pool with a pooled session (see email_queue.py)
+from email_queue import EMAIL_QUEUE_ENABLED, MailgunClient, get_email_queue
+mailgun = MailgunClient(MAILGUN_API_KEY, MAILGUN_DOMAIN, MAILGUN_BASE_URL)
 
 # FIREBASE ADMIN SDK INITIALIZATION
 try:
@@ -49,12 +95,23 @@ try:
     firebase_admin.initialize_app(cred)
     db = firestore.client()
     FIREBASE_ENABLED = True
-    print("✅ Firebase Admin SDK initialized successfully")
+    logging.info("✅ Firebase Admin SDK initialized successfully")
 
 except Exception as e:
-    print(f"❌ Firebase initialization failed: {e}")
+    logging.error(f"❌ Firebase initialization failed: {e}")
     FIREBASE_ENABLED = False
 
+# USAGE ACCOUNTING (tokens and cost per request/user/mode/model - see usage_meter.py)
+from usage_meter import USAGE_REPORT_TOKEN, attribute_usage, begin_usage, get_usage_meter, record_credits
+
+if FIREBASE_ENABLED:
+    get_usage_meter().attach_firestore(db)
+
+@app.before_request
+def begin_request_usage():
+    if request.method != 'OPTIONS':
+        begin_usage(request.endpoint or 'unmatched')
+
 # CREDIT MAPPING FUNCTION (matches your extension logic exactly)
 def get_feature_credits(mode):
     """Map features to credit costs - matches extension logic exactly"""
@@ -109,6 +166,7 @@ def get_feature_credits(mode):
         return 6  # Default fallback
 
 # AUTHENTICATION HELPER FUNCTIONS
+@traced('auth')
 def verify_auth_token(token):
     """Verify JWT token and return user info"""
     if not FIREBASE_ENABLED:
@@ -134,9 +192,10 @@ def verify_auth_token(token):
         return None
 
     except Exception as e:
-        print(f"Token verification failed: {e}")
+        auth_log.warning(f"Token verification failed: {e}")
         return None
 
+@traced('credits')
 def check_and_deduct_credits(user_uid, feature_mode):
     """Check if user has enough credits and deduct them"""
     if not FIREBASE_ENABLED:
@@ -196,14 +255,18 @@ def check_and_deduct_credits(user_uid, feature_mode):
         # Execute transaction
         transaction = db.transaction()
         result = update_credits(transaction)
+        if result.get('success'):
+            record_credits(result.get('credits_used'), user_uid)
         return result
 
     except Exception as e:
-        print(f"Credit deduction error: {e}")
+        credits_log.error(f"Credit deduction error: {e}")
         return {'success': False, 'message': str(e)}
 
 def optional_credit_check(feature_mode):
     """Optional credit check that doesn't break existing functionality"""
+    annotate_request(mode=feature_mode)
+    attribute_usage(mode=feature_mode)
     try:
         # Check if user sent auth token
         auth_header = request.headers.get('Authorization')
@@ -218,6 +281,7 @@ def optional_credit_check(feature_mode):
 
         if not user_info:
             return {'success': True, 'message': 'Invalid token - allowing free usage'}
+        attribute_usage(user=user_info['uid'])
 
         # Check and deduct credits
         result = check_and_deduct_credits(user_info['uid'], feature_mode)
@@ -225,7 +289,7 @@ def optional_credit_check(feature_mode):
 
     except Exception as e:
         # On any error, allow free usage (safety fallback)
-        print(f"Credit check error: {e}")
+        credits_log.error(f"Credit check error: {e}")
         return {'success': True, 'message': 'Credit check failed - allowing free usage'}
 
 
@@ -259,35 +323,35 @@ def generate_verification_token_v2(email):
         # Combine base64 data with hash
         final_token = f"{token_b64}.{token_hash}"
 
-        print(f"🔧 DEBUG: Token generated successfully for {email}")
+        auth_log.debug(f"🔧 Token generated successfully for {email}")
         return final_token
 
     except Exception as e:
-        print(f"❌ Token generation failed: {e}")
+        auth_log.warning(f"❌ Token generation failed: {e}")
         return None
 
 def verify_token_v2(email, token):
     """Verify token with embedded expiration - RELIABLE VERSION"""
     try:
         if not MAILGUN_API_KEY:
-            print(f"❌ Token verification failed: No API key")
+            auth_log.warning("❌ Token verification failed: No API key")
             return False
 
         if not token or '.' not in token:
-            print(f"❌ Invalid token format: {token}")
+            auth_log.warning(f"❌ Invalid token format: {token}")
             return False
 
         # Split token into data and hash parts
         try:
             token_b64, token_hash = token.rsplit('.', 1)
         except ValueError:
-            print(f"❌ Could not split token")
+            auth_log.warning("❌ Could not split token")
             return False
 
         # Verify hash first
         expected_hash = hashlib.sha256(f"{token_b64}:{MAILGUN_API_KEY}".encode()).hexdigest()[:16]
         if expected_hash != token_hash:
-            print(f"❌ Token hash verification failed")
+            auth_log.warning("❌ Token hash verification failed")
             return False
 
         # Decode token data
@@ -296,12 +360,12 @@ def verify_token_v2(email, token):
             token_json = token_bytes.decode('utf-8')
             token_data = json.loads(token_json)
         except Exception as decode_error:
-            print(f"❌ Token decode error: {decode_error}")
+            auth_log.warning(f"❌ Token decode error: {decode_error}")
             return False
 
         # Verify email matches
         if token_data.get('email') != email:
-            print(f"❌ Email mismatch in token")
+            auth_log.warning("❌ Email mismatch in token")
             return False
 
         # Check expiration
@@ -310,67 +374,48 @@ def verify_token_v2(email, token):
             current_time = datetime.datetime.utcnow()
 
             if current_time > expiration:
-                print(f"❌ Token has expired")
+                auth_log.warning("❌ Token has expired")
                 return False
 
-            print(f"✅ Token verified successfully for {email}")
+            auth_log.info(f"✅ Token verified successfully for {email}")
             return True
 
         except Exception as time_error:
-            print(f"❌ Time parsing error: {time_error}")
+            auth_log.warning(f"❌ Time parsing error: {time_error}")
             return False
 
     except Exception as e:
-        print(f"❌ Token verification error: {e}")
+        auth_log.warning(f"❌ Token verification error: {e}")
         return False
 
-def send_verification_email_mailgun(email, first_name=""):
-    """Send verification email using Mailgun - IMPROVED VERSION WITH DEBUGGING"""
-    try:
-        print(f"🔧 DEBUG: === Starting email send process ===")
-        print(f"🔧 DEBUG: Email: {email}")
-        print(f"🔧 DEBUG: First name: {first_name}")
-
-        # Step 1: Validate environment variables
-        if not MAILGUN_API_KEY:
-            print(f"❌ DEBUG: MAILGUN_API_KEY is missing or empty")
-            return {"success": False, "message": "Mailgun API key not configured"}
-
-        if not MAILGUN_DOMAIN:
-            print(f"❌ DEBUG: MAILGUN_DOMAIN is missing or empty")
-            return {"success": False, "message": "Mailgun domain not configured"}
-
-        print(f"✅ DEBUG: Environment variables present")
-        print(f"🔧 DEBUG: API Key length: {len(MAILGUN_API_KEY)}")
-        print(f"🔧 DEBUG: Domain: {MAILGUN_DOMAIN}")
-        print(f"🔧 DEBUG: Base URL: {MAILGUN_BASE_URL}")
-
-        # Step 2: Generate verification token
-        print(f"🔧 DEBUG: Generating verification token...")
-        verification_token = generate_verification_token_v2(email)
-        if not verification_token:
-            print(f"❌ DEBUG: Token generation failed")
-            return {"success": False, "message": "Failed to generate verification token"}
+def build_verification_email(email, first_name=""):
+    """Mailgun form fields for a verification email, or None if no token could be generated"""
+    # Step 1: Generate verification token
+    mail_log.debug("🔧 Generating verification token...")
+    verification_token = generate_verification_token_v2(email)
+    if not verification_token:
+        mail_log.error("❌ Token generation failed")
+        return None
 
-        print(f"✅ DEBUG: Token generated successfully")
+    mail_log.debug("✅ Token generated successfully")
 
-        # Step 3: Build verification URL
-        verification_url = f"{VERIFICATION_BASE_URL}/verify-email?email={email}&token={verification_token}"
-        print(f"🔧 DEBUG: Verification URL: {verification_url}")
+    # Step 2: Build verification URL
+    verification_url = f"{VERIFICATION_BASE_URL}/verify-email?email={email}&token={verification_token}"
+    mail_log.debug(f"🔧 Verification URL: {verification_url}")
 
-        # Step 4: Prepare email content
-        print(f"🔧 DEBUG: Preparing email content...")
+    # Step 3: Prepare email content
+    mail_log.debug("🔧 Preparing email content...")
 
-        # Simplified welcome text to avoid f-string issues
-        if first_name:
-            welcome_text = f"Welcome {first_name}!"
-        else:
-            welcome_text = "Welcome!"
+    # Simplified welcome text to avoid f-string issues
+    if first_name:
+        welcome_text = f"Welcome {first_name}!"
+    else:
+        welcome_text = "Welcome!"
 
-        print(f"🔧 DEBUG: Welcome text: {welcome_text}")
+    mail_log.debug(f"🔧 Welcome text: {welcome_text}")
 
-        # Professional HTML Email Template (simplified to avoid f-string errors)
-        html_content = f"""<!DOCTYPE html>
+    # Professional HTML Email Template (simplified to avoid f-string errors)
+    html_content = f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
@@ -430,8 +475,8 @@ def send_verification_email_mailgun(email, first_name=""):
 </body>
 </html>"""
 
-        # Plain text fallback
-        text_content = f"""
+    # Plain text fallback
+    text_content = f"""
 {welcome_text}
 
 Thanks for signing up! Click the link below to verify your email address:
@@ -445,59 +490,60 @@ Once verified, you can start optimizing your AI conversations with our Chrome ex
 - Solthron Team
 """
 
-        print(f"✅ DEBUG: Email content prepared")
+    mail_log.debug("✅ Email content prepared")
+
+    # Step 4: Mailgun form fields
+    email_data = {
+        "from": f"Solthron <noreply@{MAILGUN_DOMAIN}>",
+        "to": [email],
+        "subject": "🚀 Verify Your Solthron Account - Start Optimizing AI Conversations",
+        "text": text_content,
+        "html": html_content,
+        "o:tag": ["verification", "signup"],
+        "o:tracking": "yes"
+    }
 
-        # Step 5: Prepare Mailgun request
-        mailgun_url = f"{MAILGUN_BASE_URL}/{MAILGUN_DOMAIN}/messages"
-        print(f"🔧 DEBUG: Mailgun URL: {mailgun_url}")
+    mail_log.debug("🔧 Email data prepared")
+    mail_log.debug(f"🔧 From: {email_data['from']}")
+    mail_log.debug(f"🔧 To: {email_data['to']}")
+    mail_log.debug(f"🔧 Subject: {email_data['subject']}")
 
-        email_data = {
-            "from": f"Solthron <noreply@{MAILGUN_DOMAIN}>",
-            "to": [email],
-            "subject": "🚀 Verify Your Solthron Account - Start Optimizing AI Conversations",
-            "text": text_content,
-            "html": html_content,
-            "o:tag": ["verification", "signup"],
-            "o:tracking": "yes"
-        }
+    return email_data
 
-        print(f"🔧 DEBUG: Email data prepared")
-        print(f"🔧 DEBUG: From: {email_data['from']}")
-        print(f"🔧 DEBUG: To: {email_data['to']}")
-        print(f"🔧 DEBUG: Subject: {email_data['subject']}")
 
-        # Step 6: Send email via Mailgun
-        print(f"🔧 DEBUG: Sending request to Mailgun...")
+def send_verification_email_mailgun(email, first_name=""):
+    """Queue a verification email for the Mailgun workers (see email_queue.py)"""
+    try:
+        mail_log.debug(f"🔧 === Starting email send process for {email} ===")
 
-        response = requests.post(
-            mailgun_url,
-            auth=("api", MAILGUN_API_KEY),
-            data=email_data,
-            timeout=30  # Add timeout
-        )
+        # Step 1: Validate environment variables
+        if not MAILGUN_API_KEY:
+            mail_log.error("❌ MAILGUN_API_KEY is missing or empty")
+            return {"success": False, "message": "Mailgun API key not configured"}
 
-        print(f"🔧 DEBUG: Mailgun response status: {response.status_code}")
-        print(f"🔧 DEBUG: Mailgun response text: {response.text}")
+        if not MAILGUN_DOMAIN:
+            mail_log.error("❌ MAILGUN_DOMAIN is missing or empty")
+            return {"success": False, "message": "Mailgun domain not configured"}
+
+        # Step 2: Build the message (token, HTML and text bodies)
+        email_data = build_verification_email(email, first_name)
+        if email_data is None:
+            return {"success": False, "message": "Failed to generate verification token"}
+
+        # Step 3: Hand it to the worker pool - or send inline when the queue is off
+        if not EMAIL_QUEUE_ENABLED:
+            result = get_email_queue(mailgun).send_now(email_data)
+            if result["success"]:
+                mail_log.info(f"✅ Verification email sent successfully to {email}")
+            return result
+
+        job_id = get_email_queue(mailgun).enqueue(email_data, dedupe_key=f"verification:{email}")
+        mail_log.info(f"📨 Verification email to {email} queued as {job_id}")
+        return {"success": True, "queued": True, "job_id": job_id, "message": "Verification email queued"}
 
-        if response.status_code == 200:
-            print(f"✅ Verification email sent successfully to {email}")
-            return {"success": True, "message": "Verification email sent"}
-        else:
-            print(f"❌ Mailgun error: {response.status_code} - {response.text}")
-            return {"success": False, "message": f"Mailgun API error: {response.status_code}"}
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Mailgun request timeout")
-        return {"success": False, "message": "Email service timeout"}
-    except requests.exceptions.ConnectionError:
-        print(f"❌ Mailgun connection error")
-        return {"success": False, "message": "Failed to connect to email service"}
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Mailgun request error: {e}")
-        return {"success": False, "message": f"Email service error: {str(e)}"}
     except Exception as e:
-        print(f"❌ Unexpected error in send_verification_email_mailgun: {e}")
-        print(f"❌ Error type: {type(e).__name__}")
+        mail_log.error(f"❌ Unexpected error in send_verification_email_mailgun: {e}")
+        return {"success": False, "message": f"Email service error: {str(e)}"}
 
 # ============================================
 # END MAILGUN EMAIL FUNCTIONS
@@ -721,7 +767,7 @@ Push every boundary. Challenge every norm. Create something remarkable.
             "user_message": user_message
         }
 
-def process_reframe_request(client, topic, tone, length):
+def process_reframe_request(llm, topic, tone, length):
     if tone.startswith('reframe_'):
         tone = tone.split('_')[1]
 
@@ -729,7 +775,7 @@ def process_reframe_request(client, topic, tone, length):
     if not template:
         raise ValueError(f"Unsupported tone: {tone}")
 
-    response = client.chat.completions.create(
+    response = llm.complete(
         model="chatgpt-4o-latest",
         messages=[
             {"role": "system", "content": template["system"]},
@@ -740,7 +786,7 @@ def process_reframe_request(client, topic, tone, length):
     )
 
     return {
-        'prompt': response.choices[0].message.content,
+        'prompt': response.text,
         'status': 'success',
         'metadata': {
             'topic': topic,
@@ -810,7 +856,7 @@ def create_explain_prompt(topic, mode):
     }
     return explain_templates.get(mode)
 
-def process_image_variation(client, image_data, mode):
+def process_image_variation(llm, image_data, mode):
     image_templates = {
         "image_caption": {
             "system": "Generate a concise, descriptive caption for this image.",
@@ -827,7 +873,7 @@ def process_image_variation(client, image_data, mode):
         "max_tokens": 50
     })
 
-    response = client.chat.completions.create(
+    response = llm.complete(
         model="chatgpt-4o-latest",
         messages=[
             {"role": "system", "content": template["system"]},
@@ -840,11 +886,12 @@ def process_image_variation(client, image_data, mode):
     )
 
     return {
-        'prompt': response.choices[0].message.content,
+        'prompt': response.text,
         'status': 'success',
         'metadata': {'mode': mode}
     }
 
+@traced('parse')
 def extract_questions_from_text(text):
     """Extract questions from AI response when JSON parsing fails"""
     questions = []
@@ -883,59 +930,9 @@ def extract_questions_from_text(text):
     return questions[:3]
 
 def parse_json_response_enhanced(ai_response):
-    """Enhanced JSON parsing for GPT-4.1's higher quality output"""
-
-    # GPT-4.1 should produce cleaner JSON, but still handle edge cases
-    clean_response = ai_response.strip()
-
-    # Remove markdown code blocks if present
-    if "```json" in clean_response:
-        clean_response = clean_response.split("```json")[1].split("```")[0].strip()
-    elif "```" in clean_response:
-        parts = clean_response.split("```")
-        if len(parts) >= 3:
-            clean_response = parts[1].strip()
-
-    # Find JSON object boundaries
-    start_idx = clean_response.find('{')
-    if start_idx == -1:
-        raise json.JSONDecodeError("No JSON found", clean_response, 0)
-
-    # Find the matching closing brace
-    brace_count = 0
-    end_idx = -1
-    in_string = False
-    escape_next = False
-
-    for i in range(start_idx, len(clean_response)):
-        char = clean_response[i]
-
-        if escape_next:
-            escape_next = False
-            continue
-
-        if char == '\\' and in_string:
-            escape_next = True
-            continue
-
-        if char == '"':
-            in_string = not in_string
-            continue
-
-        if not in_string:
-            if char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i + 1
-                    break
-
-    if end_idx == -1:
-        raise json.JSONDecodeError("Incomplete JSON", clean_response, start_idx)
-
-    json_str = clean_response[start_idx:end_idx]
-    return json.loads(json_str)
+    """Enhanced JSON parsing for GPT-4.1's higher quality output (fences, prose and
+    braces inside strings are handled by the shared extractor)"""
+    return extract_json(ai_response)
 
 def create_gpt41_fallback_prompts_clean(original_text):
     """Create high-quality fallback prompts WITHOUT including the original text"""
@@ -1044,9 +1041,9 @@ Examples of EXCELLENT short topic-aware responses:
 Keep responses SHORT, CONFIDENT, and TOPIC-SPECIFIC. Max 10-12 words."""
 
     try:
-        print(f"🤖 Starting AI analysis for: {input_text[:50]}...")
+        request_log.info(f"🤖 Starting AI analysis for: {input_text[:50]}...")
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1062,31 +1059,20 @@ Keep responses SHORT, CONFIDENT, and TOPIC-SPECIFIC. Max 10-12 words."""
             max_tokens=500
         )
 
-        ai_response = response.choices[0].message.content.strip()
-        print(f"🧠 AI Analysis Response: {ai_response}")
-
-        # Parse the JSON response
-        if "```json" in ai_response:
-            ai_response = ai_response.split("```json")[1].split("```")[0]
-        elif "```" in ai_response:
-            ai_response = ai_response.split("```")[1].split("```")[0]
+        ai_response = response.text.strip()
+        log_payload(payload_log, "🧠 AI analysis response", ai_response, model="chatgpt-4o-latest")
 
-        # Find JSON boundaries
-        start_idx = ai_response.find('{')
-        end_idx = ai_response.rfind('}') + 1
+        # Parse the JSON response (fences and surrounding prose are skipped)
+        analysis_data = find_json(ai_response)
 
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = ai_response[start_idx:end_idx]
-            analysis_data = json.loads(json_str)
+        if analysis_data is not None:
 
-            print(f"✅ Parsed analysis:")
-            print(f"   Intent: {analysis_data.get('intent', 'Unknown')}")
-            print(f"   Topic: {analysis_data.get('topic', 'Unknown')}")
-            print(f"   Topic Category: {analysis_data.get('topic_category', 'Unknown')}")
-            print(f"   Context: {analysis_data.get('context', 'Unknown')}")
-            print(f"   Goal: {analysis_data.get('user_goal', 'Unknown')}")
-            print(f"   Confidence: {analysis_data.get('confidence', 0)}")
-            print(f"   Message: {analysis_data.get('warm_message', 'Default')[:100]}...")
+            request_log.info("✅ Parsed analysis", extra={'fields': {
+                'intent': analysis_data.get('intent', 'Unknown'),
+                'topic': analysis_data.get('topic', 'Unknown'),
+                'topic_category': analysis_data.get('topic_category', 'Unknown'),
+                'confidence': analysis_data.get('confidence', 0),
+            }})
 
             return {
                 'detected_context': analysis_data.get('intent', 'general'),
@@ -1106,11 +1092,12 @@ Keep responses SHORT, CONFIDENT, and TOPIC-SPECIFIC. Max 10-12 words."""
             raise json.JSONDecodeError("No valid JSON found", ai_response, 0)
 
     except Exception as e:
-        print(f"❌ AI analysis failed: {e}")
-        print(f"❌ Raw AI response: {ai_response if 'ai_response' in locals() else 'No response'}")
+        request_log.error(f"❌ AI analysis failed: {e}")
+        if 'ai_response' in locals():
+            log_payload(payload_log, "❌ Raw AI response", ai_response, level=logging.ERROR)
 
-        # Intelligent fallback based on simple analysis
-        return create_intelligent_fallback(input_text, platform)
+        # Intelligent fallback based on simple analysis (flagged so clients and load tests can tell)
+        return dict(create_intelligent_fallback(input_text, platform), fallback=True)
 
 def create_intelligent_fallback(input_text, platform):
     """Create intelligent fallback when AI analysis fails"""
@@ -1165,6 +1152,27 @@ def create_intelligent_fallback(input_text, platform):
         }
 
 # DEBUG ENDPOINTS
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: request and per-phase latency histograms"""
+    return Response(render_metrics() + render_log_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/usage-report', methods=['GET'])
+def usage_report():
+    """Admin endpoint: LLM tokens, latency and cost per mode/model/user (?since=&until=&group_by=&user=)"""
+    # Per-user spend is private - the report only exists once a token is configured
+    if not USAGE_REPORT_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), USAGE_REPORT_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return jsonify(get_usage_meter().report(
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        group_by=request.args.get('group_by', 'mode,model').split(','),
+        user=request.args.get('user'),
+        limit=request.args.get('limit', 200, type=int),
+    ))
+
 @app.route('/debug-routes', methods=['GET'])
 def debug_routes():
     """Debug endpoint to check which routes are loaded"""
@@ -1219,7 +1227,7 @@ def generate():
         # Handle reframe modes
         if mode.startswith('reframe_'):
             tone = mode.split('_')[1]
-            result = process_reframe_request(client, topic, tone, length)
+            result = process_reframe_request(llm, topic, tone, length)
 
             # Add credit info to response
             if credit_result.get('credits_used'):
@@ -1251,7 +1259,7 @@ Domain Meanings & Usage:
 Related:
 [3-4 closely related terms, comma-separated]"""
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model="chatgpt-4o-latest",
                     messages=[
                         {
@@ -1275,7 +1283,7 @@ Related:
 Story:
 [3-4 sentences that naturally explain the concept through a relatable narrative]"""
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model="chatgpt-4o-latest",
                     messages=[
                         {"role": "system", "content": "Create a concise story that explains the concept naturally, without bullet points or sections."},
@@ -1287,7 +1295,7 @@ Story:
 
             elif mode == 'explain_eli5':
                 # ORIGINAL explain_eli5 approach
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model="chatgpt-4o-latest",
                     messages=[
                         {"role": "system", "content": "Explain concepts using simple words, fun analogies, and examples that a 5-year-old would understand. Use short sentences and friendly language."},
@@ -1300,7 +1308,7 @@ Story:
             else:
                 # Fallback for any other explain modes
                 template = create_explain_prompt(topic, mode)
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model="chatgpt-4o-latest",
                     messages=[
                         {"role": "system", "content": template["system"]},
@@ -1310,7 +1318,7 @@ Story:
                 )
 
             result = {
-                'prompt': response.choices[0].message.content,
+                'prompt': response.text,
                 'status': 'success',
                 'metadata': {'mode': mode}
             }
@@ -1433,7 +1441,7 @@ Original Text:
 
 Transform this text into a detailed prompt that leaves no room for ambiguity while maintaining clarity and purpose."""
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model="chatgpt-4o-latest",
                     messages=[
                         {
@@ -1449,7 +1457,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
                 )
 
                 result = {
-                    'prompt': response.choices[0].message.content,
+                    'prompt': response.text,
                     'status': 'success',
                     'metadata': {'mode': mode, 'original_text': topic}
                 }
@@ -1465,7 +1473,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
 
         # Handle image modes
         if mode.startswith('image_'):
-            result = process_image_variation(client, topic, mode)
+            result = process_image_variation(llm, topic, mode)
 
             if credit_result.get('credits_used'):
                 result['credits_used'] = credit_result['credits_used']
@@ -1485,7 +1493,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
 
         # Default processing
         prompt_data = create_enhanced_rewrite(topic, tone, length)
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {"role": "system", "content": prompt_data["system_message"]},
@@ -1495,7 +1503,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success',
             'metadata': {
                 'topic': topic,
@@ -1511,7 +1519,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"Error generating prompt: {str(e)}")
+        request_log.error(f"Error generating prompt: {str(e)}")
         return jsonify({
             'error': 'Failed to generate prompt',
             'details': str(e)
@@ -1569,7 +1577,7 @@ Anomalies & Unique Features: [anything unusual, unexpected, hidden elements, vis
 
 Do not use afterrisks in the output"""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1594,7 +1602,7 @@ Do not use afterrisks in the output"""
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success'
         }
 
@@ -1605,7 +1613,7 @@ Do not use afterrisks in the output"""
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        request_log.error(f"Error: {str(e)}")
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/generate-caption', methods=['POST'])
@@ -1643,7 +1651,7 @@ LinkedIn:
 ---
 #[3-4 relevant professional hashtags]"""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1668,7 +1676,7 @@ LinkedIn:
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success'
         }
 
@@ -1679,7 +1687,7 @@ LinkedIn:
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        request_log.error(f"Error: {str(e)}")
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/explain-meaning', methods=['POST'])
@@ -1715,7 +1723,7 @@ Domain Meanings & Usage:
 Related:
 [3-4 closely related terms, comma-separated]"""
 
-    response = client.chat.completions.create(
+    response = llm.complete(
         model="chatgpt-4o-latest",
         messages=[
             {
@@ -1731,7 +1739,7 @@ Related:
         max_tokens=400
     )
 
-    result = {'explanation': response.choices[0].message.content}
+    result = {'explanation': response.text}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1759,7 +1767,7 @@ def explain_story():
 Story:
 [3-4 sentences that naturally explain the concept through a relatable narrative]"""
 
-    response = client.chat.completions.create(
+    response = llm.complete(
         model="chatgpt-4o-latest",
         messages=[
             {"role": "system", "content": "Create a concise story that explains the concept naturally, without bullet points or sections."},
@@ -1769,7 +1777,7 @@ Story:
         max_tokens=400
     )
 
-    result = {'explanation': response.choices[0].message.content}
+    result = {'explanation': response.text}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1791,7 +1799,7 @@ def explain_eli5():
     text = data.get('text', '').strip()
 
     # ORIGINAL explain_eli5 approach
-    response = client.chat.completions.create(
+    response = llm.complete(
         model="chatgpt-4o-latest",
         messages=[
             {"role": "system", "content": "Explain concepts using simple words, fun analogies, and examples that a 5-year-old would understand. Use short sentences and friendly language."},
@@ -1801,7 +1809,7 @@ def explain_eli5():
         max_tokens=400
     )
 
-    result = {'explanation': response.choices[0].message.content}
+    result = {'explanation': response.text}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1852,7 +1860,7 @@ Original Text:
 
 Enhance this text into a clear, focused prompt that could be given to an AI system."""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1868,7 +1876,7 @@ Enhance this text into a clear, focused prompt that could be given to an AI syst
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success',
             'metadata': {
                 'mode': 'concise',
@@ -1932,7 +1940,7 @@ Original Text:
 
 Transform this text into a balanced prompt that provides clear direction while maintaining essential context."""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1948,7 +1956,7 @@ Transform this text into a balanced prompt that provides clear direction while m
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success',
             'metadata': {
                 'mode': 'balanced',
@@ -2026,7 +2034,7 @@ Original Text:
 
 Transform this text into a detailed prompt that leaves no room for ambiguity while maintaining clarity and purpose."""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -2042,7 +2050,7 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success',
             'metadata': {
                 'mode': 'detailed',
@@ -2158,7 +2166,7 @@ JSON format:
 def smart_followups():
     """Enhanced smart follow-up questions with dynamic generation"""
     try:
-        logging.info("=== Enhanced smart followups request started ===")
+        request_log.info("=== Enhanced smart followups request started ===")
 
         # ADD CREDIT CHECK
         credit_result = optional_credit_check('smart_followups')
@@ -2173,14 +2181,14 @@ def smart_followups():
         conversation = data.get('conversation', '').strip()
         platform = data.get('platform', 'unknown')
 
-        logging.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
+        request_log.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
 
         if not conversation:
             return jsonify({'error': 'Conversation content is required'}), 400
 
         # Get dynamic focus for this conversation
         focus_type = get_focus_for_session(conversation)
-        logging.info(f"Selected focus: {focus_type}")
+        request_log.info(f"Selected focus: {focus_type}")
 
         # Build enhanced prompt with focus and specificity requirements
         analysis_prompt = build_enhanced_prompt(conversation, focus_type)
@@ -2212,21 +2220,21 @@ def smart_followups():
                 model_name = model_config["name"]
                 params = model_config["params"]
 
-                logging.info(f"Trying model: {model_name}")
+                request_log.info(f"Trying model: {model_name}")
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model=model_name,
                     messages=[{"role": "user", "content": analysis_prompt}],
                     **params
                 )
 
                 model_used = model_name
-                logging.info(f"Successfully used model: {model_name}")
+                request_log.info(f"Successfully used model: {model_name}")
                 break
 
             except Exception as e:
                 error_msg = str(e)
-                logging.warning(f"Model {model_name} failed: {error_msg}")
+                request_log.warning(f"Model {model_name} failed: {error_msg}")
                 continue
 
         if not response:
@@ -2236,43 +2244,11 @@ def smart_followups():
             }), 500
 
         # Parse response
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"AI Response length: {len(ai_response)}")
+        ai_response = response.text.strip()
+        request_log.info(f"AI Response length: {len(ai_response)}")
 
         try:
-            # Clean and extract JSON
-            clean_response = ai_response
-
-            # Remove markdown code blocks
-            if "```json" in clean_response:
-                clean_response = clean_response.split("```json")[1].split("```")[0]
-            elif "```" in clean_response:
-                parts = clean_response.split("```")
-                if len(parts) >= 3:
-                    clean_response = parts[1]
-
-            # Find JSON boundaries
-            start_idx = clean_response.find('{')
-            if start_idx == -1:
-                raise json.JSONDecodeError("No JSON found", clean_response, 0)
-
-            # Find matching closing brace
-            brace_count = 0
-            end_idx = -1
-            for i in range(start_idx, len(clean_response)):
-                if clean_response[i] == '{':
-                    brace_count += 1
-                elif clean_response[i] == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        end_idx = i + 1
-                        break
-
-            if end_idx == -1:
-                raise json.JSONDecodeError("Incomplete JSON", clean_response, start_idx)
-
-            json_str = clean_response[start_idx:end_idx]
-            parsed_response = json.loads(json_str)
+            parsed_response = extract_json(ai_response)
 
             # Validate structure
             questions = parsed_response.get('questions', [])
@@ -2312,7 +2288,7 @@ def smart_followups():
             return jsonify(result)
 
         except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
+            request_log.error(f"JSON parsing failed: {str(e)}")
 
             # Enhanced fallback extraction with conversation context
             questions = extract_questions_from_text(ai_response)
@@ -2338,9 +2314,9 @@ def smart_followups():
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Enhanced smart followups error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Enhanced smart followups error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2353,7 +2329,7 @@ def smart_followups():
 def smart_enhancements():
     """Generate smart enhancement suggestions based on selected text"""
     try:
-        logging.info("=== Smart enhancements request started ===")
+        request_log.info("=== Smart enhancements request started ===")
 
         # ADD CREDIT CHECK
         credit_result = optional_credit_check('smart_enhancements')
@@ -2367,7 +2343,7 @@ def smart_enhancements():
         data = request.get_json(force=True)
         selected_text = data.get('text', '').strip()
 
-        logging.info(f"Selected text length: {len(selected_text)}")
+        request_log.info(f"Selected text length: {len(selected_text)}")
 
         if not selected_text:
             return jsonify({'error': 'Selected text is required'}), 400
@@ -2459,9 +2435,9 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
                 model_name = model_config["name"]
                 params = model_config["params"]
 
-                logging.info(f"Attempting smart enhancements with {model_name}")
+                request_log.info(f"Attempting smart enhancements with {model_name}")
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model=model_name,
                     messages=[
                         {
@@ -2477,12 +2453,12 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
                 )
 
                 model_used = model_name
-                logging.info(f"✅ Smart enhancements successful with {model_name}")
+                request_log.info(f"✅ Smart enhancements successful with {model_name}")
                 break
 
             except Exception as e:
                 error_msg = str(e)
-                logging.warning(f"❌ {model_name} failed: {error_msg}")
+                request_log.warning(f"❌ {model_name} failed: {error_msg}")
                 continue
 
         if not response:
@@ -2492,8 +2468,8 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
             }), 500
 
         # Enhanced response processing
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"Generated {len(ai_response)} chars with {model_used}")
+        ai_response = response.text.strip()
+        request_log.info(f"Generated {len(ai_response)} chars with {model_used}")
 
         try:
             # Parse JSON with enhanced quality
@@ -2535,7 +2511,7 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
             return jsonify(result)
 
         except Exception as e:
-            logging.error(f"Response processing failed: {str(e)}")
+            request_log.error(f"Response processing failed: {str(e)}")
 
             # Create premium fallback prompts WITHOUT original text
             fallback_prompts = create_gpt41_fallback_prompts_clean(selected_text)
@@ -2558,9 +2534,9 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Smart enhancements error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Smart enhancements error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2620,6 +2596,7 @@ JSON format:
     "analysis": "Brief explanation of how these prompts help take action on the conversation"
 }}"""
 
+@traced('parse')
 def extract_action_prompts_from_text(text, conversation=""):
     """Fallback extraction for action prompts when JSON parsing fails"""
     prompts = []
@@ -2661,7 +2638,7 @@ def extract_action_prompts_from_text(text, conversation=""):
 def smart_actions():
     """Generate smart action-oriented follow-up prompts based on conversation context"""
     try:
-        logging.info("=== Smart actions request started ===")
+        request_log.info("=== Smart actions request started ===")
 
         # ADD CREDIT CHECK
         credit_result = optional_credit_check('smart_actions')
@@ -2676,7 +2653,7 @@ def smart_actions():
         conversation = data.get('conversation', '').strip()
         platform = data.get('platform', 'unknown')
 
-        logging.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
+        request_log.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
 
         if not conversation:
             return jsonify({'error': 'Conversation content is required'}), 400
@@ -2711,21 +2688,21 @@ def smart_actions():
                 model_name = model_config["name"]
                 params = model_config["params"]
 
-                logging.info(f"Trying model: {model_name}")
+                request_log.info(f"Trying model: {model_name}")
 
-                response = client.chat.completions.create(
+                response = llm.complete(
                     model=model_name,
                     messages=[{"role": "user", "content": action_prompt}],
                     **params
                 )
 
                 model_used = model_name
-                logging.info(f"Successfully used model: {model_name}")
+                request_log.info(f"Successfully used model: {model_name}")
                 break
 
             except Exception as e:
                 error_msg = str(e)
-                logging.warning(f"Model {model_name} failed: {error_msg}")
+                request_log.warning(f"Model {model_name} failed: {error_msg}")
                 continue
 
         if not response:
@@ -2735,8 +2712,8 @@ def smart_actions():
             }), 500
 
         # Parse response
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"AI Response length: {len(ai_response)}")
+        ai_response = response.text.strip()
+        request_log.info(f"AI Response length: {len(ai_response)}")
 
         try:
             # Parse JSON response
@@ -2778,7 +2755,7 @@ def smart_actions():
             return jsonify(result)
 
         except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
+            request_log.error(f"JSON parsing failed: {str(e)}")
 
             # Fallback extraction
             action_prompts = extract_action_prompts_from_text(ai_response, conversation)
@@ -2802,9 +2779,9 @@ def smart_actions():
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Smart actions error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Smart actions error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2856,7 +2833,7 @@ Please provide a JSON response with the following structure:
 Focus on being specific and practical. If the role includes level indicators (senior, junior, lead, etc.), reflect that in experience_level and adjust skills accordingly."""
 
     try:
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -2872,7 +2849,7 @@ Focus on being specific and practical. If the role includes level indicators (se
             max_tokens=1000
         )
 
-        ai_response = response.choices[0].message.content.strip()
+        ai_response = response.text.strip()
 
         # Clean the response - remove markdown code blocks if present
         if "```json" in ai_response:
@@ -2885,12 +2862,12 @@ Focus on being specific and practical. If the role includes level indicators (se
             analysis_data = json.loads(ai_response)
             return analysis_data
         except json.JSONDecodeError as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
-            logging.error(f"AI Response: {ai_response}")
+            request_log.error(f"JSON parsing failed: {str(e)}")
+            log_payload(payload_log, "AI analysis response", ai_response, level=logging.ERROR)
             return None
 
     except Exception as e:
-        logging.error(f"AI analysis failed: {str(e)}")
+        request_log.error(f"AI analysis failed: {str(e)}")
         return None
 
 def build_persona_from_ai_analysis(analysis_data, keyword):
@@ -3005,7 +2982,7 @@ def create_dynamic_persona_template(context):
     """Main function to create AI-powered dynamic persona"""
     keyword = context['keyword']
 
-    logging.info(f"Generating AI-powered persona for: {keyword}")
+    request_log.info(f"Generating AI-powered persona for: {keyword}")
 
     # Get AI analysis of the role
     analysis_data = generate_ai_persona_analysis(keyword)
@@ -3105,12 +3082,12 @@ def generate_persona():
         if not keyword:
             return jsonify({'error': 'Keyword is required'}), 400
 
-        logging.info(f"=== AI Persona Generation Started ===")
-        logging.info(f"Input keyword: {keyword}")
+        request_log.info(f"=== AI Persona Generation Started ===")
+        request_log.info(f"Input keyword: {keyword}")
 
         # Detect basic context (keeping existing function for metadata)
         context = detect_domain_context(keyword)
-        logging.info(f"Detected domain: {context['domain']}, tone: {context['tone']}")
+        request_log.info(f"Detected domain: {context['domain']}, tone: {context['tone']}")
 
         # Generate AI-powered persona
         persona_template = create_dynamic_persona_template(context)
@@ -3118,7 +3095,7 @@ def generate_persona():
         if not persona_template:
             raise Exception("Failed to generate persona template")
 
-        logging.info(f"=== AI Persona Generation Completed ===")
+        request_log.info(f"=== AI Persona Generation Completed ===")
 
         result = {
             'prompt': persona_template,
@@ -3139,9 +3116,9 @@ def generate_persona():
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"=== AI Persona Generation Failed ===")
-        logging.error(f"Error: {str(e)}")
-        logging.error(f"Error type: {type(e).__name__}")
+        request_log.error(f"=== AI Persona Generation Failed ===")
+        request_log.error(f"Error: {str(e)}")
+        request_log.error(f"Error type: {type(e).__name__}")
 
         return jsonify({
             'error': 'Failed to generate AI-powered persona',
@@ -3188,12 +3165,21 @@ def send_verification_email():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
 
-        print(f"📧 Sending verification email to: {email}")
+        mail_log.info(f"📧 Sending verification email to: {email}")
 
         # Send via Mailgun
         result = send_verification_email_mailgun(email, first_name)
 
-        if result["success"]:
+        if result.get("queued"):
+            # Accepted - the email workers deliver it (poll /verification-email-status)
+            return jsonify({
+                'success': True,
+                'message': 'Verification email queued',
+                'provider': 'mailgun',
+                'delivered_via': 'Mailgun (95%+ inbox rate)',
+                'job_id': result["job_id"]
+            }), 202
+        elif result["success"]:
             return jsonify({
                 'success': True,
                 'message': 'Verification email sent successfully',
@@ -3209,12 +3195,26 @@ def send_verification_email():
             }), 500
 
     except Exception as e:
-        print(f"❌ Send verification error: {e}")
+        mail_log.error(f"❌ Send verification error: {e}")
         return jsonify({
             'error': 'Failed to send verification email',
             'details': str(e)
         }), 500
 
+@app.route('/verification-email-status', methods=['GET'])
+def verification_email_status():
+    """Delivery state of a queued verification email (?job_id= from the 202 response)"""
+    job_id = request.args.get('job_id', '').strip()
+    if not job_id:
+        return jsonify({'error': 'job_id is required'}), 400
+
+    status = get_email_queue(mailgun).status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job_id'}), 404
+    if status['status'] == 'failed':
+        status['use_firebase_fallback'] = True
+    return jsonify(status)
+
 @app.route('/verify-email', methods=['GET'])
 def verify_email():
     """Verify email using token and update Firebase user"""
@@ -3231,11 +3231,11 @@ def verify_email():
             </body></html>
             """
 
-        print(f"🔐 Verifying email: {email}")
+        mail_log.info(f"🔐 Verifying email: {email}")
 
         # Verify token
         if not verify_token_v2(email, token):
-            print(f"❌ Invalid or expired token for {email}")
+            mail_log.warning(f"❌ Invalid or expired token for {email}")
             return f"""
             <html><body style="font-family: Arial; text-align: center; padding: 50px;">
             <h1 style="color: red;">❌ Verification Link Expired</h1>
@@ -3256,7 +3256,7 @@ def verify_email():
                     email_verified=True
                 )
 
-                print(f"✅ Email verified for user: {email}")
+                mail_log.info(f"✅ Email verified for user: {email}")
 
                 # Success page
                 return f"""
@@ -3278,7 +3278,7 @@ def verify_email():
                 """
 
             except auth.UserNotFoundError:
-                print(f"❌ User not found: {email}")
+                mail_log.warning(f"❌ User not found: {email}")
                 return f"""
                 <html><body style="font-family: Arial; text-align: center; padding: 50px;">
                 <h1 style="color: red;">❌ User Not Found</h1>
@@ -3287,7 +3287,7 @@ def verify_email():
                 </body></html>
                 """
             except Exception as firebase_error:
-                print(f"❌ Firebase error: {firebase_error}")
+                mail_log.error(f"❌ Firebase error: {firebase_error}")
                 return f"""
                 <html><body style="font-family: Arial; text-align: center; padding: 50px;">
                 <h1 style="color: red;">❌ Verification Error</h1>
@@ -3305,7 +3305,7 @@ def verify_email():
             """
 
     except Exception as e:
-        print(f"❌ Verification error: {e}")
+        mail_log.error(f"❌ Verification error: {e}")
         return f"""
         <html><body style="font-family: Arial; text-align: center; padding: 50px;">
         <h1 style="color: red;">❌ Server Error</h1>
@@ -3334,7 +3334,7 @@ def analyze_context():
         if not input_text:
             return jsonify({'error': 'Input text is required'}), 400
 
-        print(f"🤖 Analyzing context for: {input_text[:50]}...")
+        request_log.info(f"🤖 Analyzing context for: {input_text[:50]}...")
 
         # Analyze the user's input context
         analysis_result = analyze_user_context_with_ai(input_text, platform)
@@ -3347,16 +3347,18 @@ def analyze_context():
             'platform': platform,
             'analysis_timestamp': timestamp
         }
+        if analysis_result.get('fallback'):
+            result['fallback'] = True
 
         if credit_result.get('credits_used'):
             result['credits_used'] = credit_result['credits_used']
             result['credits_remaining'] = credit_result.get('remaining')
 
-        print(f"✅ Context analysis complete: {analysis_result['detected_context']}")
+        request_log.info(f"✅ Context analysis complete: {analysis_result['detected_context']}")
         return jsonify(result)
 
     except Exception as e:
-        print(f"❌ Context analysis error: {e}")
+        request_log.error(f"❌ Context analysis error: {e}")
         return jsonify({
             'error': 'Failed to analyze context',
             'details': str(e)
@@ -3382,11 +3384,13 @@ def synthesize_conversation():
         if not inputs or len(inputs) < 2:
             return jsonify({'error': 'At least 2 inputs required for synthesis'}), 400
 
-        print(f"🔄 Synthesizing {len(inputs)} inputs for session: {session_id}")
+        request_log.info(f"🔄 Synthesizing {len(inputs)} inputs for session: {session_id}")
 
         # Build synthesis prompt
         input_texts = [inp.get('text', '') for inp in inputs]
-        conversation_flow = '\n'.join([f"Input {i+1}: {text}" for i, text in enumerate(input_texts)])
+        input_lines = [f"Input {i+1}: {text}" for i, text in enumerate(input_texts)]
+        # First input plus the most recent ones that fit the token budget
+        conversation_flow = '\n'.join(trim_turns(input_lines, SYNTHESIS_INPUT_TOKENS, separator='\n'))
 
         synthesis_prompt = f"""You are an expert prompt engineer creating "practical magic" - prompts that give users helpful details they wouldn't think of, without overwhelming them.
 
@@ -3440,7 +3444,7 @@ Take their basic request and make it more detailed and effective while keeping t
 
 Enhanced continuation prompt:"""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -3456,7 +3460,7 @@ Enhanced continuation prompt:"""
             max_tokens=800
         )
 
-        synthesized_prompt = response.choices[0].message.content.strip()
+        synthesized_prompt = response.text.strip()
 
         # Clean up the response - remove any meta text
         if synthesized_prompt.startswith("Optimized continuation prompt:"):
@@ -3477,11 +3481,11 @@ Enhanced continuation prompt:"""
             result['credits_used'] = credit_result['credits_used']
             result['credits_remaining'] = credit_result.get('remaining')
 
-        print(f"✅ Synthesis complete for session: {session_id}")
+        request_log.info(f"✅ Synthesis complete for session: {session_id}")
         return jsonify(result)
 
     except Exception as e:
-        print(f"❌ Synthesis error: {e}")
+        request_log.error(f"❌ Synthesis error: {e}")
         return jsonify({
             'error': 'Failed to synthesize conversation',
             'details': str(e)
@@ -3506,7 +3510,7 @@ def analyze_intervention():
         if not inputs or len(inputs) < 2:
             return jsonify({'error': 'At least 2 inputs required for intervention analysis'}), 400
 
-        print(f"🔍 Analyzing intervention for {len(inputs)} inputs...")
+        request_log.info(f"🔍 Analyzing intervention for {len(inputs)} inputs...")
 
         # Get the last 2-3 inputs for better context
         recent_inputs = inputs[-3:] if len(inputs) >= 3 else inputs[-2:]
@@ -3546,7 +3550,7 @@ JSON Format:
 
 Keep the intervention_message under 12 words and make it specific to their actual requests."""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -3562,21 +3566,12 @@ Keep the intervention_message under 12 words and make it specific to their actua
             max_tokens=300
         )
 
-        ai_response = response.choices[0].message.content.strip()
+        ai_response = response.text.strip()
 
-        # Clean and parse JSON response
-        if "```json" in ai_response:
-            ai_response = ai_response.split("```json")[1].split("```")[0]
-        elif "```" in ai_response:
-            ai_response = ai_response.split("```")[1].split("```")[0]
+        # Parse the JSON response (fences and surrounding prose are skipped)
+        analysis_data = find_json(ai_response)
 
-        # Find JSON boundaries
-        start_idx = ai_response.find('{')
-        end_idx = ai_response.rfind('}') + 1
-
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = ai_response[start_idx:end_idx]
-            analysis_data = json.loads(json_str)
+        if analysis_data is not None:
 
             result = {
                 'success': True,
@@ -3592,7 +3587,7 @@ Keep the intervention_message under 12 words and make it specific to their actua
                 result['credits_used'] = credit_result['credits_used']
                 result['credits_remaining'] = credit_result.get('remaining')
 
-            print(f"✅ Intervention analysis complete: {result['intervention_message']}")
+            request_log.info(f"✅ Intervention analysis complete: {result['intervention_message']}")
             return jsonify(result)
 
         else:
@@ -3614,7 +3609,7 @@ Keep the intervention_message under 12 words and make it specific to their actua
             return jsonify(result)
 
     except Exception as e:
-        print(f"❌ Intervention analysis error: {e}")
+        request_log.error(f"❌ Intervention analysis error: {e}")
         return jsonify({
             'error': 'Failed to analyze intervention',
             'details': str(e)
@@ -3639,7 +3634,7 @@ def analyze_motivation():
         if not inputs or len(inputs) < 5:
             return jsonify({'error': 'Need at least 5 inputs for motivational analysis'}), 400
 
-        print(f"💪 Analyzing motivation for {len(inputs)} inputs...")
+        request_log.info(f"💪 Analyzing motivation for {len(inputs)} inputs...")
 
         # Get the user's journey context
         input_texts = [inp.get('text', '') for inp in inputs]
@@ -3673,7 +3668,7 @@ JSON Format:
 
 Keep the motivational_message under 15 words and make it specific to their actual work."""
 
-        response = client.chat.completions.create(
+        response = llm.complete(
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -3689,21 +3684,12 @@ Keep the motivational_message under 15 words and make it specific to their actua
             max_tokens=300
         )
 
-        ai_response = response.choices[0].message.content.strip()
-
-        # Clean and parse JSON response
-        if "```json" in ai_response:
-            ai_response = ai_response.split("```json")[1].split("```")[0]
-        elif "```" in ai_response:
-            ai_response = ai_response.split("```")[1].split("```")[0]
+        ai_response = response.text.strip()
 
-        # Find JSON boundaries
-        start_idx = ai_response.find('{')
-        end_idx = ai_response.rfind('}') + 1
+        # Parse the JSON response (fences and surrounding prose are skipped)
+        analysis_data = find_json(ai_response)
 
-        if start_idx != -1 and end_idx > start_idx:
-            json_str = ai_response[start_idx:end_idx]
-            analysis_data = json.loads(json_str)
+        if analysis_data is not None:
 
             result = {
                 'success': True,
@@ -3719,7 +3705,7 @@ Keep the motivational_message under 15 words and make it specific to their actua
                 result['credits_used'] = credit_result['credits_used']
                 result['credits_remaining'] = credit_result.get('remaining')
 
-            print(f"✅ Motivational analysis complete: {result['motivational_message']}")
+            request_log.info(f"✅ Motivational analysis complete: {result['motivational_message']}")
             return jsonify(result)
 
         else:
@@ -3741,7 +3727,7 @@ Keep the motivational_message under 15 words and make it specific to their actua
             return jsonify(result)
 
     except Exception as e:
-        print(f"❌ Motivational analysis error: {e}")
+        request_log.error(f"❌ Motivational analysis error: {e}")
         return jsonify({
             'error': 'Failed to analyze motivation',
             'details': str(e)
@@ -3758,12 +3744,18 @@ def resend_verification():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
 
-        print(f"🔄 Resending verification email to: {email}")
+        mail_log.info(f"🔄 Resending verification email to: {email}")
 
         # Send verification email
         result = send_verification_email_mailgun(email, first_name)
 
-        if result["success"]:
+        if result.get("queued"):
+            return jsonify({
+                'success': True,
+                'message': 'Verification email queued',
+                'job_id': result["job_id"]
+            }), 202
+        elif result["success"]:
             return jsonify({
                 'success': True,
                 'message': 'Verification email resent successfully'
@@ -3776,14 +3768,15 @@ def resend_verification():
             }), 500
 
     except Exception as e:
-        print(f"❌ Resend verification error: {e}")
+        mail_log.error(f"❌ Resend verification error: {e}")
         return jsonify({
             'error': 'Failed to resend verification email',
             'details': str(e)
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Local development only - production runs through serve.py (or PythonAnywhere's WSGI)
+    app.run(debug=os.getenv('FLASK_DEBUG', 'false').lower() in ('true', '1', 'yes'))
 
 # Set application variable for PythonAnywhere
 application = app
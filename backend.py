@@ -1,11 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from openai import OpenAI
 import logging
 import os
 import json
 import requests  # ADD THIS LINE
 import hashlib
+import hmac
 import base64
 import json
 
@@ -28,9 +28,78 @@ CORS(app,
 
 # REMOVED: @app.after_request and @app.before_request functions (were causing duplicate headers)
 
-logging.basicConfig(level=logging.INFO)
+# LOGGING (queued, structured, sampled per category - see structured_logging.py)
+from structured_logging import get_logger, log_payload, render_log_metrics, setup_logging
+setup_logging()
+request_log = get_logger('request')
+payload_log = get_logger('payload')
+auth_log = get_logger('auth')
+credits_log = get_logger('credits')
+mail_log = get_logger('mailgun')
+
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+# TRACING (per-phase spans, GET /metrics and OTLP export - see tracing.py)
+from tracing import annotate_request, finish_request, render_metrics, start_request, tag_response, traced
+
+# Registered before the credit hooks, so settling runs inside the request span
+@app.before_request
+def start_request_span():
+    if request.method != 'OPTIONS' and request.endpoint != 'metrics':
+        g.request_span = start_request(request.endpoint or 'unmatched', request.headers.get('traceparent'), **{
+            'http.request.method': request.method,
+            'http.route': request.url_rule.rule if request.url_rule else request.path,
+        })
+
+@app.after_request
+def tag_request_span(response):
+    root = g.get('request_span')
+    if root is not None and tag_response(root, response):
+        g.pop('request_span')  # the stream finishes it after its last event
+    return response
+
+@app.teardown_request
+def finish_request_span(exc):
+    finish_request(g.pop('request_span', None), exc)
+
+# SHARED LLM GATEWAY (pooled async client - see llm_gateway.py)
+from llm_gateway import LLMResult, get_gateway
+from circuit_breaker import CircuitOpenError
+from model_policy import HedgePolicy
+llm = get_gateway()
+
+# EXACT-MATCH RESPONSE CACHE (reframe/explain/convert - see response_cache.py)
+from response_cache import get_response_cache, make_cache_key
+response_cache = get_response_cache()
+
+# STRUCTURED OUTPUT PARSING (see json_stream.py)
+from json_stream import JSONStreamParser
+
+# STRUCTURED OUTPUTS (per-endpoint JSON schemas - see output_schemas.py)
+from output_schemas import ACTIONS_SCHEMA, ENHANCEMENTS_SCHEMA, FOLLOWUPS_SCHEMA, structured_models
+
+# SEMANTIC CACHE (smart-followups / smart-actions - see semantic_cache.py)
+from semantic_cache import get_semantic_cache
+semantic_cache = get_semantic_cache()
+
+# MODE REGISTRY (entries are registered further down, once handlers exist)
+from mode_registry import ModeRegistry, CACHE_EXACT, CACHE_SEMANTIC
+
+# PROMPT TEMPLATES (static prefix first, request text last - see prompt_templates.py)
+from prompt_templates import TemplateRegistry
+PROMPTS = TemplateRegistry()
+
+# TOKEN BUDGETS (per-mode prompt_tokens in MODES - see token_budget.py)
+from token_budget import count_tokens, trim_conversation, trim_middle, user_budget
+
+@traced('prompt')
+def fit_to_budget(mode, text, template=None, trim=trim_middle, reserved=0):
+    """Trim request text to what the mode's prompt_tokens leave after its template"""
+    entry = MODES.resolve(mode)
+    if entry is None or not entry.prompt_tokens:
+        return text
+    template = template or PROMPTS[mode]
+    return trim(text, user_budget(template, entry.prompt_tokens, reserved))
 
 # MAILGUN CONFIGURATION - ADD THIS ENTIRE SECTION
 MAILGUN_API_KEY = os.getenv('MAILGUN_API_KEY', '')
@@ -39,8 +108,12 @@ MAILGUN_BASE_URL = os.getenv('MAILGUN_BASE_URL', 'https://api.mailgun.net/v3')
 FRONTEND_BASE_URL = os.getenv('FRONTEND_BASE_URL', 'https://solthron.com')
 VERIFICATION_BASE_URL = os.getenv('VERIFICATION_BASE_URL', 'https://afaque.pythonanywhere.com')
 
-print(f"🔑 Mailgun API key loaded: {'✅' if MAILGUN_API_KEY else '❌'}")
-print(f"🌐 Mailgun domain: {MAILGUN_DOMAIN}")
+mail_log.info(f"🔑 Mailgun API key loaded: {'✅' if MAILGUN_API_KEY else '❌'}")
+mail_log.info(f"🌐 Mailgun domain: {MAILGUN_DOMAIN}")
+
+# Sends go through a background worker pool with a pooled session (see email_queue.py)
+from email_queue import EMAIL_QUEUE_ENABLED, MailgunClient, get_email_queue
+mailgun = MailgunClient(MAILGUN_API_KEY, MAILGUN_DOMAIN, MAILGUN_BASE_URL)
 
 # FIREBASE ADMIN SDK INITIALIZATION
 try:
@@ -49,91 +122,92 @@ try:
     firebase_admin.initialize_app(cred)
     db = firestore.client()
     FIREBASE_ENABLED = True
-    print("✅ Firebase Admin SDK initialized successfully")
+    logging.info("✅ Firebase Admin SDK initialized successfully")
 
 except Exception as e:
-    print(f"❌ Firebase initialization failed: {e}")
+    logging.error(f"❌ Firebase initialization failed: {e}")
     FIREBASE_ENABLED = False
 
-# CREDIT MAPPING FUNCTION (matches your extension logic exactly)
-def get_feature_credits(mode):
-    """Map features to credit costs - matches extension logic exactly"""
+# USAGE ACCOUNTING (tokens and cost per request/user/mode/model - see usage_meter.py)
+from usage_meter import USAGE_REPORT_TOKEN, attribute_usage, begin_usage, get_usage_meter, record_credits
 
-    # Text Processing: 6 credits
-    text_processing_modes = [
-        'reframe_casual', 'reframe_technical', 'reframe_professional',
-        'reframe_eli5', 'reframe_short', 'reframe_long'
-    ]
+if FIREBASE_ENABLED:
+    get_usage_meter().attach_firestore(db)
 
-    # Convert Prompts: 8 credits
-    convert_prompt_modes = [
-        'convert_concise', 'convert_balanced', 'convert_detailed'
-    ]
+@app.before_request
+def begin_request_usage():
+    if request.method != 'OPTIONS':
+        begin_usage(request.endpoint or 'unmatched')
 
-    # Persona AI Generator: 10 credits
-    persona_modes = ['persona_generator']
-
-    # Image Processing: 12 credits
-    image_modes = ['image_prompt', 'image_caption']
-
-    # Explain: 5 credits
-    explain_modes = ['explain_meaning', 'explain_story', 'explain_eli5']
-
-    # AI Assistant: 15 credits
-    ai_assistant_modes = ['smart_followups', 'smart_actions', 'smart_enhancements']
-
-    # Free Features: 0 credits
-    free_modes = ['save_note', 'save_prompt', 'save_persona']
-
-    # Determine credit cost based on mode
-    if mode in text_processing_modes:
-        return 6
-    elif mode in convert_prompt_modes:
-        return 8
-    elif mode in persona_modes:
-        return 10
-    elif mode in image_modes:
-        return 12
-    elif mode in explain_modes:
-        return 5
-    elif mode in ai_assistant_modes:
-        return 15
-    elif mode in free_modes:
-        return 0
-    else:
-        return 6  # Default fallback
+# CREDIT MAPPING FUNCTION (matches your extension logic exactly)
+def get_feature_credits(mode):
+    """Map features to credit costs - matches extension logic exactly (see MODES)"""
+    return MODES.credits(mode)
 
 # AUTHENTICATION HELPER FUNCTIONS
-def verify_auth_token(token):
-    """Verify JWT token and return user info"""
+from auth_cache import token_cache, profile_cache
+from credit_ledger import CREDIT_LEDGER_ENABLED, get_credit_ledger
+
+@traced('auth')
+def verify_auth_token(token, fresh=False):
+    """Verify JWT token and return user info (cached - see auth_cache.py)"""
     if not FIREBASE_ENABLED:
         return None
 
     try:
-        # Decode JWT token
-        payload = jwt.decode(token, options={"verify_signature": False})
-        user_id = payload.get('uid') or payload.get('user_id')
+        user_id = token_cache.get(token)
 
         if not user_id:
-            return None
+            # Decode JWT token
+            payload = jwt.decode(token, options={"verify_signature": False})
+            user_id = payload.get('uid') or payload.get('user_id')
 
-        # Get user from Firebase
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+            if not user_id:
+                return None
 
-        if user_doc.exists:
-            return {
-                'uid': user_id,
-                'data': user_doc.to_dict()
-            }
-        return None
+            token_cache.set(token, user_id, payload.get('exp'))
+
+        user_data = None if fresh else profile_cache.get(user_id)
+
+        if user_data is None:
+            # Get user from Firebase
+            user_ref = db.collection('users').document(user_id)
+            user_doc = user_ref.get()
+
+            if not user_doc.exists:
+                profile_cache.invalidate(user_id)
+                return None
+
+            user_data = user_doc.to_dict()
+            profile_cache.set(user_id, user_data)
+
+        return {
+            'uid': user_id,
+            'data': user_data
+        }
 
     except Exception as e:
-        print(f"Token verification failed: {e}")
+        auth_log.warning(f"Token verification failed: {e}")
         return None
 
-def check_and_deduct_credits(user_uid, feature_mode):
-    """Check if user has enough credits and deduct them"""
+def request_user_id():
+    """uid named by the request's bearer token, without a Firestore read (scopes per-user caches)"""
+    auth_header = request.headers.get('Authorization')
+    if not FIREBASE_ENABLED or not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    token = auth_header[7:]
+    user_id = token_cache.get(token)
+    if not user_id:
+        try:
+            payload = jwt.decode(token, options={"verify_signature": False})
+        except jwt.PyJWTError:
+            return None
+        user_id = payload.get('uid') or payload.get('user_id')
+    return user_id
+
+@traced('credits')
+def reserve_credits(user_uid, feature_mode, known_balance=None):
+    """Check if user has enough credits and hold them until commit/release"""
     if not FIREBASE_ENABLED:
         return {'success': True, 'message': 'Firebase disabled - allowing free usage'}
 
@@ -144,6 +218,15 @@ def check_and_deduct_credits(user_uid, feature_mode):
         if required_credits == 0:
             return {'success': True, 'credits_used': 0}
 
+        # Reserve locally and settle with Firestore in the background (see credit_ledger.py)
+        if CREDIT_LEDGER_ENABLED:
+            result = get_credit_ledger(db).reserve(user_uid, feature_mode, required_credits, known_balance)
+            if result.get('success'):
+                profile_cache.update_credits(user_uid, result['remaining'])
+            else:
+                profile_cache.invalidate(user_uid)
+            return result
+
         # Get user document
         user_ref = db.collection('users').document(user_uid)
 
@@ -172,7 +255,7 @@ def check_and_deduct_credits(user_uid, feature_mode):
                 'lastUpdated': firestore.SERVER_TIMESTAMP
             })
 
-            # Log transaction
+            # Log transaction (its id lets release_credits refund it)
             transaction_ref = db.collection('transactions').document()
             transaction.set(transaction_ref, {
                 'userId': user_uid,
@@ -185,20 +268,74 @@ def check_and_deduct_credits(user_uid, feature_mode):
             return {
                 'success': True,
                 'credits_used': required_credits,
-                'remaining': new_credits
+                'remaining': new_credits,
+                'transaction_id': transaction_ref.id
             }
 
         # Execute transaction
         transaction = db.transaction()
         result = update_credits(transaction)
+
+        # Keep the cached profile in step with the committed balance
+        if result.get('success'):
+            profile_cache.update_credits(user_uid, result['remaining'])
+        else:
+            profile_cache.invalidate(user_uid)
+
         return result
 
     except Exception as e:
-        print(f"Credit deduction error: {e}")
+        credits_log.error(f"Credit deduction error: {e}")
+        profile_cache.invalidate(user_uid)
         return {'success': False, 'message': str(e)}
 
+@traced('settle')
+def commit_credits(credit_result, user_uid=None):
+    """Charge a reservation once the request has succeeded"""
+    reservation_id = credit_result.pop('reservation_id', None)
+    if reservation_id and CREDIT_LEDGER_ENABLED:
+        # Just a local status flip - the Firestore write rides the next ledger batch
+        get_credit_ledger(db).commit(reservation_id)
+    credit_result.pop('transaction_id', None)
+    record_credits(credit_result.get('credits_used'), user_uid)
+
+@traced('settle')
+def release_credits(credit_result, user_uid=None):
+    """Refund a reservation because the request failed"""
+    try:
+        if credit_result.get('reservation_id') and CREDIT_LEDGER_ENABLED:
+            get_credit_ledger(db).release(credit_result.pop('reservation_id'))
+        elif credit_result.get('transaction_id'):
+            # Transactional path already charged Firestore - refund in one batched write
+            amount = credit_result.get('credits_used', 0)
+            batch = db.batch()
+            batch.update(db.collection('users').document(user_uid), {
+                'credits': firestore.Increment(amount),
+                'lastUpdated': firestore.SERVER_TIMESTAMP
+            })
+            batch.update(db.collection('transactions').document(credit_result.pop('transaction_id')), {
+                'refunded': True,
+                'refundedAt': firestore.SERVER_TIMESTAMP
+            })
+            batch.commit()
+        else:
+            return
+        if user_uid:
+            profile_cache.invalidate(user_uid)
+    except Exception as e:
+        credits_log.error(f"Credit release error: {e}")
+
+def check_and_deduct_credits(user_uid, feature_mode, known_balance=None):
+    """Check if user has enough credits and deduct them"""
+    result = reserve_credits(user_uid, feature_mode, known_balance)
+    if result.get('success'):
+        commit_credits(result, user_uid)
+    return result
+
 def optional_credit_check(feature_mode):
     """Optional credit check that doesn't break existing functionality"""
+    annotate_request(mode=feature_mode)
+    attribute_usage(mode=feature_mode)
     try:
         # Check if user sent auth token
         auth_header = request.headers.get('Authorization')
@@ -213,16 +350,240 @@ def optional_credit_check(feature_mode):
 
         if not user_info:
             return {'success': True, 'message': 'Invalid token - allowing free usage'}
+        attribute_usage(user=user_info['uid'])
 
-        # Check and deduct credits
-        result = check_and_deduct_credits(user_info['uid'], feature_mode)
+        # Reserve credits; settle_request_credits charges or refunds them when the request ends
+        result = reserve_credits(user_info['uid'], feature_mode,
+                                 known_balance=user_info['data'].get('credits'))
+        if result.get('success'):
+            g.pending_credits = (user_info['uid'], result)
         return result
 
     except Exception as e:
         # On any error, allow free usage (safety fallback)
-        print(f"Credit check error: {e}")
+        credits_log.error(f"Credit check error: {e}")
         return {'success': True, 'message': 'Credit check failed - allowing free usage'}
 
+def settle_credits(pending, success):
+    """Commit (success) or release a (user_uid, credit_result) reservation"""
+    if pending is None:
+        return
+    user_uid, credit_result = pending
+    if success:
+        commit_credits(credit_result, user_uid)
+    else:
+        release_credits(credit_result, user_uid)
+
+def settle_request_credits(success):
+    """Settle the reservation optional_credit_check made for this request"""
+    if g.get('stream_settles_credits'):
+        return
+    settle_credits(g.pop('pending_credits', None), success)
+
+def waive_credits():
+    """Release this request's reservation even if it answers 200 (locally generated stand-in content)"""
+    g.credits_waived = True
+
+@app.after_request
+def settle_credits_after_request(response):
+    # Streams settle their own reservation (see stream_completion)
+    settle_request_credits(response.status_code < 400 and not g.get('credits_waived'))
+    return response
+
+@app.teardown_request
+def release_unsettled_credits(exc):
+    # Anything still pending here failed or was abandoned (client disconnect mid-stream)
+    settle_request_credits(False)
+
+def add_credit_info(result, credit_result):
+    """Attach credits used/remaining to a response payload"""
+    if credit_result.get('credits_used'):
+        result['credits_used'] = credit_result['credits_used']
+        result['credits_remaining'] = credit_result.get('remaining')
+    return result
+
+# ============================================
+# STREAMING (SSE) HELPERS
+# ============================================
+
+def wants_stream(data):
+    """Opt-in streaming: {"stream": true} in the body or ?stream=true"""
+    flag = data.get('stream', request.args.get('stream', False))
+    return flag is True or str(flag).lower() in ('true', '1', 'yes')
+
+def sse_event(event, payload):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_completion(completion, build_result, credit_result, cache_key=None, mode=None, text='', items=None):
+    """Relay completion tokens as SSE 'token' events.
+
+    The final 'done' event carries the same JSON body the non-streaming
+    endpoint returns (built by build_result from the full text), including
+    credit info. Failures after the first byte arrive as an 'error' event.
+    Reserved credits are committed with 'done' and released on 'error'.
+    With a cache_key, a cached response is sent as a single token event.
+    With a mode, max_tokens is sized from the mode's observed output lengths.
+    With items=(array_key, event, clean), the completion is JSON: instead of
+    tokens, each element of its top-level `array_key` array is sent as an
+    `event` event as soon as it closes (clean() may tidy it, or return None
+    to drop it).
+    """
+    observe = None
+    if mode is not None:
+        completion, observe = budgeted_completion(mode, text, completion)
+
+    # The stream body runs after the request is torn down, so it owns the
+    # reservation - which an optimistic credit check may not have made yet
+    g.stream_settles_credits = True
+
+    parser = JSONStreamParser(arrays=(items[0],)) if items else None
+
+    def relay(delta):
+        if parser is None:
+            yield sse_event('token', {'delta': delta})
+            return
+        _, event, clean = items
+        for _, item in parser.feed(delta):
+            item = clean(item)
+            if item is not None:
+                yield sse_event(event, item)
+
+    def events():
+        pending = g.pop('pending_credits', None)
+        chunks = []
+        outcome = {}
+        try:
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                chunks.append(cached)
+                yield from relay(cached)
+            else:
+                for delta in llm.stream(outcome=outcome, **completion):
+                    chunks.append(delta)
+                    yield from relay(delta)
+                if observe is not None:
+                    observe(LLMResult(''.join(chunks), completion.get('model'), outcome.get('usage'),
+                                      finish_reason=outcome.get('finish_reason')))
+                # An answer cut off by its output budget is not worth reusing
+                if cache_key and outcome.get('finish_reason') != 'length':
+                    response_cache.set(cache_key, ''.join(chunks))
+
+            result = add_credit_info(build_result(''.join(chunks)), credit_result)
+            settle_credits(pending, True)
+            pending = None
+            yield sse_event('done', result)
+
+        except Exception as e:
+            request_log.error(f"Streaming error: {str(e)}")
+            yield sse_event('error', {'error': str(e), 'status': 'error'})
+
+        finally:
+            # Errors and client disconnects before 'done' are refunded
+            settle_credits(pending, False)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_result(result, items):
+    """SSE replay of an already built result (e.g. a cache hit) in stream_completion's format"""
+    array_key, event, clean = items
+    events = [sse_event(event, item) for item in result.get(array_key, [])]
+    events.append(sse_event('done', result))
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ASYNC-CAPABLE VIEWS
+# LLM-bound views yield these calls instead of blocking on them, so the same
+# view runs under Flask and under the ASGI app (see view_flow.py, asgi.py)
+from view_flow import Call, CreditCheck, flow_view, set_call_loop
+
+# Credit checks run alongside the LLM call (OPTIMISTIC_CREDITS, see view_flow.py)
+set_call_loop(lambda: llm.loop)
+
+def credit_rejection(feature_mode, credit_result):
+    return jsonify({
+        'error': credit_result['message'],
+        'credits_required': get_feature_credits(feature_mode)
+    }), 402
+
+def credit_check(feature_mode):
+    return CreditCheck(optional_credit_check, lambda result: credit_rejection(feature_mode, result), feature_mode)
+
+def llm_call(gateway=None, **completion):
+    gateway = gateway or llm
+    return Call(gateway.complete, gateway.acomplete, **completion)
+
+# OUTPUT BUDGETS - max_tokens (and model) per request from observed outputs (see output_budget.py)
+from output_budget import get_output_budgets, output_tokens
+output_budgets = get_output_budgets()
+
+def budgeted_completion(mode, text, completion):
+    """completion sized for this mode and input, plus the callback that records the output"""
+    entry = MODES.resolve(mode)
+    key = entry.name if entry is not None else 'default'  # unknown modes share one window
+    ceilings = [value for value in (completion.get('max_tokens'), entry and entry.max_tokens) if value]
+    ceiling = min(ceilings) if ceilings else None
+    scales = entry.scales_output if entry is not None else False
+    input_tokens = count_tokens(text)
+    sized = output_budgets.size_completion(key, completion, input_tokens, ceiling, scales)
+
+    def observe(result):
+        truncated = getattr(result, 'finish_reason', None) == 'length'
+        output_budgets.observe(key, input_tokens, sized['max_tokens'], output_tokens(result), truncated, ceiling)
+
+    return sized, observe
+
+def observed_call(observe, sync_fn, async_fn, *args, **kwargs):
+    """Call that hands its result to observe() before the view sees it"""
+    def run(*args, **kwargs):
+        result = sync_fn(*args, **kwargs)
+        observe(result)
+        return result
+
+    async def arun(*args, **kwargs):
+        result = await async_fn(*args, **kwargs)
+        observe(result)
+        return result
+
+    return Call(run, arun, *args, **kwargs)
+
+def budgeted_call(mode, text, gateway=None, **completion):
+    """llm_call with max_tokens sized for the mode and the input text"""
+    gateway = gateway or llm
+    completion, observe = budgeted_completion(mode, text, completion)
+    return observed_call(observe, gateway.complete, gateway.acomplete, **completion)
+
+def budgeted_policy_call(mode, text, messages):
+    """policy_call over the mode's policy, trimmed to models and budgets that fit the input"""
+    entry = MODES[mode]
+    input_tokens = count_tokens(text)
+    policy = output_budgets.size_policy(mode, entry.policy, input_tokens, entry.max_tokens, entry.scales_output)
+
+    budgets = {option.name: option.params.get('max_tokens') for option in policy.models}
+
+    def observe(result):
+        # Sized per model, so the winner's budget is the one that may have cut it off
+        truncated = result.finish_reason == 'length'
+        output_budgets.observe(mode, input_tokens, budgets.get(result.model), output_tokens(result),
+                               truncated, entry.max_tokens)
+
+    return observed_call(observe, llm.complete_with_policy, llm.acomplete_with_policy, policy, messages)
+
+def cached_completion_text(mode, text, completion, gateway=None):
+    """Completion text for a cacheable mode, served from the response cache when possible"""
+    cache_key = make_cache_key(mode, text, completion)
+    output = response_cache.get(cache_key)
+    if output is None:
+        response = yield budgeted_call(mode, text, gateway, **completion)
+        output = response.text
+        # An answer cut off by its output budget is not worth reusing
+        if response.finish_reason != 'length':
+            response_cache.set(cache_key, output)
+    return output
 
 # ============================================
 # MAILGUN EMAIL FUNCTIONS - ADD THIS SECTION
@@ -254,35 +615,35 @@ def generate_verification_token_v2(email):
         # Combine base64 data with hash
         final_token = f"{token_b64}.{token_hash}"
 
-        print(f"🔧 DEBUG: Token generated successfully for {email}")
+        auth_log.debug(f"🔧 Token generated successfully for {email}")
         return final_token
 
     except Exception as e:
-        print(f"❌ Token generation failed: {e}")
+        auth_log.warning(f"❌ Token generation failed: {e}")
         return None
 
 def verify_token_v2(email, token):
     """Verify token with embedded expiration - RELIABLE VERSION"""
     try:
         if not MAILGUN_API_KEY:
-            print(f"❌ Token verification failed: No API key")
+            auth_log.warning("❌ Token verification failed: No API key")
             return False
 
         if not token or '.' not in token:
-            print(f"❌ Invalid token format: {token}")
+            auth_log.warning(f"❌ Invalid token format: {token}")
             return False
 
         # Split token into data and hash parts
         try:
             token_b64, token_hash = token.rsplit('.', 1)
         except ValueError:
-            print(f"❌ Could not split token")
+            auth_log.warning("❌ Could not split token")
             return False
 
         # Verify hash first
         expected_hash = hashlib.sha256(f"{token_b64}:{MAILGUN_API_KEY}".encode()).hexdigest()[:16]
         if expected_hash != token_hash:
-            print(f"❌ Token hash verification failed")
+            auth_log.warning("❌ Token hash verification failed")
             return False
 
         # Decode token data
@@ -291,12 +652,12 @@ def verify_token_v2(email, token):
             token_json = token_bytes.decode('utf-8')
             token_data = json.loads(token_json)
         except Exception as decode_error:
-            print(f"❌ Token decode error: {decode_error}")
+            auth_log.warning(f"❌ Token decode error: {decode_error}")
             return False
 
         # Verify email matches
         if token_data.get('email') != email:
-            print(f"❌ Email mismatch in token")
+            auth_log.warning("❌ Email mismatch in token")
             return False
 
         # Check expiration
@@ -305,67 +666,48 @@ def verify_token_v2(email, token):
             current_time = datetime.datetime.utcnow()
 
             if current_time > expiration:
-                print(f"❌ Token has expired")
+                auth_log.warning("❌ Token has expired")
                 return False
 
-            print(f"✅ Token verified successfully for {email}")
+            auth_log.info(f"✅ Token verified successfully for {email}")
             return True
 
         except Exception as time_error:
-            print(f"❌ Time parsing error: {time_error}")
+            auth_log.warning(f"❌ Time parsing error: {time_error}")
             return False
 
     except Exception as e:
-        print(f"❌ Token verification error: {e}")
+        auth_log.warning(f"❌ Token verification error: {e}")
         return False
 
-def send_verification_email_mailgun(email, first_name=""):
-    """Send verification email using Mailgun - IMPROVED VERSION WITH DEBUGGING"""
-    try:
-        print(f"🔧 DEBUG: === Starting email send process ===")
-        print(f"🔧 DEBUG: Email: {email}")
-        print(f"🔧 DEBUG: First name: {first_name}")
-
-        # Step 1: Validate environment variables
-        if not MAILGUN_API_KEY:
-            print(f"❌ DEBUG: MAILGUN_API_KEY is missing or empty")
-            return {"success": False, "message": "Mailgun API key not configured"}
-
-        if not MAILGUN_DOMAIN:
-            print(f"❌ DEBUG: MAILGUN_DOMAIN is missing or empty")
-            return {"success": False, "message": "Mailgun domain not configured"}
-
-        print(f"✅ DEBUG: Environment variables present")
-        print(f"🔧 DEBUG: API Key length: {len(MAILGUN_API_KEY)}")
-        print(f"🔧 DEBUG: Domain: {MAILGUN_DOMAIN}")
-        print(f"🔧 DEBUG: Base URL: {MAILGUN_BASE_URL}")
-
-        # Step 2: Generate verification token
-        print(f"🔧 DEBUG: Generating verification token...")
-        verification_token = generate_verification_token_v2(email)
-        if not verification_token:
-            print(f"❌ DEBUG: Token generation failed")
-            return {"success": False, "message": "Failed to generate verification token"}
+def build_verification_email(email, first_name=""):
+    """Mailgun form fields for a verification email, or None if no token could be generated"""
+    # Step 1: Generate verification token
+    mail_log.debug("🔧 Generating verification token...")
+    verification_token = generate_verification_token_v2(email)
+    if not verification_token:
+        mail_log.error("❌ Token generation failed")
+        return None
 
-        print(f"✅ DEBUG: Token generated successfully")
+    mail_log.debug("✅ Token generated successfully")
 
-        # Step 3: Build verification URL
-        verification_url = f"{VERIFICATION_BASE_URL}/verify-email?email={email}&token={verification_token}"
-        print(f"🔧 DEBUG: Verification URL: {verification_url}")
+    # Step 2: Build verification URL
+    verification_url = f"{VERIFICATION_BASE_URL}/verify-email?email={email}&token={verification_token}"
+    mail_log.debug(f"🔧 Verification URL: {verification_url}")
 
-        # Step 4: Prepare email content
-        print(f"🔧 DEBUG: Preparing email content...")
+    # Step 3: Prepare email content
+    mail_log.debug("🔧 Preparing email content...")
 
-        # Simplified welcome text to avoid f-string issues
-        if first_name:
-            welcome_text = f"Welcome {first_name}!"
-        else:
-            welcome_text = "Welcome!"
+    # Simplified welcome text to avoid f-string issues
+    if first_name:
+        welcome_text = f"Welcome {first_name}!"
+    else:
+        welcome_text = "Welcome!"
 
-        print(f"🔧 DEBUG: Welcome text: {welcome_text}")
+    mail_log.debug(f"🔧 Welcome text: {welcome_text}")
 
-        # Professional HTML Email Template (simplified to avoid f-string errors)
-        html_content = f"""<!DOCTYPE html>
+    # Professional HTML Email Template (simplified to avoid f-string errors)
+    html_content = f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
@@ -425,8 +767,8 @@ def send_verification_email_mailgun(email, first_name=""):
 </body>
 </html>"""
 
-        # Plain text fallback
-        text_content = f"""
+    # Plain text fallback
+    text_content = f"""
 {welcome_text}
 
 Thanks for signing up! Click the link below to verify your email address:
@@ -440,59 +782,60 @@ Once verified, you can start optimizing your AI conversations with our Chrome ex
 - Solthron Team
 """
 
-        print(f"✅ DEBUG: Email content prepared")
+    mail_log.debug("✅ Email content prepared")
+
+    # Step 4: Mailgun form fields
+    email_data = {
+        "from": f"Solthron <noreply@{MAILGUN_DOMAIN}>",
+        "to": [email],
+        "subject": "🚀 Verify Your Solthron Account - Start Optimizing AI Conversations",
+        "text": text_content,
+        "html": html_content,
+        "o:tag": ["verification", "signup"],
+        "o:tracking": "yes"
+    }
 
-        # Step 5: Prepare Mailgun request
-        mailgun_url = f"{MAILGUN_BASE_URL}/{MAILGUN_DOMAIN}/messages"
-        print(f"🔧 DEBUG: Mailgun URL: {mailgun_url}")
+    mail_log.debug("🔧 Email data prepared")
+    mail_log.debug(f"🔧 From: {email_data['from']}")
+    mail_log.debug(f"🔧 To: {email_data['to']}")
+    mail_log.debug(f"🔧 Subject: {email_data['subject']}")
 
-        email_data = {
-            "from": f"Solthron <noreply@{MAILGUN_DOMAIN}>",
-            "to": [email],
-            "subject": "🚀 Verify Your Solthron Account - Start Optimizing AI Conversations",
-            "text": text_content,
-            "html": html_content,
-            "o:tag": ["verification", "signup"],
-            "o:tracking": "yes"
-        }
+    return email_data
 
-        print(f"🔧 DEBUG: Email data prepared")
-        print(f"🔧 DEBUG: From: {email_data['from']}")
-        print(f"🔧 DEBUG: To: {email_data['to']}")
-        print(f"🔧 DEBUG: Subject: {email_data['subject']}")
 
-        # Step 6: Send email via Mailgun
-        print(f"🔧 DEBUG: Sending request to Mailgun...")
+def send_verification_email_mailgun(email, first_name=""):
+    """Queue a verification email for the Mailgun workers (see email_queue.py)"""
+    try:
+        mail_log.debug(f"🔧 === Starting email send process for {email} ===")
 
-        response = requests.post(
-            mailgun_url,
-            auth=("api", MAILGUN_API_KEY),
-            data=email_data,
-            timeout=30  # Add timeout
-        )
+        # Step 1: Validate environment variables
+        if not MAILGUN_API_KEY:
+            mail_log.error("❌ MAILGUN_API_KEY is missing or empty")
+            return {"success": False, "message": "Mailgun API key not configured"}
+
+        if not MAILGUN_DOMAIN:
+            mail_log.error("❌ MAILGUN_DOMAIN is missing or empty")
+            return {"success": False, "message": "Mailgun domain not configured"}
 
-        print(f"🔧 DEBUG: Mailgun response status: {response.status_code}")
-        print(f"🔧 DEBUG: Mailgun response text: {response.text}")
+        # Step 2: Build the message (token, HTML and text bodies)
+        email_data = build_verification_email(email, first_name)
+        if email_data is None:
+            return {"success": False, "message": "Failed to generate verification token"}
+
+        # Step 3: Hand it to the worker pool - or send inline when the queue is off
+        if not EMAIL_QUEUE_ENABLED:
+            result = get_email_queue(mailgun).send_now(email_data)
+            if result["success"]:
+                mail_log.info(f"✅ Verification email sent successfully to {email}")
+            return result
+
+        job_id = get_email_queue(mailgun).enqueue(email_data, dedupe_key=f"verification:{email}")
+        mail_log.info(f"📨 Verification email to {email} queued as {job_id}")
+        return {"success": True, "queued": True, "job_id": job_id, "message": "Verification email queued"}
 
-        if response.status_code == 200:
-            print(f"✅ Verification email sent successfully to {email}")
-            return {"success": True, "message": "Verification email sent"}
-        else:
-            print(f"❌ Mailgun error: {response.status_code} - {response.text}")
-            return {"success": False, "message": f"Mailgun API error: {response.status_code}"}
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Mailgun request timeout")
-        return {"success": False, "message": "Email service timeout"}
-    except requests.exceptions.ConnectionError:
-        print(f"❌ Mailgun connection error")
-        return {"success": False, "message": "Failed to connect to email service"}
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Mailgun request error: {e}")
-        return {"success": False, "message": f"Email service error: {str(e)}"}
     except Exception as e:
-        print(f"❌ Unexpected error in send_verification_email_mailgun: {e}")
-        print(f"❌ Error type: {type(e).__name__}")
+        mail_log.error(f"❌ Unexpected error in send_verification_email_mailgun: {e}")
+        return {"success": False, "message": f"Email service error: {str(e)}"}
 
 # ============================================
 # END MAILGUN EMAIL FUNCTIONS
@@ -562,12 +905,16 @@ def get_user_credits():
             return jsonify({'error': 'No valid authorization token'}), 401
 
         token = auth_header[7:]  # Remove 'Bearer '
-        user_info = verify_auth_token(token)
+        # Balance display always reads Firestore so purchases show up immediately
+        user_info = verify_auth_token(token, fresh=True)
 
         if not user_info:
             return jsonify({'error': 'Invalid token'}), 401
 
         credits = user_info['data'].get('credits', 0)
+        if CREDIT_LEDGER_ENABLED:
+            # Deductions the ledger has not written to Firestore yet
+            credits -= get_credit_ledger(db).pending(user_info['uid'])
         return jsonify({'credits': credits})
 
     except Exception as e:
@@ -600,12 +947,9 @@ def deduct_credits():
         return jsonify({'error': str(e)}), 500
 
 # YOUR EXISTING AI PROCESSING FUNCTIONS (keeping them exactly the same)
-def create_enhanced_rewrite(topic, tone, length, mode='enhance'):
-    if mode == 'cot':
-        fixed_template = f"""Original User Request:
-{topic}
-
-INITIATING CHAIN OF THOUGHT ANALYSIS...
+# The framework comes first and the request once at the end, so every cot
+# prompt pasted into a chat shares the same prefix
+PROMPTS.add('cot', static="""INITIATING CHAIN OF THOUGHT ANALYSIS...
 
 LAYER 1: CORE DECONSTRUCTION
 → What is the fundamental purpose behind this task?
@@ -678,14 +1022,18 @@ FINAL ACCELERATION:
 → Transform basic into exceptional
 → Elevate ordinary to extraordinary
 
-Now, armed with this comprehensive analytical framework, return to:
+""", dynamic="""Now, armed with this comprehensive analytical framework, return to:
 {topic}
 
 EXECUTE WITH MAXIMUM CAPABILITY AND CREATIVITY.
 Transform this task beyond its basic form into something extraordinary.
 Push every boundary. Challenge every norm. Create something remarkable.
 
-[Proceed with execution using all layers of analysis above]"""
+[Proceed with execution using all layers of analysis above]""")
+
+def create_enhanced_rewrite(topic, tone, length, mode='enhance'):
+    if mode == 'cot':
+        fixed_template = PROMPTS['cot'].render(topic=topic)
 
         return {
             "prompt": fixed_template,
@@ -716,7 +1064,8 @@ Push every boundary. Challenge every norm. Create something remarkable.
             "user_message": user_message
         }
 
-def process_reframe_request(client, topic, tone, length):
+def build_reframe_request(topic, tone, length):
+    """Build the completion kwargs for a reframe mode"""
     if tone.startswith('reframe_'):
         tone = tone.split('_')[1]
 
@@ -724,18 +1073,22 @@ def process_reframe_request(client, topic, tone, length):
     if not template:
         raise ValueError(f"Unsupported tone: {tone}")
 
-    response = client.chat.completions.create(
-        model="chatgpt-4o-latest",
-        messages=[
+    return {
+        'model': "chatgpt-4o-latest",
+        'messages': [
             {"role": "system", "content": template["system"]},
             {"role": "user", "content": template["user"]},
             {"role": "system", "content": "Important: Output must match requested format exactly."}
         ],
-        temperature=0.3
-    )
+        'temperature': 0.3
+    }
+
+def reframe_result(text, topic, tone):
+    if tone.startswith('reframe_'):
+        tone = tone.split('_')[1]
 
     return {
-        'prompt': response.choices[0].message.content,
+        'prompt': text,
         'status': 'success',
         'metadata': {
             'topic': topic,
@@ -805,143 +1158,279 @@ def create_explain_prompt(topic, mode):
     }
     return explain_templates.get(mode)
 
-def process_image_variation(client, image_data, mode):
-    image_templates = {
-        "image_caption": {
-            "system": "Generate a concise, descriptive caption for this image.",
-            "max_tokens": 50
-        },
-        "image_prompt": {
-            "system": "Generate a detailed prompt that describes this image for AI image generation.",
-            "max_tokens": 100
+# EXPLAIN / CONVERT TEMPLATES (shared by /generate and the dedicated endpoints)
+def build_explain_request(topic, mode):
+    """Build the completion kwargs for an explain mode"""
+    if mode == 'explain_meaning':
+        # ORIGINAL explain_meaning template
+        template = f"""Definition:
+[Concise one-line definition of the core concept]
+
+Domain Meanings & Usage:
+| [Domain1]: [Specific meaning in this domain]
+  "[Example sentence showing usage]"
+
+| [Domain2]: [Specific meaning in this domain]
+  "[Example sentence showing usage]"
+
+| [Domain3]: [Specific meaning in this domain]
+  "[Example sentence showing usage]"
+
+| [Domain4]: [Specific meaning in this domain]
+  "[Example sentence showing usage]"
+
+Related:
+[3-4 closely related terms, comma-separated]"""
+
+        return {
+            'model': "chatgpt-4o-latest",
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "Generate concise, structured explanations following the exact template format. Include relevant domain-specific meanings and authentic usage examples."
+                },
+                {
+                    "role": "user",
+                    "content": f"Explain this term:\n{topic}\n\nUse template:\n{template}"
+                }
+            ],
+            'temperature': 0.3,
+            'max_tokens': 400
         }
-    }
 
-    template = image_templates.get(mode, {
-        "system": "Default image processing system message",
-        "max_tokens": 50
-    })
+    if mode == 'explain_story':
+        # ORIGINAL explain_story template
+        template = f"""Core Concept:
+[One-line explanation of what it is]
 
-    response = client.chat.completions.create(
-        model="chatgpt-4o-latest",
-        messages=[
-            {"role": "system", "content": template["system"]},
-            {"role": "user", "content": [
-                {"type": "text", "text": "Process this image:"},
-                {"type": "image_url", "image_url": {"url": image_data}}
-            ]}
-        ],
-        max_tokens=template["max_tokens"]
-    )
+Story:
+[3-4 sentences that naturally explain the concept through a relatable narrative]"""
+
+        return {
+            'model': "chatgpt-4o-latest",
+            'messages': [
+                {"role": "system", "content": "Create a concise story that explains the concept naturally, without bullet points or sections."},
+                {"role": "user", "content": f"Explain this through a story:\n{topic}\n\nUse template:\n{template}"}
+            ],
+            'temperature': 0.3,
+            'max_tokens': 400
+        }
+
+    if mode == 'explain_eli5':
+        # ORIGINAL explain_eli5 approach
+        return {
+            'model': "chatgpt-4o-latest",
+            'messages': [
+                {"role": "system", "content": "Explain concepts using simple words, fun analogies, and examples that a 5-year-old would understand. Use short sentences and friendly language."},
+                {"role": "user", "content": f"Explain this to a 5-year-old:\n{topic}"}
+            ],
+            'temperature': 0.3,
+            'max_tokens': 400
+        }
 
+    # Fallback for any other explain modes
+    template = create_explain_prompt(topic, mode)
     return {
-        'prompt': response.choices[0].message.content,
-        'status': 'success',
-        'metadata': {'mode': mode}
+        'model': "chatgpt-4o-latest",
+        'messages': [
+            {"role": "system", "content": template["system"]},
+            {"role": "user", "content": template["user"]}
+        ],
+        'temperature': 0.7
     }
 
-def extract_questions_from_text(text):
-    """Extract questions from AI response when JSON parsing fails"""
-    questions = []
-    lines = text.split('\n')
-
-    for line in lines:
-        line = line.strip()
-        if '?' in line and len(line) > 20:
-            # Clean the question
-            clean_q = line
+# convert_* templates: instructions first, the user's text last
+PROMPTS.add('convert_concise', static="""You will convert the following text into a clear, concise prompt.
 
-            # Remove common prefixes and artifacts
-            prefixes = ['"text":', 'text:', '"', "'", '-', '•', '*', '1.', '2.', '3.', '4.', '5.']
-            for prefix in prefixes:
-                if clean_q.startswith(prefix):
-                    clean_q = clean_q[len(prefix):].strip()
+Format Guidelines:
+- One clear task statement
+- Maximum 2-3 essential requirements
+- No additional explanations or examples
+- Keep total length under 5 lines
+- Maintain professional tone
 
-            # Remove trailing punctuation except ?
-            clean_q = clean_q.rstrip('",\'"').strip()
+Structure:
+Task: [One clear sentence]
+Requirements:
+1. [First key requirement]
+2. [Second key requirement]
+3. [Third key requirement - if absolutely necessary]
 
-            # Ensure it looks like a question
-            if clean_q and clean_q.endswith('?') and len(clean_q) > 15:
-                questions.append({
-                    "text": clean_q,
-                    "type": "strategic"
-                })
+Format Requirements:
+- Maximum 3 sentences
+- No bullet points
+- No examples unless critical
+- Focus on core request
 
-    # If no questions extracted, provide high-quality defaults
-    if len(questions) == 0:
-        questions = [
-            {"text": "What underlying assumptions in this approach should be validated or challenged?", "type": "assumption"},
-            {"text": "What alternative strategies or methodologies could achieve similar outcomes?", "type": "alternative"},
-            {"text": "What would be the key implementation challenges and success factors?", "type": "implementation"}
-        ]
+""", dynamic="""Original Text:
+{topic}
 
-    return questions[:3]
+Enhance this text into a clear, focused prompt that could be given to an AI system.""")
 
-def parse_json_response_enhanced(ai_response):
-    """Enhanced JSON parsing for GPT-4.1's higher quality output"""
-
-    # GPT-4.1 should produce cleaner JSON, but still handle edge cases
-    clean_response = ai_response.strip()
-
-    # Remove markdown code blocks if present
-    if "```json" in clean_response:
-        clean_response = clean_response.split("```json")[1].split("```")[0].strip()
-    elif "```" in clean_response:
-        parts = clean_response.split("```")
-        if len(parts) >= 3:
-            clean_response = parts[1].strip()
-
-    # Find JSON object boundaries
-    start_idx = clean_response.find('{')
-    if start_idx == -1:
-        raise json.JSONDecodeError("No JSON found", clean_response, 0)
-
-    # Find the matching closing brace
-    brace_count = 0
-    end_idx = -1
-    in_string = False
-    escape_next = False
-
-    for i in range(start_idx, len(clean_response)):
-        char = clean_response[i]
-
-        if escape_next:
-            escape_next = False
-            continue
-
-        if char == '\\' and in_string:
-            escape_next = True
-            continue
-
-        if char == '"':
-            in_string = not in_string
-            continue
-
-        if not in_string:
-            if char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i + 1
-                    break
-
-    if end_idx == -1:
-        raise json.JSONDecodeError("Incomplete JSON", clean_response, start_idx)
-
-    json_str = clean_response[start_idx:end_idx]
-    return json.loads(json_str)
+PROMPTS.add('convert_balanced', static="""You will help convert the following text into a balanced, well-structured prompt.
 
-def create_gpt41_fallback_prompts_clean(original_text):
-    """Create high-quality fallback prompts WITHOUT including the original text"""
+Format Guidelines:
+- Clear task definition
+- Do not use afterrisks
+- 4-5 key requirements
+- One brief example
+- Keep total length under 10 lines
 
-    # Analyze text type for better fallbacks
-    text_lower = original_text.lower()
+Structure:
+Task: [Clear task description]
 
-    if any(keyword in text_lower for keyword in ['function', 'class', 'def', 'var', 'const', 'import']):
-        content_type = "code"
-    elif any(keyword in text_lower for keyword in ['write', 'blog', 'article', 'content', 'copy']):
-        content_type = "writing"
+Requirements:
+1. [First requirement]
+2. [Second requirement]
+3. [Third requirement]
+4. [Fourth requirement]
+5. [Optional fifth requirement]
+
+Example:
+Scenario: [Brief example scenario]
+Input: [Sample input]
+Output: [Expected output]
+
+Output Format: [Desired format]
+
+""", dynamic="""Original Text:
+{topic}
+
+Transform this text into a balanced prompt that provides clear direction while maintaining essential context.""")
+
+PROMPTS.add('convert_detailed', static="""Create a comprehensive prompt from the original text below.
+
+Format Guidelines:
+- Detailed task explanation
+- Do not use afterrisks
+- Specific requirements and constraints
+- Step-by-step guidance
+- Clear examples
+- Structured sections
+
+Structure:
+Task: [Comprehensive task description]
+
+Requirements:
+1. [First requirement with explanation]
+2. [Second requirement with explanation]
+3. [Third requirement with explanation]
+[Continue with all necessary requirements]
+
+Steps:
+1. [First step with guidance]
+2. [Second step with guidance]
+3. [Third step with guidance]
+[Continue with all necessary steps]
+
+Examples:
+1. Example Scenario: [Specific example]
+   Input: [Sample input]
+   Output: [Expected output]
+2. [Additional example if needed]
+
+Output Format: [Specific format requirements]
+
+Structure Guidelines:
+- Clear section headers
+- Multiple related examples
+- Step-by-step instructions where relevant
+- Explicit success criteria
+- Edge cases and exceptions
+
+""", dynamic="""Original Text:
+{topic}
+
+Transform this text into a detailed prompt that leaves no room for ambiguity while maintaining clarity and purpose.""")
+
+def build_convert_template(topic, mode):
+    """Return the ORIGINAL convert_* template for this mode (unknown convert modes get detailed)"""
+    template = PROMPTS.get(mode, PROMPTS['convert_detailed'])
+    return template.render(topic=fit_to_budget(mode, topic, template))
+
+def process_image_variation(llm, image_data, mode):
+    image_templates = {
+        "image_caption": {
+            "system": "Generate a concise, descriptive caption for this image.",
+            "max_tokens": 50
+        },
+        "image_prompt": {
+            "system": "Generate a detailed prompt that describes this image for AI image generation.",
+            "max_tokens": 100
+        }
+    }
+
+    template = image_templates.get(mode, {
+        "system": "Default image processing system message",
+        "max_tokens": 50
+    })
+
+    response = yield llm_call(
+        model="chatgpt-4o-latest",
+        messages=[
+            {"role": "system", "content": template["system"]},
+            {"role": "user", "content": [
+                {"type": "text", "text": "Process this image:"},
+                {"type": "image_url", "image_url": {"url": image_data}}
+            ]}
+        ],
+        max_tokens=template["max_tokens"]
+    )
+
+    return {
+        'prompt': response.text,
+        'status': 'success',
+        'metadata': {'mode': mode}
+    }
+
+@traced('parse')
+def extract_questions_from_text(text):
+    """Extract questions from AI response when JSON parsing fails"""
+    questions = []
+    lines = text.split('\n')
+
+    for line in lines:
+        line = line.strip()
+        if '?' in line and len(line) > 20:
+            # Clean the question
+            clean_q = line
+
+            # Remove common prefixes and artifacts
+            prefixes = ['"text":', 'text:', '"', "'", '-', '•', '*', '1.', '2.', '3.', '4.', '5.']
+            for prefix in prefixes:
+                if clean_q.startswith(prefix):
+                    clean_q = clean_q[len(prefix):].strip()
+
+            # Remove trailing punctuation except ?
+            clean_q = clean_q.rstrip('",\'"').strip()
+
+            # Ensure it looks like a question
+            if clean_q and clean_q.endswith('?') and len(clean_q) > 15:
+                questions.append({
+                    "text": clean_q,
+                    "type": "strategic"
+                })
+
+    # If no questions extracted, provide high-quality defaults
+    if len(questions) == 0:
+        questions = [
+            {"text": "What underlying assumptions in this approach should be validated or challenged?", "type": "assumption"},
+            {"text": "What alternative strategies or methodologies could achieve similar outcomes?", "type": "alternative"},
+            {"text": "What would be the key implementation challenges and success factors?", "type": "implementation"}
+        ]
+
+    return questions[:3]
+
+def create_gpt41_fallback_prompts_clean(original_text):
+    """Create high-quality fallback prompts WITHOUT including the original text"""
+
+    # Analyze text type for better fallbacks
+    text_lower = original_text.lower()
+
+    if any(keyword in text_lower for keyword in ['function', 'class', 'def', 'var', 'const', 'import']):
+        content_type = "code"
+    elif any(keyword in text_lower for keyword in ['write', 'blog', 'article', 'content', 'copy']):
+        content_type = "writing"
     elif original_text.endswith('?') or 'help' in text_lower:
         content_type = "prompt"
     else:
@@ -976,6 +1465,7 @@ def create_gpt41_fallback_prompts_clean(original_text):
 
     return fallback_prompts
 
+@traced('parse')
 def extract_suggestions_from_text_enhanced(text):
     """Extract enhancement suggestions from AI response when JSON parsing fails"""
     suggestions = []
@@ -1029,6 +1519,54 @@ def debug_routes():
         })
     return jsonify({'routes': routes})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: request and per-phase latency histograms, dropped log records"""
+    return Response(render_metrics() + render_log_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/usage-report', methods=['GET'])
+def usage_report():
+    """Admin endpoint: LLM tokens, latency and cost per mode/model/user (?since=&until=&group_by=&user=)"""
+    # Per-user spend is private - the report only exists once a token is configured
+    if not USAGE_REPORT_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), USAGE_REPORT_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return jsonify(get_usage_meter().report(
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        group_by=request.args.get('group_by', 'mode,model').split(','),
+        user=request.args.get('user'),
+        limit=request.args.get('limit', 200, type=int),
+    ))
+
+@app.route('/debug-breakers', methods=['GET'])
+def debug_breakers():
+    """Admin endpoint showing per-model circuit breaker state and latency"""
+    return jsonify({
+        'breakers': llm.breakers.snapshot(),
+        'hedge_delays': {
+            endpoint: policy.hedge_delay(llm.first_token_latency.get(policy.models[0].name))
+            for endpoint, policy in MODEL_POLICIES.items()
+        }
+    })
+
+@app.route('/debug-modes', methods=['GET'])
+def debug_modes():
+    """Admin endpoint listing the mode registry"""
+    return jsonify({
+        'modes': MODES.describe(),
+        'output_budgets': output_budgets.stats(),
+        'structured_outputs': {
+            schema.name: schema.stats() for schema in (FOLLOWUPS_SCHEMA, ACTIONS_SCHEMA, ENHANCEMENTS_SCHEMA)
+        },
+    })
+
+@app.route('/debug-prompts', methods=['GET'])
+def debug_prompts():
+    """Admin endpoint listing precompiled prompt templates and their static prefix sizes"""
+    return jsonify({'templates': PROMPTS.describe()})
+
 @app.route('/test-convert', methods=['POST'])
 def test_convert():
     """Simple test for convert functionality"""
@@ -1048,342 +1586,152 @@ def test_convert():
 def home():
     return "Solthron API is running"
 
-@app.route('/generate', methods=['POST'])
-def generate():
-    try:
-        data = request.get_json(force=True)
-        topic = data.get('topic', '').strip()
-        tone = data.get('tone', 'professional')
-        length = data.get('length', 'balanced')
-        mode = data.get('mode', 'reframe_casual')
+# /generate MODE HANDLERS - dispatched through MODES (see the mode registry below)
+def mode_completion_text(entry, mode, text, completion):
+    """Completion text, through the response cache when the mode's cache policy allows"""
+    if entry.cache == CACHE_EXACT:
+        return (yield from cached_completion_text(mode, text, completion))
+    return (yield budgeted_call(mode, text, **completion)).text
 
-        if not topic:
-            return jsonify({'error': 'Topic is required'}), 400
+def mode_stream(entry, mode, text, completion, build_result, credit_result):
+    cache_key = make_cache_key(mode, text, completion) if entry.cache == CACHE_EXACT else None
+    return stream_completion(completion, build_result, credit_result, cache_key=cache_key, mode=mode, text=text)
 
-        # ADD CREDIT CHECK HERE
-        credit_result = optional_credit_check(mode)
-        if not credit_result['success']:
-            return jsonify({
-                'error': credit_result['message'],
-                'credits_required': get_feature_credits(mode)
-            }), 402
-
-        # Handle reframe modes
-        if mode.startswith('reframe_'):
-            tone = mode.split('_')[1]
-            result = process_reframe_request(client, topic, tone, length)
-
-            # Add credit info to response
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
-
-            return jsonify(result)
+def generate_reframe(entry, mode, topic, tone, length, stream, credit_result):
+    tone = mode.split('_')[1]
+    completion = entry.template(topic, tone, length)
 
-        # Handle explain modes - RESTORED ORIGINAL TEMPLATES
-        if mode.startswith('explain_'):
-            if mode == 'explain_meaning':
-                # ORIGINAL explain_meaning template
-                template = f"""Definition:
-[Concise one-line definition of the core concept]
+    def build_result(text):
+        return reframe_result(text, topic, tone)
 
-Domain Meanings & Usage:
-| [Domain1]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
+    if stream:
+        return mode_stream(entry, mode, topic, completion, build_result, credit_result)
 
-| [Domain2]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
-
-| [Domain3]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
-
-| [Domain4]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
-
-Related:
-[3-4 closely related terms, comma-separated]"""
-
-                response = client.chat.completions.create(
-                    model="chatgpt-4o-latest",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Generate concise, structured explanations following the exact template format. Include relevant domain-specific meanings and authentic usage examples."
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Explain this term:\n{topic}\n\nUse template:\n{template}"
-                        }
-                    ],
-                    temperature=0.3,
-                    max_tokens=400
-                )
+    text = yield from mode_completion_text(entry, mode, topic, completion)
+    return jsonify(add_credit_info(build_result(text), credit_result))
 
-            elif mode == 'explain_story':
-                # ORIGINAL explain_story template
-                template = f"""Core Concept:
-[One-line explanation of what it is]
+def generate_explain(entry, mode, topic, tone, length, stream, credit_result):
+    # RESTORED ORIGINAL TEMPLATES
+    completion = entry.template(topic, mode)
 
-Story:
-[3-4 sentences that naturally explain the concept through a relatable narrative]"""
+    def build_result(text):
+        return {
+            'prompt': text,
+            'status': 'success',
+            'metadata': {'mode': mode}
+        }
 
-                response = client.chat.completions.create(
-                    model="chatgpt-4o-latest",
-                    messages=[
-                        {"role": "system", "content": "Create a concise story that explains the concept naturally, without bullet points or sections."},
-                        {"role": "user", "content": f"Explain this through a story:\n{topic}\n\nUse template:\n{template}"}
-                    ],
-                    temperature=0.3,
-                    max_tokens=400
-                )
+    if stream:
+        return mode_stream(entry, mode, topic, completion, build_result, credit_result)
 
-            elif mode == 'explain_eli5':
-                # ORIGINAL explain_eli5 approach
-                response = client.chat.completions.create(
-                    model="chatgpt-4o-latest",
-                    messages=[
-                        {"role": "system", "content": "Explain concepts using simple words, fun analogies, and examples that a 5-year-old would understand. Use short sentences and friendly language."},
-                        {"role": "user", "content": f"Explain this to a 5-year-old:\n{topic}"}
-                    ],
-                    temperature=0.3,
-                    max_tokens=400
-                )
+    text = yield from mode_completion_text(entry, mode, topic, completion)
+    return jsonify(add_credit_info(build_result(text), credit_result))
 
-            else:
-                # Fallback for any other explain modes
-                template = create_explain_prompt(topic, mode)
-                response = client.chat.completions.create(
-                    model="chatgpt-4o-latest",
-                    messages=[
-                        {"role": "system", "content": template["system"]},
-                        {"role": "user", "content": template["user"]}
-                    ],
-                    temperature=0.7
-                )
+def generate_convert(entry, mode, topic, tone, length, stream, credit_result):
+    # RESTORED ORIGINAL TEMPLATES
+    try:
+        completion = {
+            'model': "chatgpt-4o-latest",
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "You are an expert at creating clear, effective prompts."
+                },
+                {
+                    "role": "user",
+                    "content": entry.template(topic, mode)
+                }
+            ],
+            'temperature': 0.3
+        }
 
-            result = {
-                'prompt': response.choices[0].message.content,
+        def build_result(text):
+            return {
+                'prompt': text,
                 'status': 'success',
-                'metadata': {'mode': mode}
+                'metadata': {'mode': mode, 'original_text': topic}
             }
 
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
-
-            return jsonify(result)
+        if stream:
+            return mode_stream(entry, mode, topic, completion, build_result, credit_result)
 
-        # Handle convert modes - RESTORED ORIGINAL TEMPLATES
-        if mode.startswith('convert_'):
-            try:
-                if mode == 'convert_concise':
-                    # ORIGINAL convert_concise template
-                    template = f"""You will convert the following text into a clear, concise prompt.
+        text = yield from mode_completion_text(entry, mode, topic, completion)
+        return jsonify(add_credit_info(build_result(text), credit_result))
 
-Format Guidelines:
-- One clear task statement
-- Maximum 2-3 essential requirements
-- No additional explanations or examples
-- Keep total length under 5 lines
-- Maintain professional tone
-
-Structure:
-Task: [One clear sentence]
-Requirements:
-1. [First key requirement]
-2. [Second key requirement]
-3. [Third key requirement - if absolutely necessary]
-
-Format Requirements:
-- Maximum 3 sentences
-- No bullet points
-- No examples unless critical
-- Focus on core request
-
-Original Text:
-{topic}
-
-Enhance this text into a clear, focused prompt that could be given to an AI system."""
-
-                elif mode == 'convert_balanced':
-                    # ORIGINAL convert_balanced template
-                    template = f"""You will help convert the following text into a balanced, well-structured prompt.
-
-Format Guidelines:
-- Clear task definition
-- Do not use afterrisks
-- 4-5 key requirements
-- One brief example
-- Keep total length under 10 lines
-
-Structure:
-Task: [Clear task description]
-
-Requirements:
-1. [First requirement]
-2. [Second requirement]
-3. [Third requirement]
-4. [Fourth requirement]
-5. [Optional fifth requirement]
-
-Example:
-Scenario: [Brief example scenario]
-Input: [Sample input]
-Output: [Expected output]
-
-Output Format: [Desired format]
-
-Original Text:
-{topic}
-
-Transform this text into a balanced prompt that provides clear direction while maintaining essential context."""
-
-                else:  # convert_detailed
-                    # ORIGINAL convert_detailed template
-                    template = f"""Create a comprehensive prompt about {topic}.
-
-Format Guidelines:
-- Detailed task explanation
-- Do not use afterrisks
-- Specific requirements and constraints
-- Step-by-step guidance
-- Clear examples
-- Structured sections
-
-Structure:
-Task: [Comprehensive task description]
-
-Requirements:
-1. [First requirement with explanation]
-2. [Second requirement with explanation]
-3. [Third requirement with explanation]
-[Continue with all necessary requirements]
-
-Steps:
-1. [First step with guidance]
-2. [Second step with guidance]
-3. [Third step with guidance]
-[Continue with all necessary steps]
-
-Examples:
-1. Example Scenario: [Specific example]
-   Input: [Sample input]
-   Output: [Expected output]
-2. [Additional example if needed]
-
-Output Format: [Specific format requirements]
-
-Structure Guidelines:
-- Clear section headers
-- Multiple related examples
-- Step-by-step instructions where relevant
-- Explicit success criteria
-- Edge cases and exceptions
-
-Original Text:
-{topic}
-
-Transform this text into a detailed prompt that leaves no room for ambiguity while maintaining clarity and purpose."""
-
-                response = client.chat.completions.create(
-                    model="chatgpt-4o-latest",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are an expert at creating clear, effective prompts."
-                        },
-                        {
-                            "role": "user",
-                            "content": template
-                        }
-                    ],
-                    temperature=0.3
-                )
-
-                result = {
-                    'prompt': response.choices[0].message.content,
-                    'status': 'success',
-                    'metadata': {'mode': mode, 'original_text': topic}
-                }
-
-                if credit_result.get('credits_used'):
-                    result['credits_used'] = credit_result['credits_used']
-                    result['credits_remaining'] = credit_result.get('remaining')
-
-                return jsonify(result)
-
-            except Exception as e:
-                return jsonify({'error': str(e), 'status': 'error'}), 500
-
-        # Handle image modes
-        if mode.startswith('image_'):
-            result = process_image_variation(client, topic, mode)
-
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 500
 
-            return jsonify(result)
+def generate_image_variation(entry, mode, topic, tone, length, stream, credit_result):
+    result = yield from process_image_variation(llm, topic, mode)
+    return jsonify(add_credit_info(result, credit_result))
 
-        # Handle template modes (only cot now)
-        if mode in ['cot']:
-            result = create_enhanced_rewrite(topic, tone, length, mode)
+def generate_template(entry, mode, topic, tone, length, stream, credit_result):
+    # Template modes (only cot now) need no LLM call
+    result = create_enhanced_rewrite(topic, tone, length, mode)
+    return jsonify(add_credit_info(result, credit_result))
+    yield  # keeps this a generator like the other handlers
 
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
+def generate_default(entry, mode, topic, tone, length, stream, credit_result):
+    prompt_data = create_enhanced_rewrite(topic, tone, length)
+    response = yield budgeted_call(
+        mode, topic,
+        model="chatgpt-4o-latest",
+        messages=[
+            {"role": "system", "content": prompt_data["system_message"]},
+            {"role": "user", "content": prompt_data["user_message"]}
+        ],
+        temperature=0.7
+    )
 
-            return jsonify(result)
+    result = {
+        'prompt': response.text,
+        'status': 'success',
+        'metadata': {
+            'topic': topic,
+            'tone': tone,
+            'mode': mode
+        }
+    }
+    return jsonify(add_credit_info(result, credit_result))
 
-        # Default processing
-        prompt_data = create_enhanced_rewrite(topic, tone, length)
-        response = client.chat.completions.create(
-            model="chatgpt-4o-latest",
-            messages=[
-                {"role": "system", "content": prompt_data["system_message"]},
-                {"role": "user", "content": prompt_data["user_message"]}
-            ],
-            temperature=0.7
-        )
+@app.route('/generate', methods=['POST'])
+@flow_view
+def generate():
+    try:
+        data = request.get_json(force=True)
+        topic = data.get('topic', '').strip()
+        tone = data.get('tone', 'professional')
+        length = data.get('length', 'balanced')
+        mode = data.get('mode', 'reframe_casual')
 
-        result = {
-            'prompt': response.choices[0].message.content,
-            'status': 'success',
-            'metadata': {
-                'topic': topic,
-                'tone': tone,
-                'mode': mode
-            }
-        }
+        if not topic:
+            return jsonify({'error': 'Topic is required'}), 400
 
-        if credit_result.get('credits_used'):
-            result['credits_used'] = credit_result['credits_used']
-            result['credits_remaining'] = credit_result.get('remaining')
+        # ADD CREDIT CHECK HERE
+        credit_result = yield credit_check(mode)
+        if not credit_result['success']:
+            return jsonify({
+                'error': credit_result['message'],
+                'credits_required': get_feature_credits(mode)
+            }), 402
 
-        return jsonify(result)
+        # Dispatch through the mode registry; unknown modes get the default rewrite
+        entry = MODES.resolve(mode)
+        handler = entry.handler if entry is not None and entry.handler else generate_default
+        return (yield from handler(entry, mode, topic, tone, length, wants_stream(data), credit_result))
 
     except Exception as e:
-        logging.error(f"Error generating prompt: {str(e)}")
+        request_log.error(f"Error generating prompt: {str(e)}")
         return jsonify({
             'error': 'Failed to generate prompt',
             'details': str(e)
         }), 500
 
-@app.route('/generate-image', methods=['POST'])
-def generate_image_prompt():
-    try:
-        # ADD CREDIT CHECK
-        credit_result = optional_credit_check('image_prompt')
-        if not credit_result['success']:
-            return jsonify({
-                'error': credit_result['message'],
-                'credits_required': get_feature_credits('image_prompt')
-            }), 402
-
-        data = request.get_json(force=True)
-        image_url = data.get('image')
-
-        universal_prompt = """Analyze this image with extreme thoroughness and precision. Examine every single visual element, no matter how minute. Study the image as if you need to recreate it perfectly from memory. Provide output in this exact format:
+# Universal image analysis prompt - fully static, the image is the only per-request part
+IMAGE_ANALYSIS_PROMPT = PROMPTS.add(
+    'image_prompt',
+    system="Generate precise image analysis following the universal prompt format.",
+    static="""Analyze this image with extreme thoroughness and precision. Examine every single visual element, no matter how minute. Study the image as if you need to recreate it perfectly from memory. Provide output in this exact format:
 
 Description: [4-5 line comprehensive description capturing the complete scene, all subjects, actions, and significant visual elements in detail]
 
@@ -1420,18 +1768,36 @@ Fine Details: [small background objects, wear patterns, aging signs, scratches/d
 Anomalies & Unique Features: [anything unusual, unexpected, hidden elements, visual tricks, easter eggs, inconsistencies, artistic choices, creative elements, surreal aspects]
 
 Do not use afterrisks in the output"""
+)
+
+@app.route('/generate-image', methods=['POST'])
+@flow_view
+def generate_image_prompt():
+    try:
+        # ADD CREDIT CHECK
+        credit_result = yield credit_check('image_prompt')
+        if not credit_result['success']:
+            return jsonify({
+                'error': credit_result['message'],
+                'credits_required': get_feature_credits('image_prompt')
+            }), 402
+
+        data = request.get_json(force=True)
+        image_url = data.get('image')
 
-        response = client.chat.completions.create(
+        response = yield budgeted_call(
+            'image_prompt', '',
             model="chatgpt-4o-latest",
             messages=[
                 {
                     "role": "system",
-                    "content": "Generate precise image analysis following the universal prompt format."
+                    "content": IMAGE_ANALYSIS_PROMPT.system
                 },
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": universal_prompt},
+                        # Static analysis instructions ahead of the per-request image
+                        {"type": "text", "text": IMAGE_ANALYSIS_PROMPT.static},
                         {
                             "type": "image_url",
                             "image_url": {
@@ -1442,11 +1808,11 @@ Do not use afterrisks in the output"""
                     ]
                 }
             ],
-            max_tokens=500
+            max_tokens=MODES['image_prompt'].max_tokens
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success'
         }
 
@@ -1457,14 +1823,15 @@ Do not use afterrisks in the output"""
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        request_log.error(f"Error: {str(e)}")
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/generate-caption', methods=['POST'])
+@flow_view
 def generate_caption():
     try:
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('image_caption')
+        credit_result = yield credit_check('image_caption')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -1495,7 +1862,8 @@ LinkedIn:
 ---
 #[3-4 relevant professional hashtags]"""
 
-        response = client.chat.completions.create(
+        response = yield budgeted_call(
+            'image_caption', '',
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -1516,11 +1884,11 @@ LinkedIn:
                     ]
                 }
             ],
-            max_tokens=500
+            max_tokens=MODES['image_caption'].max_tokens
         )
 
         result = {
-            'prompt': response.choices[0].message.content,
+            'prompt': response.text,
             'status': 'success'
         }
 
@@ -1531,13 +1899,14 @@ LinkedIn:
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        request_log.error(f"Error: {str(e)}")
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/explain-meaning', methods=['POST'])
+@flow_view
 def explain_meaning():
     # ADD CREDIT CHECK
-    credit_result = optional_credit_check('explain_meaning')
+    credit_result = yield credit_check('explain_meaning')
     if not credit_result['success']:
         return jsonify({
             'error': credit_result['message'],
@@ -1547,43 +1916,15 @@ def explain_meaning():
     data = request.get_json(force=True)
     text = data.get('text', '').strip()
 
-    # ORIGINAL explain_meaning template
-    template = f"""Definition:
-[Concise one-line definition of the core concept]
-
-Domain Meanings & Usage:
-| [Domain1]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
-
-| [Domain2]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
+    completion = build_explain_request(text, 'explain_meaning')
 
-| [Domain3]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
+    if wants_stream(data):
+        return stream_completion(completion, lambda output: {'explanation': output}, credit_result,
+                                 cache_key=make_cache_key('explain_meaning', text, completion), mode='explain_meaning', text=text)
 
-| [Domain4]: [Specific meaning in this domain]
-  "[Example sentence showing usage]"
+    output = yield from cached_completion_text('explain_meaning', text, completion)
 
-Related:
-[3-4 closely related terms, comma-separated]"""
-
-    response = client.chat.completions.create(
-        model="chatgpt-4o-latest",
-        messages=[
-            {
-                "role": "system",
-                "content": "Generate concise, structured explanations following the exact template format. Include relevant domain-specific meanings and authentic usage examples."
-            },
-            {
-                "role": "user",
-                "content": f"Explain this term:\n{text}\n\nUse template:\n{template}"
-            }
-        ],
-        temperature=0.3,
-        max_tokens=400
-    )
-
-    result = {'explanation': response.choices[0].message.content}
+    result = {'explanation': output}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1592,9 +1933,10 @@ Related:
     return jsonify(result)
 
 @app.route('/explain-story', methods=['POST'])
+@flow_view
 def explain_story():
     # ADD CREDIT CHECK
-    credit_result = optional_credit_check('explain_story')
+    credit_result = yield credit_check('explain_story')
     if not credit_result['success']:
         return jsonify({
             'error': credit_result['message'],
@@ -1604,24 +1946,15 @@ def explain_story():
     data = request.get_json(force=True)
     text = data.get('text', '').strip()
 
-    # ORIGINAL explain_story template
-    template = f"""Core Concept:
-[One-line explanation of what it is]
+    completion = build_explain_request(text, 'explain_story')
 
-Story:
-[3-4 sentences that naturally explain the concept through a relatable narrative]"""
+    if wants_stream(data):
+        return stream_completion(completion, lambda output: {'explanation': output}, credit_result,
+                                 cache_key=make_cache_key('explain_story', text, completion), mode='explain_story', text=text)
 
-    response = client.chat.completions.create(
-        model="chatgpt-4o-latest",
-        messages=[
-            {"role": "system", "content": "Create a concise story that explains the concept naturally, without bullet points or sections."},
-            {"role": "user", "content": f"Explain this through a story:\n{text}\n\nUse template:\n{template}"}
-        ],
-        temperature=0.3,
-        max_tokens=400
-    )
+    output = yield from cached_completion_text('explain_story', text, completion)
 
-    result = {'explanation': response.choices[0].message.content}
+    result = {'explanation': output}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1630,9 +1963,10 @@ Story:
     return jsonify(result)
 
 @app.route('/explain-eli5', methods=['POST'])
+@flow_view
 def explain_eli5():
     # ADD CREDIT CHECK
-    credit_result = optional_credit_check('explain_eli5')
+    credit_result = yield credit_check('explain_eli5')
     if not credit_result['success']:
         return jsonify({
             'error': credit_result['message'],
@@ -1642,18 +1976,15 @@ def explain_eli5():
     data = request.get_json(force=True)
     text = data.get('text', '').strip()
 
-    # ORIGINAL explain_eli5 approach
-    response = client.chat.completions.create(
-        model="chatgpt-4o-latest",
-        messages=[
-            {"role": "system", "content": "Explain concepts using simple words, fun analogies, and examples that a 5-year-old would understand. Use short sentences and friendly language."},
-            {"role": "user", "content": f"Explain this to a 5-year-old:\n{text}"}
-        ],
-        temperature=0.3,
-        max_tokens=400
-    )
+    completion = build_explain_request(text, 'explain_eli5')
+
+    if wants_stream(data):
+        return stream_completion(completion, lambda output: {'explanation': output}, credit_result,
+                                 cache_key=make_cache_key('explain_eli5', text, completion), mode='explain_eli5', text=text)
 
-    result = {'explanation': response.choices[0].message.content}
+    output = yield from cached_completion_text('explain_eli5', text, completion)
+
+    result = {'explanation': output}
 
     if credit_result.get('credits_used'):
         result['credits_used'] = credit_result['credits_used']
@@ -1662,11 +1993,12 @@ def explain_eli5():
     return jsonify(result)
 
 @app.route('/convert-concise', methods=['POST'])
+@flow_view
 def convert_concise():
     """Convert input to a concise prompt using specific strategies."""
     try:
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('convert_concise')
+        credit_result = yield credit_check('convert_concise')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -1676,57 +2008,39 @@ def convert_concise():
         data = request.get_json(force=True)
         topic = data.get('topic', '').strip()
 
-        # ORIGINAL convert_concise template
-        template = f"""You will convert the following text into a clear, concise prompt.
-
-Format Guidelines:
-- One clear task statement
-- Maximum 2-3 essential requirements
-- No additional explanations or examples
-- Keep total length under 5 lines
-- Maintain professional tone
-
-Structure:
-Task: [One clear sentence]
-Requirements:
-1. [First key requirement]
-2. [Second key requirement]
-3. [Third key requirement - if absolutely necessary]
-
-Format Requirements:
-- Maximum 3 sentences
-- No bullet points
-- No examples unless critical
-- Focus on core request
-
-Original Text:
-{topic}
-
-Enhance this text into a clear, focused prompt that could be given to an AI system."""
-
-        response = client.chat.completions.create(
-            model="chatgpt-4o-latest",
-            messages=[
+        completion = {
+            'model': "chatgpt-4o-latest",
+            'messages': [
                 {
                     "role": "system",
                     "content": "You are an expert at converting text into clear, concise prompts."
                 },
                 {
                     "role": "user",
-                    "content": template
+                    "content": build_convert_template(topic, 'convert_concise')
                 }
             ],
-            temperature=0.3
-        )
+            'temperature': 0.3
+        }
 
-        result = {
-            'prompt': response.choices[0].message.content,
-            'status': 'success',
-            'metadata': {
-                'mode': 'concise',
-                'original_text': topic
+        def convert_result(text):
+            return {
+                'prompt': text,
+                'status': 'success',
+                'metadata': {
+                    'mode': 'concise',
+                    'original_text': topic
+                }
             }
-        }
+
+        if wants_stream(data):
+            return stream_completion(completion, convert_result, credit_result,
+                                     cache_key=make_cache_key('convert_concise', topic, completion),
+                                     mode='convert_concise', text=topic)
+
+        output = yield from cached_completion_text('convert_concise', topic, completion)
+
+        result = convert_result(output)
 
         if credit_result.get('credits_used'):
             result['credits_used'] = credit_result['credits_used']
@@ -1738,11 +2052,12 @@ Enhance this text into a clear, focused prompt that could be given to an AI syst
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/convert-balanced', methods=['POST'])
+@flow_view
 def convert_balanced():
     """Convert input to a balanced prompt with moderate detail."""
     try:
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('convert_balanced')
+        credit_result = yield credit_check('convert_balanced')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -1752,62 +2067,40 @@ def convert_balanced():
         data = request.get_json(force=True)
         topic = data.get('topic', '').strip()
 
-        # ORIGINAL convert_balanced template
-        template = f"""You will help convert the following text into a balanced, well-structured prompt.
-
-Format Guidelines:
-- Clear task definition
-- Do not use afterrisks
-- 4-5 key requirements
-- One brief example
-- Keep total length under 10 lines
-
-Structure:
-Task: [Clear task description]
-
-Requirements:
-1. [First requirement]
-2. [Second requirement]
-3. [Third requirement]
-4. [Fourth requirement]
-5. [Optional fifth requirement]
-
-Example:
-Scenario: [Brief example scenario]
-Input: [Sample input]
-Output: [Expected output]
-
-Output Format: [Desired format]
-
-Original Text:
-{topic}
-
-Transform this text into a balanced prompt that provides clear direction while maintaining essential context."""
-
-        response = client.chat.completions.create(
-            model="chatgpt-4o-latest",
-            messages=[
+        completion = {
+            'model': "chatgpt-4o-latest",
+            'messages': [
                 {
                     "role": "system",
                     "content": "You are an expert at creating well-balanced prompts that provide the right level of detail."
                 },
                 {
                     "role": "user",
-                    "content": template
+                    "content": build_convert_template(topic, 'convert_balanced')
                 }
             ],
-            temperature=0.4
-        )
-
-        result = {
-            'prompt': response.choices[0].message.content,
-            'status': 'success',
-            'metadata': {
-                'mode': 'balanced',
-                'original_text': topic
-            }
+            'temperature': 0.4
         }
 
+        def convert_result(text):
+            return {
+                'prompt': text,
+                'status': 'success',
+                'metadata': {
+                    'mode': 'balanced',
+                    'original_text': topic
+                }
+            }
+
+        if wants_stream(data):
+            return stream_completion(completion, convert_result, credit_result,
+                                     cache_key=make_cache_key('convert_balanced', topic, completion),
+                                     mode='convert_balanced', text=topic)
+
+        output = yield from cached_completion_text('convert_balanced', topic, completion)
+
+        result = convert_result(output)
+
         if credit_result.get('credits_used'):
             result['credits_used'] = credit_result['credits_used']
             result['credits_remaining'] = credit_result.get('remaining')
@@ -1818,11 +2111,12 @@ Transform this text into a balanced prompt that provides clear direction while m
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
 @app.route('/convert-detailed', methods=['POST'])
+@flow_view
 def convert_detailed():
     """Convert input to a detailed prompt with comprehensive specifications."""
     try:
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('convert_detailed')
+        credit_result = yield credit_check('convert_detailed')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -1832,75 +2126,39 @@ def convert_detailed():
         data = request.get_json(force=True)
         topic = data.get('topic', '').strip()
 
-        # ORIGINAL convert_detailed template
-        template = f"""Create a comprehensive prompt about {topic}.
-
-Format Guidelines:
-- Detailed task explanation
-- Do not use afterrisks
-- Specific requirements and constraints
-- Step-by-step guidance
-- Clear examples
-- Structured sections
-
-Structure:
-Task: [Comprehensive task description]
-
-Requirements:
-1. [First requirement with explanation]
-2. [Second requirement with explanation]
-3. [Third requirement with explanation]
-[Continue with all necessary requirements]
-
-Steps:
-1. [First step with guidance]
-2. [Second step with guidance]
-3. [Third step with guidance]
-[Continue with all necessary steps]
-
-Examples:
-1. Example Scenario: [Specific example]
-   Input: [Sample input]
-   Output: [Expected output]
-2. [Additional example if needed]
-
-Output Format: [Specific format requirements]
-
-Structure Guidelines:
-- Clear section headers
-- Multiple related examples
-- Step-by-step instructions where relevant
-- Explicit success criteria
-- Edge cases and exceptions
-
-Original Text:
-{topic}
-
-Transform this text into a detailed prompt that leaves no room for ambiguity while maintaining clarity and purpose."""
-
-        response = client.chat.completions.create(
-            model="chatgpt-4o-latest",
-            messages=[
+        completion = {
+            'model': "chatgpt-4o-latest",
+            'messages': [
                 {
                     "role": "system",
                     "content": "You are an expert at creating detailed, comprehensive prompts that capture all necessary specifications, and dont use # or * in your output"
                 },
                 {
                     "role": "user",
-                    "content": template
+                    "content": build_convert_template(topic, 'convert_detailed')
                 }
             ],
-            temperature=0.5
-        )
+            'temperature': 0.5
+        }
 
-        result = {
-            'prompt': response.choices[0].message.content,
-            'status': 'success',
-            'metadata': {
-                'mode': 'detailed',
-                'original_text': topic
+        def convert_result(text):
+            return {
+                'prompt': text,
+                'status': 'success',
+                'metadata': {
+                    'mode': 'detailed',
+                    'original_text': topic
+                }
             }
-        }
+
+        if wants_stream(data):
+            return stream_completion(completion, convert_result, credit_result,
+                                     cache_key=make_cache_key('convert_detailed', topic, completion),
+                                     mode='convert_detailed', text=topic)
+
+        output = yield from cached_completion_text('convert_detailed', topic, completion)
+
+        result = convert_result(output)
 
         if credit_result.get('credits_used'):
             result['credits_used'] = credit_result['credits_used']
@@ -1913,6 +2171,78 @@ Transform this text into a detailed prompt that leaves no room for ambiguity whi
 
 # KEEP ALL YOUR EXISTING SMART FOLLOWUPS, ENHANCEMENTS, ACTIONS, AND PERSONA ENDPOINTS...
 
+# MODEL POLICIES - hedged fallback per endpoint (see model_policy.py)
+# These endpoints answer in JSON, so their primaries are models that take a
+# json_schema response_format (chatgpt-4o-latest does not)
+MODEL_POLICIES = {
+    'smart_followups': HedgePolicy(structured_models(FOLLOWUPS_SCHEMA, [
+        ("gpt-4o", {"temperature": 0.3, "max_tokens": 1000}),
+        ("gpt-3.5-turbo", {"temperature": 0.3, "max_tokens": 800}),
+    ])),
+    'smart_enhancements': HedgePolicy(structured_models(ENHANCEMENTS_SCHEMA, [
+        # Very focused for precise suggestions, slight top_p creativity
+        ("gpt-4.1", {"temperature": 0.1, "max_tokens": 2500, "top_p": 0.95}),
+        ("gpt-4o", {"temperature": 0.2, "max_tokens": 2000}),
+    ])),
+    'smart_actions': HedgePolicy(structured_models(ACTIONS_SCHEMA, [
+        ("gpt-4o", {"temperature": 0.3, "max_tokens": 800}),
+        ("gpt-3.5-turbo", {"temperature": 0.3, "max_tokens": 600}),
+    ])),
+}
+
+# MODE REGISTRY - credits, dispatch, templates, policies and caching per mode
+MODES = ModeRegistry()
+
+# Text Processing: 6 credits
+for name in ['reframe_casual', 'reframe_technical', 'reframe_professional',
+             'reframe_eli5', 'reframe_short', 'reframe_long']:
+    MODES.add(name, 6, handler=generate_reframe, endpoint='/generate',
+              template=build_reframe_request, cache=CACHE_EXACT, scales_output=True)
+MODES.add_family('reframe', handler=generate_reframe, template=build_reframe_request, cache=CACHE_EXACT,
+                 scales_output=True)
+
+# Convert Prompts: 8 credits
+for name in ['convert_concise', 'convert_balanced', 'convert_detailed']:
+    MODES.add(name, 8, handler=generate_convert, endpoint='/' + name.replace('_', '-'),
+              template=build_convert_template, cache=CACHE_EXACT, prompt_tokens=4000)
+MODES.add_family('convert', handler=generate_convert, template=build_convert_template, cache=CACHE_EXACT,
+                 prompt_tokens=4000)
+
+# Persona AI Generator: 10 credits
+MODES.add('persona_generator', 10, endpoint='/generate-persona', max_tokens=1000)
+
+# Image Processing: 12 credits
+MODES.add('image_prompt', 12, handler=generate_image_variation, endpoint='/generate-image', max_tokens=500)
+MODES.add('image_caption', 12, handler=generate_image_variation, endpoint='/generate-caption', max_tokens=500)
+MODES.add_family('image', handler=generate_image_variation)
+
+# Explain: 5 credits
+for name in ['explain_meaning', 'explain_story', 'explain_eli5']:
+    MODES.add(name, 5, handler=generate_explain, endpoint='/' + name.replace('_', '-'),
+              template=build_explain_request, cache=CACHE_EXACT)
+MODES.add_family('explain', handler=generate_explain, template=build_explain_request, cache=CACHE_EXACT)
+
+# AI Assistant: 15 credits
+MODES.add('smart_followups', 15, endpoint='/smart-followups',
+          policy=MODEL_POLICIES['smart_followups'], cache=CACHE_SEMANTIC, prompt_tokens=2000,
+          schema=FOLLOWUPS_SCHEMA)
+MODES.add('smart_actions', 15, endpoint='/smart-actions',
+          policy=MODEL_POLICIES['smart_actions'], cache=CACHE_SEMANTIC, prompt_tokens=2000,
+          schema=ACTIONS_SCHEMA)
+MODES.add('smart_enhancements', 15, endpoint='/smart-enhancements',
+          policy=MODEL_POLICIES['smart_enhancements'], prompt_tokens=3000,
+          schema=ENHANCEMENTS_SCHEMA)
+
+# Auto Suggestions (served by the warm notification build): 3 credits
+MODES.add('auto_suggestion', 3)
+
+# Template modes: same as the default cost
+MODES.add('cot', 6, handler=generate_template, endpoint='/generate')
+
+# Free Features: 0 credits
+for name in ['save_note', 'save_prompt', 'save_persona']:
+    MODES.add(name, 0)
+
 # Smart Follow-ups helper functions
 def get_focus_for_session(conversation):
     """Simple rotation based on conversation hash - no storage needed"""
@@ -1958,16 +2288,11 @@ def extract_key_terms(conversation_snippet):
     except Exception:
         return []
 
-def build_enhanced_prompt(conversation, focus_type):
-    """Build enhanced prompt with focus rotation and specificity requirements"""
-
-    return f"""
+# Smart follow-ups prompt - the focus rotation and conversation go after the static guidance
+PROMPTS.add('smart_followups', static="""
 You're helping someone continue their conversation by suggesting 5 things they might want to explore next.
 
-CONVERSATION:
-{conversation[:1800]}
-
-Generate 5 follow-up questions that feel natural and helpful. Mix of approaches:
+Generate 5 follow-up questions about the conversation below that feel natural and helpful. Mix of approaches:
 - 2 practical/simple questions (what someone curious would ask)
 - 2 slightly deeper questions (but still conversational)
 - 1 action-oriented question (what to DO next - asking for practical steps or advice)
@@ -1977,7 +2302,6 @@ Guidelines:
 ✓ Keep questions conversational and approachable
 ✓ Ask what a curious friend might genuinely want to know
 ✓ Avoid business jargon and academic language
-✓ {focus_type}
 
 Question Style Examples:
 - "Have you tried [specific approach mentioned]?"
@@ -1995,25 +2319,95 @@ For action questions specifically - ask for practical steps:
 Make questions feel like natural conversation flow - what would you genuinely want to know next?
 
 JSON format:
-{{
+{
     "questions": [
-        {{"text": "Simple, curious question?", "type": "curious"}},
-        {{"text": "Another practical question?", "type": "practical"}},
-        {{"text": "Slightly deeper but still conversational question?", "type": "deeper"}},
-        {{"text": "Another conversational exploration question?", "type": "exploration"}},
-        {{"text": "What should I do/try next with [specific thing]?", "type": "action"}}
+        {"text": "Simple, curious question?", "type": "curious"},
+        {"text": "Another practical question?", "type": "practical"},
+        {"text": "Slightly deeper but still conversational question?", "type": "deeper"},
+        {"text": "Another conversational exploration question?", "type": "exploration"},
+        {"text": "What should I do/try next with [specific thing]?", "type": "action"}
     ],
     "analysis": "What would help move this conversation forward"
-}}"""
+}
+
+""", dynamic="""Focus for this conversation:
+✓ {focus_type}
+
+CONVERSATION:
+{conversation}""")
+
+def build_enhanced_prompt(conversation, focus_type):
+    """Build enhanced prompt with focus rotation and specificity requirements"""
+    return PROMPTS['smart_followups'].render(conversation=conversation, focus_type=focus_type)
+
+def clean_question(question):
+    """A follow-up from the model as the extension expects it, or None if unusable"""
+    if isinstance(question, dict) and isinstance(question.get('text'), str):
+        text = question['text'].strip()
+        if text and len(text) > 15:  # Minimum question length
+            if not text.endswith('?'):
+                text += '?'
+            return {
+                "text": text,
+                "type": question.get('type', 'strategic')
+            }
+    return None
+
+# Streamed follow-ups: one 'question' event per element of "questions"
+FOLLOWUP_ITEMS = ('questions', 'question', clean_question)
+
+def followups_result(ai_response, platform, model_used, focus_type):
+    """Response body for the model's follow-up JSON, falling back to text extraction"""
+    request_log.info(f"AI Response length: {len(ai_response)}")
+
+    try:
+        parsed_response = MODES['smart_followups'].schema.parse(ai_response, model_used)
+
+        # Validate structure
+        questions = parsed_response.get('questions', [])
+        if not isinstance(questions, list) or len(questions) == 0:
+            raise ValueError("No valid questions found")
+
+        # Process and validate questions
+        validated_questions = [q for q in map(clean_question, questions[:5]) if q]  # Changed from 3 to 5
+
+        if len(validated_questions) == 0:
+            raise ValueError("No valid questions after processing")
+
+        return {
+            'success': True,
+            'questions': validated_questions,
+            'analysis': parsed_response.get('analysis', 'Strategic insights generated'),
+            'platform': platform,
+            'model': model_used,
+            'focus_used': focus_type,
+            'enhanced': True
+        }
+
+    except ValueError as e:
+        request_log.error(f"JSON parsing failed: {str(e)}")
+
+        # Enhanced fallback extraction with conversation context
+        return {
+            'success': True,
+            'questions': extract_questions_from_text(ai_response),
+            'analysis': 'Strategic questions generated to enhance discussion',
+            'platform': platform,
+            'model': model_used,
+            'focus_used': focus_type,
+            'enhanced': True,
+            'fallback': True
+        }
 
 @app.route('/smart-followups', methods=['POST'])
+@flow_view
 def smart_followups():
     """Enhanced smart follow-up questions with dynamic generation"""
     try:
-        logging.info("=== Enhanced smart followups request started ===")
+        request_log.info("=== Enhanced smart followups request started ===")
 
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('smart_followups')
+        credit_result = yield credit_check('smart_followups')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -2025,174 +2419,94 @@ def smart_followups():
         conversation = data.get('conversation', '').strip()
         platform = data.get('platform', 'unknown')
 
-        logging.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
+        request_log.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
 
         if not conversation:
             return jsonify({'error': 'Conversation content is required'}), 400
 
         # Get dynamic focus for this conversation
         focus_type = get_focus_for_session(conversation)
-        logging.info(f"Selected focus: {focus_type}")
-
-        # Build enhanced prompt with focus and specificity requirements
-        analysis_prompt = build_enhanced_prompt(conversation, focus_type)
-
-        # Use reliable models with proper error handling
-        models_to_try = [
-            {
-                "name": "chatgpt-4o-latest",  # Start with most reliable model
-                "params": {
-                    "temperature": 0.3,  # Increased from 0.1 for more variation
-                    "max_tokens": 1000
-                }
-            },
-            {
-                "name": "gpt-3.5-turbo",
-                "params": {
-                    "temperature": 0.3,
-                    "max_tokens": 800
-                }
-            }
-        ]
-
-        response = None
-        model_used = None
+        request_log.info(f"Selected focus: {focus_type}")
 
-        # Try models in order
-        for model_config in models_to_try:
-            try:
-                model_name = model_config["name"]
-                params = model_config["params"]
-
-                logging.info(f"Trying model: {model_name}")
-
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[{"role": "user", "content": analysis_prompt}],
-                    **params
-                )
+        # Opening + most recent turns that fit the mode's token budget
+        context = fit_to_budget('smart_followups', conversation, trim=trim_conversation,
+                                reserved=count_tokens(focus_type))
 
-                model_used = model_name
-                logging.info(f"Successfully used model: {model_name}")
-                break
+        # Build enhanced prompt with focus and specificity requirements
+        analysis_prompt = build_enhanced_prompt(context, focus_type)
+
+        # The same user's unchanged latest exchange reuses a recent answer
+        semantic = MODES['smart_followups'].cache == CACHE_SEMANTIC
+        cache_scope = request_user_id() if semantic else None
+        cached = semantic_cache.lookup('smart_followups', context, cache_scope) if semantic else None
+        if cached is not None:
+            request_log.info("Semantic cache hit for smart followups")
+            result = add_credit_info(dict(cached, platform=platform), credit_result)
+            if wants_stream(data):
+                return stream_result(result, FOLLOWUP_ITEMS)
+            return jsonify(result)
 
-            except Exception as e:
-                error_msg = str(e)
-                logging.warning(f"Model {model_name} failed: {error_msg}")
-                continue
+        # Streamed: each question is sent as soon as the model closes it
+        if wants_stream(data):
+            primary = MODES['smart_followups'].policy.models[0]
+            completion = dict(primary.params, model=primary.name,
+                              messages=[{"role": "user", "content": analysis_prompt}])
 
-        if not response:
-            return jsonify({
-                'success': False,
-                'error': 'All AI models failed to respond'
-            }), 500
+            def build_result(text):
+                result = followups_result(text.strip(), platform, primary.name, focus_type)
+                if semantic and not result.get('fallback'):
+                    semantic_cache.store('smart_followups', context, dict(result), cache_scope)
+                return result
 
-        # Parse response
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"AI Response length: {len(ai_response)}")
+            return stream_completion(completion, build_result, credit_result, mode='smart_followups',
+                                     text=context, items=FOLLOWUP_ITEMS)
 
+        # Race primary and fallback models per the endpoint's hedge policy
         try:
-            # Clean and extract JSON
-            clean_response = ai_response
-
-            # Remove markdown code blocks
-            if "```json" in clean_response:
-                clean_response = clean_response.split("```json")[1].split("```")[0]
-            elif "```" in clean_response:
-                parts = clean_response.split("```")
-                if len(parts) >= 3:
-                    clean_response = parts[1]
-
-            # Find JSON boundaries
-            start_idx = clean_response.find('{')
-            if start_idx == -1:
-                raise json.JSONDecodeError("No JSON found", clean_response, 0)
-
-            # Find matching closing brace
-            brace_count = 0
-            end_idx = -1
-            for i in range(start_idx, len(clean_response)):
-                if clean_response[i] == '{':
-                    brace_count += 1
-                elif clean_response[i] == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        end_idx = i + 1
-                        break
-
-            if end_idx == -1:
-                raise json.JSONDecodeError("Incomplete JSON", clean_response, start_idx)
-
-            json_str = clean_response[start_idx:end_idx]
-            parsed_response = json.loads(json_str)
-
-            # Validate structure
-            questions = parsed_response.get('questions', [])
-            if not isinstance(questions, list) or len(questions) == 0:
-                raise ValueError("No valid questions found")
-
-            # Process and validate questions
-            validated_questions = []
-            for i, q in enumerate(questions[:5]):  # Changed from 3 to 5
-                if isinstance(q, dict) and 'text' in q:
-                    text = q['text'].strip()
-                    if text and len(text) > 15:  # Minimum question length
-                        if not text.endswith('?'):
-                            text += '?'
-                        validated_questions.append({
-                            "text": text,
-                            "type": q.get('type', 'strategic')
-                        })
-
-            if len(validated_questions) == 0:
-                raise ValueError("No valid questions after processing")
-
-            result = {
-                'success': True,
-                'questions': validated_questions,
-                'analysis': parsed_response.get('analysis', 'Strategic insights generated'),
-                'platform': platform,
-                'model': model_used,
-                'focus_used': focus_type,
-                'enhanced': True
-            }
-
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
-
-            return jsonify(result)
-
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
-
-            # Enhanced fallback extraction with conversation context
-            questions = extract_questions_from_text(ai_response)
-
+            response = yield budgeted_policy_call(
+                'smart_followups', context,
+                [{"role": "user", "content": analysis_prompt}]
+            )
+            model_used = response.model
+            request_log.info(f"Successfully used model: {model_used}")
+        except CircuitOpenError as e:
+            # Every model's breaker is open - answer from the local fallback generator, free of charge
+            request_log.warning(f"All model circuits open: {str(e)}")
             result = {
                 'success': True,
-                'questions': questions,
+                'questions': extract_questions_from_text(''),
                 'analysis': 'Strategic questions generated to enhance discussion',
                 'platform': platform,
-                'model': model_used,
+                'model': None,
                 'focus_used': focus_type,
                 'enhanced': True,
                 'fallback': True
             }
+            waive_credits()
+            return jsonify(result)
+        except Exception as e:
+            request_log.warning(f"All models failed: {str(e)}")
+            response = None
 
-            if credit_result.get('credits_used'):
-                result['credits_used'] = credit_result['credits_used']
-                result['credits_remaining'] = credit_result.get('remaining')
+        if not response:
+            return jsonify({
+                'success': False,
+                'error': 'All AI models failed to respond'
+            }), 500
 
-            return jsonify(result)
+        result = followups_result(response.text.strip(), platform, model_used, focus_type)
+        if semantic and not result.get('fallback'):
+            semantic_cache.store('smart_followups', context, dict(result), cache_scope)
+
+        return jsonify(add_credit_info(result, credit_result))
 
     except Exception as e:
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Enhanced smart followups error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Enhanced smart followups error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2201,35 +2515,13 @@ def smart_followups():
             'error_type': error_type
         }), 500
 
-@app.route('/smart-enhancements', methods=['POST'])
-def smart_enhancements():
-    """Generate smart enhancement suggestions based on selected text"""
-    try:
-        logging.info("=== Smart enhancements request started ===")
-
-        # ADD CREDIT CHECK
-        credit_result = optional_credit_check('smart_enhancements')
-        if not credit_result['success']:
-            return jsonify({
-                'error': credit_result['message'],
-                'credits_required': get_feature_credits('smart_enhancements')
-            }), 402
-
-        # Parse request
-        data = request.get_json(force=True)
-        selected_text = data.get('text', '').strip()
-
-        logging.info(f"Selected text length: {len(selected_text)}")
-
-        if not selected_text:
-            return jsonify({'error': 'Selected text is required'}), 400
-
-        # Enhanced prompt that generates enhancement instructions WITHOUT including original text
-        enhancement_prompt = f"""
-You are an expert content strategist with deep understanding across all domains. Analyze the highlighted text and create 4 precise enhancement instructions.
-
-HIGHLIGHTED TEXT TO ANALYZE:
-{selected_text}
+# Smart enhancements prompt - generates enhancement instructions WITHOUT including original text;
+# the highlighted text goes after the static framework
+PROMPTS.add(
+    'smart_enhancements',
+    system="You are a world-class content strategist and prompt engineer. Your expertise spans writing, coding, business strategy, creative work, and technical documentation. You create enhancement instructions that deliver transformative improvements. Never include the original text in your enhancement instructions.",
+    static="""
+You are an expert content strategist with deep understanding across all domains. Analyze the highlighted text at the end and create 4 precise enhancement instructions.
 
 ANALYSIS FRAMEWORK:
 1. Content Type & Purpose: What is this and what's it trying to achieve?
@@ -2247,95 +2539,98 @@ ENHANCEMENT INSTRUCTION REQUIREMENTS:
 INSTRUCTION FORMULA: "[Action verb] this [content type] by [specific improvement instructions]"
 
 JSON FORMAT:
-{{
-    "content_analysis": {{
+{
+    "content_analysis": {
         "type": "What type of content this is",
         "purpose": "What it's trying to achieve",
         "current_quality": "Brief assessment",
         "improvement_potential": "Key areas for enhancement"
-    }},
+    },
     "enhancement_prompts": [
-        {{
+        {
             "prompt": "Clear enhancement instruction WITHOUT original text",
             "focus_area": "Primary improvement focus",
             "expected_impact": "What this will improve",
             "priority": "high/medium/low"
-        }},
-        {{
+        },
+        {
             "prompt": "Second enhancement instruction focusing on different aspect",
             "focus_area": "Different improvement aspect",
             "expected_impact": "Different improvement outcome",
             "priority": "high/medium/low"
-        }},
-        {{
+        },
+        {
             "prompt": "Third enhancement instruction with another angle",
             "focus_area": "Another improvement angle",
             "expected_impact": "Another improvement outcome",
             "priority": "high/medium/low"
-        }},
-        {{
+        },
+        {
             "prompt": "Fourth enhancement instruction with final dimension",
             "focus_area": "Final improvement dimension",
             "expected_impact": "Final improvement outcome",
             "priority": "high/medium/low"
-        }}
+        }
     ]
-}}
+}
 
-IMPORTANT: Do NOT include the original text in any of the enhancement prompts. Only provide the improvement instructions."""
+IMPORTANT: Do NOT include the original text in any of the enhancement prompts. Only provide the improvement instructions.
 
-        # Use GPT-4.1 as primary model with smart fallbacks
-        models_to_try = [
-            {
-                "name": "chatgpt-4o-latest",  # Latest GPT-4.1
-                "params": {
-                    "temperature": 0.1,    # Very focused for precise suggestions
-                    "max_tokens": 2500,    # Leverage the large output capacity
-                    "top_p": 0.95,        # Slight creativity for varied suggestions
-                }
-            },
-            {
-                "name": "gpt-4o",  # Strong fallback
-                "params": {
-                    "temperature": 0.2,
-                    "max_tokens": 2000
-                }
-            }
-        ]
+""",
+    dynamic="""HIGHLIGHTED TEXT TO ANALYZE:
+{selected_text}"""
+)
 
-        response = None
-        model_used = None
+@app.route('/smart-enhancements', methods=['POST'])
+@flow_view
+def smart_enhancements():
+    """Generate smart enhancement suggestions based on selected text"""
+    try:
+        request_log.info("=== Smart enhancements request started ===")
 
-        for model_config in models_to_try:
-            try:
-                model_name = model_config["name"]
-                params = model_config["params"]
+        # ADD CREDIT CHECK
+        credit_result = yield credit_check('smart_enhancements')
+        if not credit_result['success']:
+            return jsonify({
+                'error': credit_result['message'],
+                'credits_required': get_feature_credits('smart_enhancements')
+            }), 402
 
-                logging.info(f"Attempting smart enhancements with {model_name}")
+        # Parse request
+        data = request.get_json(force=True)
+        selected_text = data.get('text', '').strip()
 
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a world-class content strategist and prompt engineer. Your expertise spans writing, coding, business strategy, creative work, and technical documentation. You create enhancement instructions that deliver transformative improvements. Never include the original text in your enhancement instructions."
-                        },
-                        {
-                            "role": "user",
-                            "content": enhancement_prompt
-                        }
-                    ],
-                    **params
-                )
+        request_log.info(f"Selected text length: {len(selected_text)}")
+
+        if not selected_text:
+            return jsonify({'error': 'Selected text is required'}), 400
 
-                model_used = model_name
-                logging.info(f"✅ Smart enhancements successful with {model_name}")
-                break
+        # Head and tail of long selections, within the mode's token budget
+        budgeted_text = fit_to_budget('smart_enhancements', selected_text)
 
-            except Exception as e:
-                error_msg = str(e)
-                logging.warning(f"❌ {model_name} failed: {error_msg}")
-                continue
+        # Race GPT-4.1-class primary and fallback per the endpoint's hedge policy
+        try:
+            response = yield budgeted_policy_call(
+                'smart_enhancements', budgeted_text,
+                PROMPTS['smart_enhancements'].messages(selected_text=budgeted_text)
+            )
+            model_used = response.model
+            request_log.info(f"✅ Smart enhancements successful with {model_used}")
+        except CircuitOpenError as e:
+            # Every model's breaker is open - answer from the local fallback generator, free of charge
+            request_log.warning(f"❌ All model circuits open: {str(e)}")
+            result = {
+                'success': True,
+                'content_analysis': {"type": "Content analyzed", "purpose": "Enhancement ready"},
+                'enhancement_prompts': create_gpt41_fallback_prompts_clean(selected_text),
+                'model_used': None,
+                'fallback': True
+            }
+            waive_credits()
+            return jsonify(result)
+        except Exception as e:
+            request_log.warning(f"❌ All models failed: {str(e)}")
+            response = None
 
         if not response:
             return jsonify({
@@ -2344,12 +2639,12 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
             }), 500
 
         # Enhanced response processing
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"Generated {len(ai_response)} chars with {model_used}")
+        ai_response = response.text.strip()
+        request_log.info(f"Generated {len(ai_response)} chars with {model_used}")
 
         try:
-            # Parse JSON with enhanced quality
-            parsed_data = parse_json_response_enhanced(ai_response)
+            # Parse and check against the endpoint's schema
+            parsed_data = MODES['smart_enhancements'].schema.parse(ai_response, model_used)
 
             # Extract and validate enhancement prompts
             enhancement_prompts = parsed_data.get('enhancement_prompts', [])
@@ -2387,7 +2682,7 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
             return jsonify(result)
 
         except Exception as e:
-            logging.error(f"Response processing failed: {str(e)}")
+            request_log.error(f"Response processing failed: {str(e)}")
 
             # Create premium fallback prompts WITHOUT original text
             fallback_prompts = create_gpt41_fallback_prompts_clean(selected_text)
@@ -2410,9 +2705,9 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Smart enhancements error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Smart enhancements error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2422,16 +2717,11 @@ IMPORTANT: Do NOT include the original text in any of the enhancement prompts. O
         }), 500
 
 # Smart Actions helper functions
-def build_action_prompt(conversation, platform):
-    """Build action-focused prompt for generating actionable follow-up prompts"""
-
-    return f"""
+# Smart actions prompt - static guidance first, the conversation last
+PROMPTS.add('smart_actions', static="""
 You're helping someone continue their AI conversation by suggesting 3 action-oriented follow-up prompts they can use.
 
-CONVERSATION:
-{conversation[:1800]}
-
-Generate 3 follow-up prompts that are:
+Generate 3 follow-up prompts for the conversation below that are:
 - Action-oriented and practical (focus on "what to do" rather than "what to know")
 - Context-aware and specific to their conversation
 - Ready to copy-paste back into the AI chat
@@ -2451,27 +2741,35 @@ Guidelines:
 ✓ Each prompt should be self-contained and ready to use
 
 JSON format:
-{{
+{
     "action_prompts": [
-        {{
+        {
             "prompt": "Context-specific action-oriented prompt for the AI",
             "focus": "implementation/application/practice",
             "context": "brief description of what this targets"
-        }},
-        {{
+        },
+        {
             "prompt": "Second practical follow-up prompt",
             "focus": "planning/strategy/approach",
             "context": "what this helps with"
-        }},
-        {{
+        },
+        {
             "prompt": "Third actionable prompt for next steps",
             "focus": "execution/practice/testing",
             "context": "practical outcome"
-        }}
+        }
     ],
     "analysis": "Brief explanation of how these prompts help take action on the conversation"
-}}"""
+}
 
+""", dynamic="""CONVERSATION:
+{conversation}""")
+
+def build_action_prompt(conversation, platform):
+    """Build action-focused prompt for generating actionable follow-up prompts"""
+    return PROMPTS['smart_actions'].render(conversation=conversation)
+
+@traced('parse')
 def extract_action_prompts_from_text(text, conversation=""):
     """Fallback extraction for action prompts when JSON parsing fails"""
     prompts = []
@@ -2510,13 +2808,14 @@ def extract_action_prompts_from_text(text, conversation=""):
     return prompts[:3]
 
 @app.route('/smart-actions', methods=['POST'])
+@flow_view
 def smart_actions():
     """Generate smart action-oriented follow-up prompts based on conversation context"""
     try:
-        logging.info("=== Smart actions request started ===")
+        request_log.info("=== Smart actions request started ===")
 
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('smart_actions')
+        credit_result = yield credit_check('smart_actions')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -2528,57 +2827,50 @@ def smart_actions():
         conversation = data.get('conversation', '').strip()
         platform = data.get('platform', 'unknown')
 
-        logging.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
+        request_log.info(f"Conversation length: {len(conversation)}, Platform: {platform}")
 
         if not conversation:
             return jsonify({'error': 'Conversation content is required'}), 400
 
+        # Opening + most recent turns that fit the mode's token budget
+        context = fit_to_budget('smart_actions', conversation, trim=trim_conversation)
+
         # Build action-focused prompt
-        action_prompt = build_action_prompt(conversation, platform)
-
-        # Use reliable models with proper error handling
-        models_to_try = [
-            {
-                "name": "chatgpt-4o-latest",
-                "params": {
-                    "temperature": 0.3,
-                    "max_tokens": 800
-                }
-            },
-            {
-                "name": "gpt-3.5-turbo",
-                "params": {
-                    "temperature": 0.3,
-                    "max_tokens": 600
-                }
+        action_prompt = build_action_prompt(context, platform)
+
+        # The same user's unchanged latest exchange reuses a recent answer
+        semantic = MODES['smart_actions'].cache == CACHE_SEMANTIC
+        cache_scope = request_user_id() if semantic else None
+        cached = semantic_cache.lookup('smart_actions', context, cache_scope) if semantic else None
+        if cached is not None:
+            request_log.info("Semantic cache hit for smart actions")
+            result = dict(cached, platform=platform)
+            return jsonify(add_credit_info(result, credit_result))
+
+        # Race primary and fallback models per the endpoint's hedge policy
+        try:
+            response = yield budgeted_policy_call(
+                'smart_actions', context,
+                [{"role": "user", "content": action_prompt}]
+            )
+            model_used = response.model
+            request_log.info(f"Successfully used model: {model_used}")
+        except CircuitOpenError as e:
+            # Every model's breaker is open - answer from the local fallback generator, free of charge
+            request_log.warning(f"All model circuits open: {str(e)}")
+            result = {
+                'success': True,
+                'action_prompts': extract_action_prompts_from_text('', conversation),
+                'analysis': 'Action-oriented prompts generated',
+                'platform': platform,
+                'model': None,
+                'fallback': True
             }
-        ]
-
-        response = None
-        model_used = None
-
-        # Try models in order
-        for model_config in models_to_try:
-            try:
-                model_name = model_config["name"]
-                params = model_config["params"]
-
-                logging.info(f"Trying model: {model_name}")
-
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[{"role": "user", "content": action_prompt}],
-                    **params
-                )
-
-                model_used = model_name
-                logging.info(f"Successfully used model: {model_name}")
-                break
-
-            except Exception as e:
-                error_msg = str(e)
-                logging.warning(f"Model {model_name} failed: {error_msg}")
-                continue
+            waive_credits()
+            return jsonify(result)
+        except Exception as e:
+            request_log.warning(f"All models failed: {str(e)}")
+            response = None
 
         if not response:
             return jsonify({
@@ -2587,12 +2879,12 @@ def smart_actions():
             }), 500
 
         # Parse response
-        ai_response = response.choices[0].message.content.strip()
-        logging.info(f"AI Response length: {len(ai_response)}")
+        ai_response = response.text.strip()
+        request_log.info(f"AI Response length: {len(ai_response)}")
 
         try:
-            # Parse JSON response
-            parsed_response = parse_json_response_enhanced(ai_response)
+            # Parse and check against the endpoint's schema
+            parsed_response = MODES['smart_actions'].schema.parse(ai_response, model_used)
 
             # Extract and validate action prompts
             action_prompts = parsed_response.get('action_prompts', [])
@@ -2623,6 +2915,9 @@ def smart_actions():
                 'model': model_used
             }
 
+            if semantic:
+                semantic_cache.store('smart_actions', context, dict(result), cache_scope)
+
             if credit_result.get('credits_used'):
                 result['credits_used'] = credit_result['credits_used']
                 result['credits_remaining'] = credit_result.get('remaining')
@@ -2630,7 +2925,7 @@ def smart_actions():
             return jsonify(result)
 
         except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
+            request_log.error(f"JSON parsing failed: {str(e)}")
 
             # Fallback extraction
             action_prompts = extract_action_prompts_from_text(ai_response, conversation)
@@ -2654,9 +2949,9 @@ def smart_actions():
         error_msg = str(e)
         error_type = type(e).__name__
 
-        logging.error(f"=== Smart actions error ===")
-        logging.error(f"Error type: {error_type}")
-        logging.error(f"Error message: {error_msg}")
+        request_log.error(f"=== Smart actions error ===")
+        request_log.error(f"Error type: {error_type}")
+        request_log.error(f"Error message: {error_msg}")
 
         return jsonify({
             'success': False,
@@ -2708,7 +3003,8 @@ Please provide a JSON response with the following structure:
 Focus on being specific and practical. If the role includes level indicators (senior, junior, lead, etc.), reflect that in experience_level and adjust skills accordingly."""
 
     try:
-        response = client.chat.completions.create(
+        response = yield budgeted_call(
+            'persona_generator', keyword,
             model="chatgpt-4o-latest",
             messages=[
                 {
@@ -2721,10 +3017,10 @@ Focus on being specific and practical. If the role includes level indicators (se
                 }
             ],
             temperature=0.3,
-            max_tokens=1000
+            max_tokens=MODES['persona_generator'].max_tokens
         )
 
-        ai_response = response.choices[0].message.content.strip()
+        ai_response = response.text.strip()
 
         # Clean the response - remove markdown code blocks if present
         if "```json" in ai_response:
@@ -2737,12 +3033,12 @@ Focus on being specific and practical. If the role includes level indicators (se
             analysis_data = json.loads(ai_response)
             return analysis_data
         except json.JSONDecodeError as e:
-            logging.error(f"JSON parsing failed: {str(e)}")
-            logging.error(f"AI Response: {ai_response}")
+            request_log.error(f"JSON parsing failed: {str(e)}")
+            log_payload(payload_log, "AI analysis response", ai_response, level=logging.ERROR)
             return None
 
     except Exception as e:
-        logging.error(f"AI analysis failed: {str(e)}")
+        request_log.error(f"AI analysis failed: {str(e)}")
         return None
 
 def build_persona_from_ai_analysis(analysis_data, keyword):
@@ -2857,10 +3153,10 @@ def create_dynamic_persona_template(context):
     """Main function to create AI-powered dynamic persona"""
     keyword = context['keyword']
 
-    logging.info(f"Generating AI-powered persona for: {keyword}")
+    request_log.info(f"Generating AI-powered persona for: {keyword}")
 
     # Get AI analysis of the role
-    analysis_data = generate_ai_persona_analysis(keyword)
+    analysis_data = yield from generate_ai_persona_analysis(keyword)
 
     # Build persona template from AI analysis
     persona_template = build_persona_from_ai_analysis(analysis_data, keyword)
@@ -2940,11 +3236,12 @@ def detect_domain_context(text):
     }
 
 @app.route('/generate-persona', methods=['POST'])
+@flow_view
 def generate_persona():
     """Generate AI-powered dynamic persona template"""
     try:
         # ADD CREDIT CHECK
-        credit_result = optional_credit_check('persona_generator')
+        credit_result = yield credit_check('persona_generator')
         if not credit_result['success']:
             return jsonify({
                 'error': credit_result['message'],
@@ -2957,20 +3254,20 @@ def generate_persona():
         if not keyword:
             return jsonify({'error': 'Keyword is required'}), 400
 
-        logging.info(f"=== AI Persona Generation Started ===")
-        logging.info(f"Input keyword: {keyword}")
+        request_log.info(f"=== AI Persona Generation Started ===")
+        request_log.info(f"Input keyword: {keyword}")
 
         # Detect basic context (keeping existing function for metadata)
         context = detect_domain_context(keyword)
-        logging.info(f"Detected domain: {context['domain']}, tone: {context['tone']}")
+        request_log.info(f"Detected domain: {context['domain']}, tone: {context['tone']}")
 
         # Generate AI-powered persona
-        persona_template = create_dynamic_persona_template(context)
+        persona_template = yield from create_dynamic_persona_template(context)
 
         if not persona_template:
             raise Exception("Failed to generate persona template")
 
-        logging.info(f"=== AI Persona Generation Completed ===")
+        request_log.info(f"=== AI Persona Generation Completed ===")
 
         result = {
             'prompt': persona_template,
@@ -2991,9 +3288,9 @@ def generate_persona():
         return jsonify(result)
 
     except Exception as e:
-        logging.error(f"=== AI Persona Generation Failed ===")
-        logging.error(f"Error: {str(e)}")
-        logging.error(f"Error type: {type(e).__name__}")
+        request_log.error(f"=== AI Persona Generation Failed ===")
+        request_log.error(f"Error: {str(e)}")
+        request_log.error(f"Error type: {type(e).__name__}")
 
         return jsonify({
             'error': 'Failed to generate AI-powered persona',
@@ -3040,12 +3337,21 @@ def send_verification_email():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
 
-        print(f"📧 Sending verification email to: {email}")
+        mail_log.info(f"📧 Sending verification email to: {email}")
 
         # Send via Mailgun
         result = send_verification_email_mailgun(email, first_name)
 
-        if result["success"]:
+        if result.get("queued"):
+            # Accepted - the email workers deliver it (poll /verification-email-status)
+            return jsonify({
+                'success': True,
+                'message': 'Verification email queued',
+                'provider': 'mailgun',
+                'delivered_via': 'Mailgun (95%+ inbox rate)',
+                'job_id': result["job_id"]
+            }), 202
+        elif result["success"]:
             return jsonify({
                 'success': True,
                 'message': 'Verification email sent successfully',
@@ -3061,12 +3367,26 @@ def send_verification_email():
             }), 500
 
     except Exception as e:
-        print(f"❌ Send verification error: {e}")
+        mail_log.error(f"❌ Send verification error: {e}")
         return jsonify({
             'error': 'Failed to send verification email',
             'details': str(e)
         }), 500
 
+@app.route('/verification-email-status', methods=['GET'])
+def verification_email_status():
+    """Delivery state of a queued verification email (?job_id= from the 202 response)"""
+    job_id = request.args.get('job_id', '').strip()
+    if not job_id:
+        return jsonify({'error': 'job_id is required'}), 400
+
+    status = get_email_queue(mailgun).status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job_id'}), 404
+    if status['status'] == 'failed':
+        status['use_firebase_fallback'] = True
+    return jsonify(status)
+
 @app.route('/verify-email', methods=['GET'])
 def verify_email():
     """Verify email using token and update Firebase user"""
@@ -3083,11 +3403,11 @@ def verify_email():
             </body></html>
             """
 
-        print(f"🔐 Verifying email: {email}")
+        mail_log.info(f"🔐 Verifying email: {email}")
 
         # Verify token
         if not verify_token_v2(email, token):
-            print(f"❌ Invalid or expired token for {email}")
+            mail_log.warning(f"❌ Invalid or expired token for {email}")
             return f"""
             <html><body style="font-family: Arial; text-align: center; padding: 50px;">
             <h1 style="color: red;">❌ Verification Link Expired</h1>
@@ -3108,7 +3428,7 @@ def verify_email():
                     email_verified=True
                 )
 
-                print(f"✅ Email verified for user: {email}")
+                mail_log.info(f"✅ Email verified for user: {email}")
 
                 # Success page
                 return f"""
@@ -3130,7 +3450,7 @@ def verify_email():
                 """
 
             except auth.UserNotFoundError:
-                print(f"❌ User not found: {email}")
+                mail_log.warning(f"❌ User not found: {email}")
                 return f"""
                 <html><body style="font-family: Arial; text-align: center; padding: 50px;">
                 <h1 style="color: red;">❌ User Not Found</h1>
@@ -3139,7 +3459,7 @@ def verify_email():
                 </body></html>
                 """
             except Exception as firebase_error:
-                print(f"❌ Firebase error: {firebase_error}")
+                mail_log.error(f"❌ Firebase error: {firebase_error}")
                 return f"""
                 <html><body style="font-family: Arial; text-align: center; padding: 50px;">
                 <h1 style="color: red;">❌ Verification Error</h1>
@@ -3157,7 +3477,7 @@ def verify_email():
             """
 
     except Exception as e:
-        print(f"❌ Verification error: {e}")
+        mail_log.error(f"❌ Verification error: {e}")
         return f"""
         <html><body style="font-family: Arial; text-align: center; padding: 50px;">
         <h1 style="color: red;">❌ Server Error</h1>
@@ -3177,12 +3497,18 @@ def resend_verification():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
 
-        print(f"🔄 Resending verification email to: {email}")
+        mail_log.info(f"🔄 Resending verification email to: {email}")
 
         # Send verification email
         result = send_verification_email_mailgun(email, first_name)
 
-        if result["success"]:
+        if result.get("queued"):
+            return jsonify({
+                'success': True,
+                'message': 'Verification email queued',
+                'job_id': result["job_id"]
+            }), 202
+        elif result["success"]:
             return jsonify({
                 'success': True,
                 'message': 'Verification email resent successfully'
@@ -3195,14 +3521,15 @@ def resend_verification():
             }), 500
 
     except Exception as e:
-        print(f"❌ Resend verification error: {e}")
+        mail_log.error(f"❌ Resend verification error: {e}")
         return jsonify({
             'error': 'Failed to resend verification email',
             'details': str(e)
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Local development only - production runs through serve.py (or PythonAnywhere's WSGI)
+    app.run(debug=os.getenv('FLASK_DEBUG', 'false').lower() in ('true', '1', 'yes'))
 
 # Set application variable for PythonAnywhere
 application = app
@@ -0,0 +1,2 @@
+"""Offline benchmarks - run from the repository root, e.g. `python -m benchmarks.loadtest`,
+`python -m benchmarks.microbench` or `python -m benchmarks.fake_mailgun`"""
@@ -0,0 +1,187 @@
+"""Recorded-style LLM replies and conversation corpora for the microbenchmarks.
+
+The replies mirror what the models send back on the smart endpoints: a
+schema-constrained JSON body, a json_object reply wrapped in chatter and a
+code fence, a reply cut off at max_tokens, and plain prose for the fallback
+extractors. Conversations are built from a fixed pool of turns (code,
+marketing, writing, cooking) so every size is deterministic for a seed.
+
+    conversation(50 * 1024)          # ~50 KB "User: ... / Assistant: ..." text
+    scaled(PROSE['followups'], 4096) # a prose reply repeated to ~4 KB
+"""
+import json
+import random
+
+KB = 1024
+
+# Conversation sizes the extension sends (a short chat up to a long thread)
+CONVERSATION_SIZES = (1 * KB, 10 * KB, 50 * KB, 200 * KB)
+# Reply sizes up to roughly a 4K-token max_tokens ceiling
+REPLY_SIZES = (1 * KB, 4 * KB, 16 * KB)
+
+FOLLOWUPS_JSON = json.dumps({
+    'questions': [
+        {'text': 'Have you tried running the migration against a copy of the production database first?', 'type': 'curious'},
+        {'text': 'What happens to the in-flight requests while the index is being rebuilt?', 'type': 'practical'},
+        {'text': 'Could you walk through how the retry queue decides when a job is poisoned?', 'type': 'deeper'},
+        {'text': "What's been your biggest challenge with keeping the Redis cache consistent?", 'type': 'exploration'},
+        {'text': 'What would you recommend trying first to cut the p95 latency on the search endpoint?', 'type': 'action'},
+    ],
+    'analysis': 'The user is planning a schema migration and worries about downtime and cache consistency.',
+})
+
+ACTIONS_JSON = json.dumps({
+    'action_prompts': [
+        {'prompt': 'Help me write a step-by-step rollout plan for the new pricing page, including what to A/B test first?',
+         'focus': 'planning', 'context': 'pricing launch'},
+        {'prompt': 'Give me three subject lines for the onboarding email that reference the free trial ending?',
+         'focus': 'copywriting', 'context': 'email campaign'},
+        {'prompt': 'Walk me through setting up a retention dashboard in Amplitude for the churn cohort we discussed?',
+         'focus': 'analytics', 'context': 'churn analysis'},
+    ],
+    'analysis': 'The conversation covers a SaaS pricing change and its effect on trial conversion.',
+})
+
+ENHANCEMENTS_JSON = json.dumps({
+    'content_analysis': {
+        'type': 'prompt',
+        'purpose': 'Ask an assistant to refactor a Flask view into smaller functions',
+        'current_quality': 'Clear goal but missing constraints and examples',
+        'improvement_potential': 'high',
+    },
+    'enhancement_prompts': [
+        {'prompt': 'Refactor this Flask view into request parsing, business logic and response building, keeping the JSON contract identical',
+         'focus_area': 'structure', 'expected_impact': 'Easier to test and review', 'priority': 'high'},
+        {'prompt': 'Add type-checked validation for the request body and return 400 with a helpful message on bad input',
+         'focus_area': 'robustness', 'expected_impact': 'Fewer 500s from malformed requests', 'priority': 'high'},
+        {'prompt': 'Include a before/after example and the test cases that must keep passing after the refactor',
+         'focus_area': 'context', 'expected_impact': 'More precise answers', 'priority': 'medium'},
+        {'prompt': 'Optimize the prompt for a senior Python reviewer persona and ask for a short rationale per change',
+         'focus_area': 'persona', 'expected_impact': 'Higher quality review', 'priority': 'medium'},
+    ],
+})
+
+PERSONA_ANALYSIS = {
+    'role_title': 'Senior Data Engineer',
+    'experience_level': 'senior',
+    'core_skills': ['Designing batch and streaming pipelines', 'SQL and dimensional modelling',
+                    'Spark and Airflow orchestration', 'Data quality monitoring', 'Cost-aware cloud architecture'],
+    'communication_style': ['Explains trade-offs with concrete numbers.', 'Prefers diagrams for data flow.',
+                            'Asks about data volumes before proposing a design.'],
+    'tools_technologies': ['Apache Spark', 'Airflow', 'dbt', 'BigQuery', 'Kafka'],
+    'primary_responsibilities': ['Own the ingestion platform', 'Review pipeline designs', 'Set data SLAs with analysts'],
+    'industry_context': 'e-commerce analytics',
+    'key_phrases': ["What's the expected volume per day?", 'Let us make it idempotent first', 'Where is the source of truth?'],
+}
+
+PERSONA_KEYWORDS = ('senior python developer', 'friendly fitness coach', 'marketing strategist',
+                    'patent attorney', 'creative director for a design studio', 'beekeeper')
+
+# json_object / prompt-only replies: chatter around a fenced body
+FENCED = {
+    'followups': f"Sure! Here are some follow-up questions you might explore next:\n\n```json\n{FOLLOWUPS_JSON}\n```\n\n"
+                 "Let me know if you want them tailored to a specific audience {{like beginners}}.",
+    'actions': f"Based on the conversation {{pricing, onboarding}}, here you go:\n```json\n{ACTIONS_JSON}\n```",
+    'enhancements': f"```\n{ENHANCEMENTS_JSON}\n```\nThese should make the prompt much more specific.",
+}
+
+# Replies cut off at max_tokens - JSON parsing fails and the text extractors run
+TRUNCATED = {
+    'followups': FOLLOWUPS_JSON[:len(FOLLOWUPS_JSON) * 2 // 3],
+    'actions': ACTIONS_JSON[:len(ACTIONS_JSON) * 2 // 3],
+    'enhancements': ENHANCEMENTS_JSON[:len(ENHANCEMENTS_JSON) * 2 // 3],
+}
+
+PROSE = {
+    'followups': """Here are a few questions that could move this forward:
+
+1. Have you tried running the migration against a copy of production first?
+2. What happens to in-flight requests while the index is rebuilt?
+- Could you walk through how the retry queue decides a job is poisoned?
+• What's been the hardest part of keeping the cache consistent?
+* What would you try first to cut the p95 latency on search?
+
+These focus on risk first, then on performance.
+""",
+    'actions': """A few prompts you could send next:
+
+- "Help me write a step-by-step rollout plan for the new pricing page, including what to A/B test first?"
+- "Give me three subject lines for the onboarding email that reference the free trial ending?"
+- "Walk me through setting up a retention dashboard for the churn cohort we discussed?"
+- Create a checklist for the launch meeting with owners and deadlines, what should be on it?
+
+Pick whichever matches where you are in the launch.
+""",
+    'enhancements': """Your prompt is clear but could be sharper. Suggestions:
+
+1. Enhance the request by stating the exact Flask version and the constraints on the JSON contract
+2. Improve the structure by splitting parsing, business logic and response building into steps
+3. Add a before/after example so the assistant can match your style
+4. Include the tests that must keep passing after the refactor
+5. Optimize for a reviewer persona and ask for a short rationale for each change
+
+Overall the intent is good; the additions above mostly add context.
+""",
+}
+
+TURNS = {
+    'User': (
+        "I'm migrating our Postgres orders table to a partitioned layout. The table is about 400 GB and the API "
+        "serves roughly 2k requests per second. How do I do this without downtime?",
+        "Our React dashboard re-renders every widget when one filter changes. I've tried useMemo but it didn't help. "
+        "Here's the component:\n\nfunction Dashboard({ filters }) {\n  const data = useQuery(filters)\n  "
+        "return <Grid widgets={data.widgets} />\n}",
+        "Can you help me write a launch email for our SaaS pricing change? We're moving from per-seat to usage "
+        "pricing and the free trial drops from 30 to 14 days.",
+        "I'm writing a short story about a lighthouse keeper in Maine who finds a radio that picks up messages from "
+        "the future. The second chapter feels slow. What would you cut?",
+        "What's a good weeknight recipe with chickpeas, spinach and whatever is in a normal pantry? I have 30 minutes.",
+        "We deploy with Docker on AWS ECS and the containers get OOM-killed during the nightly report job. "
+        "Memory limit is 2 GB. Where should I start looking?",
+    ),
+    'Assistant': (
+        "For a table that size, the safest path is an online migration:\n\n1. Create the partitioned table "
+        "alongside the old one.\n2. Add a trigger that dual-writes new orders.\n3. Backfill in batches of 10k rows, "
+        "ordered by primary key, pausing when replication lag exceeds a few seconds.\n4. Verify counts and "
+        "checksums per partition.\n5. Swap the tables inside a short transaction during low traffic.\n\nKeep the "
+        "old table for a week so you can roll back.",
+        "The re-render comes from useQuery returning a new object every time. Memoize on the filter values rather "
+        "than the object identity, and wrap each widget in React.memo with a comparison on its own slice of data. "
+        "You can confirm with the React Profiler: widgets that didn't change should show as 'did not render'.",
+        "Subject: Simpler pricing that grows with you\n\nHi {first_name},\n\nStarting March 1, you'll pay for what "
+        "you use instead of per seat. Most teams your size will pay less. Trials now run 14 days, and you can extend "
+        "once from the billing page. Reply to this email if you want us to estimate your new bill.",
+        "Chapter two spends three pages on the keeper's routine before the radio speaks. Cut the inventory of the "
+        "supply shed and the weather log, keep the single detail about the cracked lens, and open on the first "
+        "static-filled message. The routine can come back later as contrast.",
+        "Try a chickpea and spinach stew: soften an onion and garlic in olive oil, add cumin and smoked paprika, "
+        "then a can of tomatoes and a drained can of chickpeas. Simmer ten minutes, stir in the spinach until it "
+        "wilts, and finish with lemon juice. Serve with bread or rice.",
+        "Start with the job's peak memory: run it locally with the same data and watch RSS. Report jobs usually "
+        "load a whole result set with pandas or an ORM. Stream the query in chunks, write the report incrementally, "
+        "and check that the container limit matches the JVM or Python heap settings you expect.",
+    ),
+}
+
+
+def conversation(size, seed=0):
+    """Alternating User/Assistant turns, cut to `size` characters"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        for role in ('User', 'Assistant'):
+            turn = f"{role}: {rng.choice(TURNS[role])}"
+            parts.append(turn)
+            length += len(turn) + 2
+    return '\n\n'.join(parts)[:size]
+
+
+def scaled(text, size):
+    """text repeated (whole paragraphs) to about `size` characters"""
+    copies = max(1, -(-size // len(text)))
+    return '\n'.join([text] * copies)[:size]
+
+
+def size_label(size):
+    return f"{size // KB}KB" if size >= KB else f"{size}B"
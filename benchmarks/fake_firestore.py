@@ -0,0 +1,234 @@
+"""In-memory stand-in for the Firestore client the backends use.
+
+Covers what the request path touches: document get/set/update, auto ids,
+batched writes with firestore.Increment and SERVER_TIMESTAMP, equality
+queries with limit() and stream(), and transactions run through
+@firestore.transactional (the warm notification build deducts credits that
+way). Transactions take a database-wide lock, so concurrent credit
+deductions serialize as they would contend in Firestore.
+
+An optional latency (same `kind:params` ms specs as fake_openai) is slept
+per round trip, so the credit path costs roughly what it does in production.
+
+    db = FakeFirestore(latency='lognormal:25,0.3')
+    db.seed_user('u1', credits=10_000)
+    backend.db, backend.FIREBASE_ENABLED = db, True
+"""
+import copy
+import threading
+import time
+import uuid
+
+from firebase_admin import firestore
+
+from benchmarks.fake_openai import Distribution
+
+
+def _apply(current, data, merge=True):
+    """Document contents after a write, resolving Increment and SERVER_TIMESTAMP"""
+    document = dict(current or {}) if merge else {}
+    for key, value in data.items():
+        if isinstance(value, firestore.Increment):
+            document[key] = document.get(key, 0) + value.value
+        elif value is firestore.SERVER_TIMESTAMP:
+            document[key] = time.time()
+        else:
+            document[key] = copy.deepcopy(value)
+    return document
+
+
+class Snapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class DocumentReference:
+    def __init__(self, db, collection, document_id):
+        self._db = db
+        self.collection_name = collection
+        self.id = document_id
+
+    @property
+    def key(self):
+        return (self.collection_name, self.id)
+
+    def get(self, transaction=None):
+        return self._db._read(self)
+
+    def set(self, data, merge=False):
+        self._db._write([('set', self, data, merge)])
+
+    def update(self, data):
+        self._db._write([('update', self, data, True)])
+
+
+class Query:
+    def __init__(self, db, collection, filters=(), limit=None):
+        self._db = db
+        self._collection = collection
+        self._filters = list(filters)
+        self._limit = limit
+
+    def where(self, field, op, value):
+        if op != '==':
+            raise NotImplementedError(f"FakeFirestore only supports == queries, not {op}")
+        return Query(self._db, self._collection, self._filters + [(field, value)], self._limit)
+
+    def limit(self, count):
+        return Query(self._db, self._collection, self._filters, count)
+
+    def stream(self):
+        return iter(self._db._query(self._collection, self._filters, self._limit))
+
+    get = stream
+
+
+class CollectionReference(Query):
+    def __init__(self, db, name):
+        super().__init__(db, name)
+        self.id = name
+
+    def document(self, document_id=None):
+        return DocumentReference(self._db, self._collection, document_id or uuid.uuid4().hex[:20])
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, True))
+
+    def commit(self):
+        self._db._write(self._writes)
+        self._writes = []
+
+
+class Transaction(WriteBatch):
+    """Duck-types the attributes @firestore.transactional drives"""
+
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+        self._locked = False
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db._lock.acquire()
+        self._locked = True
+        self._id = uuid.uuid4().bytes
+        self._db._count('transactions')
+
+    def _commit(self):
+        try:
+            self._db._write(self._writes)
+        finally:
+            self._finish()
+        return []
+
+    def _rollback(self):
+        self._finish()
+
+    def _finish(self):
+        self._clean_up()
+        if self._locked:
+            self._locked = False
+            self._db._lock.release()
+
+
+class FakeFirestore:
+    """The subset of google.cloud.firestore.Client used by the backends"""
+
+    def __init__(self, latency=None):
+        self.latency = Distribution(latency) if latency else None
+        self._documents = {}
+        self._lock = threading.RLock()
+        self._stats = {'reads': 0, 'writes': 0, 'commits': 0, 'transactions': 0, 'queries': 0}
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    # SEEDING AND INSPECTION
+    def seed_user(self, uid, credits=100000, **fields):
+        self._documents[('users', uid)] = dict(fields, credits=credits, email=fields.get('email', f'{uid}@loadtest.local'))
+
+    def document(self, collection, document_id):
+        data = self._documents.get((collection, document_id))
+        return copy.deepcopy(data) if data is not None else None
+
+    def count(self, collection):
+        return sum(1 for name, _ in list(self._documents) if name == collection)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, documents=len(self._documents))
+
+    # STORAGE
+    def _round_trip(self):
+        if self.latency is not None:
+            time.sleep(self.latency.sample() / 1000.0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _read(self, reference):
+        self._round_trip()
+        with self._lock:
+            self._stats['reads'] += 1
+            data = self._documents.get(reference.key)
+            return Snapshot(reference, copy.deepcopy(data) if data is not None else None)
+
+    def _write(self, writes):
+        if not writes:
+            return
+        self._round_trip()
+        with self._lock:
+            for op, reference, data, merge in writes:
+                if op == 'update' and reference.key not in self._documents:
+                    raise KeyError(f"No document to update: {reference.collection_name}/{reference.id}")
+            for op, reference, data, merge in writes:
+                self._documents[reference.key] = _apply(self._documents.get(reference.key), data, merge)
+            self._stats['writes'] += len(writes)
+            self._stats['commits'] += 1
+
+    def _query(self, collection, filters, limit):
+        self._round_trip()
+        with self._lock:
+            self._stats['queries'] += 1
+            matches = []
+            for (name, document_id), data in self._documents.items():
+                if name == collection and all(data.get(field) == value for field, value in filters):
+                    matches.append(Snapshot(DocumentReference(self, name, document_id), copy.deepcopy(data)))
+                    if limit and len(matches) >= limit:
+                        break
+            return matches
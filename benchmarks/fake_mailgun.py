@@ -0,0 +1,200 @@
+"""Local stand-in for the Mailgun messages API.
+
+Serves POST /v3/<domain>/messages over real HTTP with basic auth, so the
+email queue's pooled sessions, retries and backoff run as they do against
+Mailgun. Messages are kept in memory instead of being delivered.
+
+    python -m benchmarks.fake_mailgun --port 8090 --latency lognormal:400,0.5 --error-rate 0.1
+    MAILGUN_BASE_URL=http://127.0.0.1:8090/v3 MAILGUN_API_KEY=key-test python serve.py
+    curl http://127.0.0.1:8090/stats                 # request, error and message counters
+
+A share of requests (error_rate) fails with one of error_statuses: 429 and
+5xx are retried by the queue, other 4xx fail the job. Latency uses the same
+kind:params distributions as fake_openai (milliseconds).
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from benchmarks.fake_openai import Distribution
+
+ERROR_BODIES = {
+    400: "'to' parameter is not a valid address (injected by fake_mailgun)",
+    401: 'Forbidden (injected by fake_mailgun)',
+    429: 'Too many requests (injected by fake_mailgun)',
+    500: 'Internal server error (injected by fake_mailgun)',
+    503: 'Service unavailable (injected by fake_mailgun)',
+}
+
+
+class FakeMailgun:
+    """Threaded HTTP server accepting Mailgun sends"""
+
+    def __init__(self, api_key='key-test', latency='fixed:50', error_rate=0.0, error_statuses=(500, 429),
+                 seed=None):
+        self.api_key = api_key
+        self.rng = random.Random(seed)
+        self.latency = Distribution(latency, self.rng)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.messages = []
+        self.server = None
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'accepted': 0, 'errors_injected': 0, 'unauthorized': 0,
+                       'connections': 0, 'by_domain': {}}
+
+    # LIFECYCLE
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread; returns the base_url for MAILGUN_BASE_URL"""
+        fake = self
+
+        class Handler(MessagesHandler):
+            pass
+
+        Handler.fake = fake
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-mailgun', daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v3'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # SENDS
+    def injected_error(self):
+        """An HTTP status to fail this request with, or None"""
+        with self._lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_statuses)
+        return None
+
+    def accept(self, domain, fields):
+        message_id = f'<{uuid.uuid4().hex}@{domain}>'
+        with self._lock:
+            self.messages.append(dict(fields, id=message_id, domain=domain, received=time.time()))
+            self._stats['accepted'] += 1
+            self._stats['by_domain'][domain] = self._stats['by_domain'].get(domain, 0) + 1
+        return message_id
+
+    def count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def sample_latency(self):
+        with self._lock:
+            return self.latency.sample() / 1000.0
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(dict(self._stats, messages=len(self.messages))))
+
+    def describe(self):
+        return {
+            'latency_ms': self.latency.spec,
+            'error_rate': self.error_rate,
+            'error_statuses': list(self.error_statuses),
+        }
+
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    """One request to the fake API (fake is set on the per-server subclass)"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled sessions reuse connections
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.fake.count('connections')
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        try:
+            user, _, key = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+        except ValueError:
+            return False
+        return user == 'api' and key == self.fake.api_key
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            return self._send_json(200, {'config': self.fake.describe(), 'stats': self.fake.stats()})
+        self._send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'v3' or parts[2] != 'messages':
+            return self._send_json(404, {'message': 'Not found'})
+
+        fake = self.fake
+        fake.count('requests')
+        time.sleep(fake.sample_latency())
+        if not self._authorized():
+            fake.count('unauthorized')
+            return self._send_json(401, {'message': 'Forbidden'})
+
+        status = fake.injected_error()
+        if status is not None:
+            fake.count('errors_injected')
+            return self._send_json(status, {'message': ERROR_BODIES.get(status, 'Injected error')})
+
+        fields = {key: values if len(values) > 1 or key in ('to', 'o:tag') else values[0]
+                  for key, values in parse_qs(body, keep_blank_values=True).items()}
+        if not fields.get('to') or not fields.get('from'):
+            return self._send_json(400, {'message': "'to' and 'from' parameters are required"})
+        message_id = fake.accept(parts[1], fields)
+        self._send_json(200, {'id': message_id, 'message': 'Queued. Thank you.'})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the Mailgun messages API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090, help='0 picks a free port')
+    parser.add_argument('--api-key', default='key-test', help='expected MAILGUN_API_KEY')
+    parser.add_argument('--latency', default='fixed:50', help='time to accept a message, ms')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-statuses', default='500,429')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    fake = FakeMailgun(args.api_key, args.latency, args.error_rate,
+                       [int(status) for status in args.error_statuses.split(',')], args.seed)
+    print(f"🧪 Fake Mailgun on {fake.start(args.host, args.port)} {json.dumps(fake.describe())}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+        print(json.dumps(fake.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Serves POST /v1/chat/completions (plain and stream=true) over real HTTP, so
+the gateway's pooled client, retries, breakers and hedging run exactly as
+they do against OpenAI - only the model is fake.
+
+    python -m benchmarks.fake_openai --port 8089 --latency lognormal:900,0.4 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 LLM_BASE_URL=http://127.0.0.1:8089/v1 python serve.py
+    curl http://127.0.0.1:8089/stats                 # request, error and token counters
+
+Replies:
+  - response_format json_schema: an instance of the schema
+  - otherwise, a prompt containing a JSON example ("JSON format: {...}"):
+    that example echoed back, so the JSON endpoints parse it. Placeholder
+    values that are not JSON ("confidence": 0.0-1.0) become the first
+    number in them, or a string
+  - otherwise lorem text, output_tokens words long and cut at max_tokens
+    (finish_reason "length")
+
+Distributions are written kind:params in milliseconds (or tokens):
+fixed:800, uniform:200,1500, normal:900,200, lognormal:900,0.5 (median and
+sigma). Streams send one word per chunk at stream_tps words per second after
+the first-token latency. A share of requests (error_rate) fails with one of
+error_statuses before any output, as OpenAI does under load.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from json_stream import find_json
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+         'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+         'ex ea commodo consequat').split()
+
+ERROR_BODIES = {
+    429: ('rate_limit_exceeded', 'Rate limit reached (injected by fake_openai)'),
+    500: ('server_error', 'The server had an error (injected by fake_openai)'),
+    502: ('server_error', 'Bad gateway (injected by fake_openai)'),
+    503: ('server_error', 'The engine is currently overloaded (injected by fake_openai)'),
+}
+
+
+class Distribution:
+    """Sampler for `kind:params` specs; values in the spec's own unit"""
+
+    KINDS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+    def __init__(self, spec, rng=None):
+        kind, _, params = str(spec).partition(':')
+        if not params:
+            kind, params = 'fixed', kind
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown distribution {kind} (expected one of {', '.join(self.KINDS)})")
+        self.spec = f'{kind}:{params}'
+        self.kind = kind
+        self.params = [float(value) for value in params.split(',')]
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = self.rng.uniform(self.params[0], self.params[1])
+        elif self.kind == 'normal':
+            value = self.rng.gauss(self.params[0], self.params[1])
+        else:
+            value = self.params[0] * math.exp(self.rng.gauss(0, self.params[1]))
+        return max(0.0, value)
+
+
+def schema_instance(schema, index=0):
+    """A value matching a (strict-mode) JSON schema"""
+    kind = schema.get('type')
+    kind = kind[0] if isinstance(kind, list) else kind
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if kind == 'object':
+        return {key: schema_instance(value, index) for key, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [schema_instance(schema.get('items', {}), i) for i in range(3)]
+    if kind in ('number', 'integer'):
+        return 1
+    if kind == 'boolean':
+        return True
+    if kind == 'null':
+        return None
+    start = index * 5 % len(WORDS)
+    words = (WORDS[start:] + WORDS)[:12]
+    return ' '.join(words).capitalize() + '?'
+
+
+# `: value` where value is a bare placeholder rather than a JSON string, object or array
+PLACEHOLDER = re.compile(r'(:\s*)([^"\s{\[][^,}\]\n]*?)(\s*[,}\]\n])')
+
+
+def _valid_placeholder(match):
+    value = match.group(2).strip()
+    try:
+        json.loads(value)
+        return match.group(0)
+    except ValueError:
+        pass
+    number = re.search(r'-?\d+(?:\.\d+)?', value)
+    return match.group(1) + (number.group(0) if number else json.dumps(value)) + match.group(3)
+
+
+def example_json(text):
+    """The first JSON example in a prompt, with placeholder values made valid, or None"""
+    example = find_json(text)
+    if example is not None:
+        return example
+    start = text.find('{')
+    while start != -1:
+        depth = 0
+        for end in range(start, len(text)):
+            depth += {'{': 1, '}': -1}.get(text[end], 0)
+            if depth == 0:
+                try:
+                    return json.loads(PLACEHOLDER.sub(_valid_placeholder, text[start:end + 1]))
+                except ValueError:
+                    break
+        start = text.find('{', start + 1)
+    return None
+
+
+def message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        parts.append(content or '')
+    return '\n'.join(parts)
+
+
+class FakeOpenAI:
+    """Threaded HTTP server answering chat completions with synthetic output"""
+
+    def __init__(self, latency='lognormal:800,0.4', output_tokens='uniform:80,300', stream_tps=60.0,
+                 error_rate=0.0, error_statuses=(500, 429), seed=None):
+        self.rng = random.Random(seed)
+        self.latency = Distribution(latency, self.rng)
+        self.output_tokens = Distribution(output_tokens, self.rng)
+        self.stream_tps = stream_tps
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.server = None
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'streams': 0, 'errors_injected': 0, 'completion_tokens': 0,
+                       'prompt_tokens': 0, 'by_model': {}, 'json_replies': 0}
+
+    # LIFECYCLE
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread; returns the base_url for OPENAI_BASE_URL"""
+        fake = self
+
+        class Handler(CompletionHandler):
+            pass
+
+        Handler.fake = fake
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-openai', daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # REPLIES
+    def _sample(self, distribution):
+        with self._lock:
+            return distribution.sample()
+
+    def _count(self, model, stream, prompt_tokens, completion_tokens, json_reply, failed=False):
+        with self._lock:
+            stats = self._stats
+            stats['requests'] += 1
+            stats['by_model'][model] = stats['by_model'].get(model, 0) + 1
+            if failed:
+                stats['errors_injected'] += 1
+                return
+            stats['streams'] += bool(stream)
+            stats['json_replies'] += bool(json_reply)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+
+    def injected_error(self):
+        """An HTTP status to fail this request with, or None"""
+        with self._lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_statuses)
+        return None
+
+    def reply(self, body):
+        """(text, finish_reason, is_json) for one request body"""
+        response_format = body.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            schema = response_format['json_schema']['schema']
+            return json.dumps(schema_instance(schema)), 'stop', True
+
+        example = example_json(message_text(body.get('messages', [])))
+        if example is not None:
+            return json.dumps(example), 'stop', True
+        if response_format.get('type') == 'json_object':
+            return json.dumps({'result': ' '.join(WORDS[:12])}), 'stop', True
+
+        count = max(1, int(self._sample(self.output_tokens)))
+        finish_reason = 'stop'
+        max_tokens = body.get('max_tokens') or body.get('max_completion_tokens')
+        if max_tokens and count > max_tokens:
+            count, finish_reason = int(max_tokens), 'length'
+        with self._lock:
+            start = self.rng.randrange(len(WORDS))
+        words = [WORDS[(start + i) % len(WORDS)] for i in range(count)]
+        return ' '.join(words).capitalize() + '.', finish_reason, False
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def describe(self):
+        return {
+            'latency_ms': self.latency.spec,
+            'output_tokens': self.output_tokens.spec,
+            'stream_tps': self.stream_tps,
+            'error_rate': self.error_rate,
+            'error_statuses': list(self.error_statuses),
+        }
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """One request to the fake API (fake is set on the per-server subclass)"""
+
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            return self._send_json(200, {'config': self.fake.describe(), 'stats': self.fake.stats()})
+        if self.path.rstrip('/').endswith('/models'):
+            models = sorted(self.fake.stats()['by_model'])
+            return self._send_json(200, {'object': 'list', 'data': [{'id': name, 'object': 'model'} for name in models]})
+        self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+
+        fake = self.fake
+        model = body.get('model', 'unknown')
+        stream = bool(body.get('stream'))
+        time.sleep(fake._sample(fake.latency) / 1000.0)
+
+        status = fake.injected_error()
+        if status is not None:
+            fake._count(model, stream, 0, 0, False, failed=True)
+            code, message = ERROR_BODIES.get(status, ('server_error', 'Injected error'))
+            return self._send_json(status, {'error': {'message': message, 'type': code, 'code': code}})
+
+        text, finish_reason, is_json = fake.reply(body)
+        prompt_tokens = max(1, len(message_text(body.get('messages', []))) // 4)
+        completion_tokens = max(1, len(text) // 4)
+        fake._count(model, stream, prompt_tokens, completion_tokens, is_json)
+
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+        created = int(time.time())
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+        if not stream:
+            return self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': text},
+                    'finish_reason': finish_reason,
+                }],
+                'usage': usage,
+            })
+
+        # SSE until the connection closes, like the real API's chunked stream
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def chunk(delta, finish=None, **extra):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}] if delta is not None else [],
+                **extra,
+            }
+            self.wfile.write(f'data: {json.dumps(payload)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+        delay = 1.0 / fake.stream_tps if fake.stream_tps else 0.0
+        try:
+            chunk({'role': 'assistant', 'content': ''})
+            pieces = text.split(' ')
+            for index, piece in enumerate(pieces):
+                chunk({'content': piece if index == 0 else ' ' + piece})
+                if delay:
+                    time.sleep(delay)
+            chunk({}, finish_reason)
+            if (body.get('stream_options') or {}).get('include_usage'):
+                # Like the real API: one last chunk with no choices, just the usage
+                chunk(None, usage=usage)
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away mid-stream (e.g. a hedge was cancelled)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089, help='0 picks a free port')
+    parser.add_argument('--latency', default='lognormal:800,0.4', help='time to first token, ms')
+    parser.add_argument('--output-tokens', default='uniform:80,300', help='length of text replies, words')
+    parser.add_argument('--stream-tps', type=float, default=60.0, help='streamed words per second')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-statuses', default='500,429')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    fake = FakeOpenAI(args.latency, args.output_tokens, args.stream_tps, args.error_rate,
+                      [int(status) for status in args.error_statuses.split(',')], args.seed)
+    # The first line is read by benchmarks.loadtest to find the port
+    print(f"🧪 Fake OpenAI on {fake.start(args.host, args.port)} {json.dumps(fake.describe())}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+        print(json.dumps(fake.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,520 @@
+"""Offline load test: every LLM route against a fake OpenAI and a fake Firestore.
+
+    python -m benchmarks.loadtest                                  # defaults below
+    python -m benchmarks.loadtest --concurrency 64 --requests 300 --latency lognormal:1200,0.5
+    python -m benchmarks.loadtest --only smart --error-rate 0.05 --output /tmp/run.json
+    python -m benchmarks.loadtest --baseline benchmarks/results/main.json   # exit 1 on regression
+
+What runs:
+  - benchmarks.fake_openai on a local port, in a child process so its
+    threads do not compete with the servers for the GIL (--upstream
+    inprocess keeps it here, --upstream URL uses one already running).
+    OPENAI_BASE_URL / LLM_BASE_URL point both backends at it, so the real
+    gateway (pooled client, retries, breakers, hedging, budgets) is
+    exercised end to end.
+  - benchmarks.fake_firestore installed as `db` in both backends, with one
+    seeded user per --users. Requests carry a JWT for a random user, so
+    auth, the profile cache and the credit ledger (or the warm build's
+    Firestore transaction) run on every request.
+  - backend.py and the warm notification build, each on a threaded
+    werkzeug server (or backend.py in-process through asgi.py with --server asgi).
+
+Scenarios: /generate in every registered mode (plus the default path and
+streamed explain/convert), /smart-followups (plain and streamed),
+/smart-actions, /smart-enhancements, /generate-persona, and the warm build's
+/analyze-context and /synthesize-conversation. Each scenario runs --requests
+requests at --concurrency after --warmup unrecorded ones. Request text is
+random words, so the exact and semantic caches only hit by chance, as with
+real traffic.
+
+The report (JSON, --output) has per-scenario throughput, p50/p95/p99
+latency, time to first byte for streams, error rate, status counts and
+fallback answers, plus totals, fake upstream and Firestore counters, and
+the run's configuration and git commit. Compare two reports with
+--baseline; p95 latency or throughput worse by more than --tolerance, or
+error rate up by more than 1 point, fails the run.
+"""
+import argparse
+import asyncio
+import atexit
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fake_firestore import FakeFirestore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WARM_BACKEND_PATH = os.path.join(REPO_ROOT, 'backedn(withwarmnotification).py')
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+VOCABULARY = ('project team budget deadline launch customer feedback design prototype server database '
+              'query latency cache deploy release bug crash memory thread python react api endpoint token '
+              'model prompt essay chapter story character plot research paper citation dataset training '
+              'marketing campaign email newsletter audience growth pricing invoice contract hiring interview '
+              'resume portfolio garden recipe travel budget workout habit sleep meditation guitar lesson '
+              'language grammar vocabulary exam schedule meeting agenda roadmap milestone metric dashboard '
+              'churn retention onboarding tutorial documentation refactor migration schema index backup').split()
+
+# 1x1 transparent PNG - image modes take a data URL as the topic
+TINY_PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA'
+            'WjR9awAAAABJRU5ErkJggg==')
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+# REQUEST TEXT
+def words(rng, count):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(count))
+
+
+def conversation(rng, turns=4):
+    lines = []
+    for turn in range(turns):
+        role = 'User' if turn % 2 == 0 else 'AI'
+        lines.append(f"{role}: {words(rng, rng.randint(12, 40)).capitalize()}{'?' if role == 'User' else '.'}")
+    return '\n\n'.join(lines)
+
+
+# SCENARIOS
+class Scenario:
+    """One route + payload shape to load"""
+
+    def __init__(self, name, app, path, payload, stream=False):
+        self.name = name
+        self.app = app          # 'backend' or 'warm'
+        self.path = path
+        self.payload = payload  # rng -> JSON body
+        self.stream = stream
+
+
+def generate_payload(mode, stream=False):
+    def payload(rng):
+        topic = TINY_PNG if mode.startswith('image') else words(rng, rng.randint(15, 60))
+        body = {'topic': topic, 'mode': mode, 'tone': 'professional', 'length': 'balanced'}
+        if stream:
+            body['stream'] = True
+        return body
+    return payload
+
+
+def build_scenarios(backend):
+    scenarios = []
+    for entry in backend.MODES.describe():
+        if entry['handler']:
+            scenarios.append(Scenario(f"generate:{entry['mode']}", 'backend', '/generate',
+                                      generate_payload(entry['mode'])))
+    scenarios.append(Scenario('generate:default', 'backend', '/generate', generate_payload('enhance')))
+    for mode in ('explain_story', 'convert_balanced'):
+        scenarios.append(Scenario(f'generate:{mode}+stream', 'backend', '/generate',
+                                  generate_payload(mode, stream=True), stream=True))
+
+    scenarios += [
+        Scenario('smart-followups', 'backend', '/smart-followups',
+                 lambda rng: {'conversation': conversation(rng), 'platform': 'chatgpt'}),
+        Scenario('smart-followups+stream', 'backend', '/smart-followups',
+                 lambda rng: {'conversation': conversation(rng), 'platform': 'chatgpt', 'stream': True},
+                 stream=True),
+        Scenario('smart-actions', 'backend', '/smart-actions',
+                 lambda rng: {'conversation': conversation(rng), 'platform': 'claude'}),
+        Scenario('smart-enhancements', 'backend', '/smart-enhancements',
+                 lambda rng: {'text': words(rng, rng.randint(30, 120))}),
+        Scenario('generate-persona', 'backend', '/generate-persona',
+                 lambda rng: {'text': words(rng, 2)}),
+        Scenario('analyze-context', 'warm', '/analyze-context',
+                 lambda rng: {'input_text': words(rng, rng.randint(10, 40)), 'platform': 'chatgpt',
+                              'timestamp': int(time.time() * 1000)}),
+        Scenario('synthesize-conversation', 'warm', '/synthesize-conversation',
+                 lambda rng: {'inputs': [{'text': words(rng, rng.randint(8, 30))} for _ in range(rng.randint(2, 5))],
+                              'platform': 'chatgpt', 'sessionId': f'session-{rng.randrange(10 ** 6)}'}),
+    ]
+    return scenarios
+
+
+# APPS UNDER TEST
+def load_apps(args, fake_db):
+    """Import both backends against the fakes (environment must be set first)"""
+    import backend
+
+    spec = importlib.util.spec_from_file_location('warm_backend', WARM_BACKEND_PATH)
+    warm = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(warm)
+
+    for module in (backend, warm):
+        module.db = fake_db
+        module.FIREBASE_ENABLED = True
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    return backend, warm
+
+
+class ServerThread:
+    """Threaded werkzeug server for one WSGI app on a free local port"""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, name='loadtest-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class Upstream:
+    """The fake OpenAI the backends call, wherever it runs"""
+
+    def __init__(self, args):
+        self.process = None
+        self.fake = None
+        if args.upstream == 'inprocess':
+            self.fake = FakeOpenAI(args.latency, args.output_tokens, args.stream_tps, args.error_rate,
+                                   [int(status) for status in args.error_statuses.split(',')], args.seed)
+            self.base_url = self.fake.start()
+        elif args.upstream == 'subprocess':
+            command = [sys.executable, '-m', 'benchmarks.fake_openai', '--port', '0',
+                       '--latency', args.latency, '--output-tokens', args.output_tokens,
+                       '--stream-tps', str(args.stream_tps), '--error-rate', str(args.error_rate),
+                       '--error-statuses', args.error_statuses, '--seed', str(args.seed)]
+            self.process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+            match = re.search(r'(http://\S+/v1)', self.process.stdout.readline())
+            if match is None:
+                self.process.kill()
+                raise RuntimeError("benchmarks.fake_openai did not report its address")
+            self.base_url = match.group(1)
+        else:
+            self.base_url = args.upstream.rstrip('/')
+
+    def report(self):
+        """{'config': ..., 'stats': ...} from the fake, or None if it cannot say"""
+        if self.fake is not None:
+            return {'config': self.fake.describe(), 'stats': self.fake.stats()}
+        try:
+            import httpx
+            return httpx.get(self.base_url[:-len('/v1')] + '/stats', timeout=10).json()
+        except Exception as e:
+            logging.warning(f"Upstream stats unavailable: {e}")
+            return None
+
+    def stop(self):
+        if self.fake is not None:
+            self.fake.stop()
+            self.fake = None
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+            self.process = None
+
+
+# MEASUREMENT
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(p * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    summary = {'mean': round(sum(ordered) / len(ordered), 2) if ordered else None}
+    for p in PERCENTILES:
+        value = percentile(ordered, p)
+        summary[f'p{int(p * 100)}'] = round(value, 2) if value is not None else None
+    summary['max'] = round(ordered[-1], 2) if ordered else None
+    return summary
+
+
+class Sample:
+    __slots__ = ('status', 'latency_ms', 'ttfb_ms', 'ok', 'fallback', 'error')
+
+    def __init__(self, status, latency_ms, ttfb_ms, ok, fallback=False, error=None):
+        self.status = status
+        self.latency_ms = latency_ms
+        self.ttfb_ms = ttfb_ms
+        self.ok = ok
+        self.fallback = fallback
+        self.error = error
+
+
+async def send(client, scenario, body, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    start = time.perf_counter()
+    try:
+        async with client.stream('POST', scenario.path, json=body, headers=headers) as response:
+            ttfb = None
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = (time.perf_counter() - start) * 1000
+                chunks.append(chunk)
+        latency = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        latency = (time.perf_counter() - start) * 1000
+        return Sample(None, latency, None, False, error=f'{type(e).__name__}: {e}'[:200])
+
+    text = b''.join(chunks).decode('utf-8', 'replace')
+    if response.status_code >= 400:
+        return Sample(response.status_code, latency, ttfb, False, error=text[:200])
+    if scenario.stream:
+        ok = 'event: done' in text and 'event: error' not in text
+        return Sample(response.status_code, latency, ttfb, ok, '"fallback": true' in text,
+                      None if ok else text[-200:])
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return Sample(response.status_code, latency, ttfb, False, error=f'non-JSON body: {text[:120]}')
+    ok = payload.get('success', True) is not False and 'error' not in payload
+    return Sample(response.status_code, latency, ttfb, ok, bool(payload.get('fallback')),
+                  None if ok else json.dumps(payload)[:200])
+
+
+async def run_scenario(client, scenario, args, tokens, rng):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            return await send(client, scenario, scenario.payload(rng), rng.choice(tokens))
+
+    if args.warmup:
+        await asyncio.gather(*[one() for _ in range(args.warmup)])
+
+    started = time.perf_counter()
+    samples = await asyncio.gather(*[one() for _ in range(args.requests)])
+    wall = time.perf_counter() - started
+    return scenario_report(scenario, samples, wall)
+
+
+def scenario_report(scenario, samples, wall):
+    ok = [sample for sample in samples if sample.ok]
+    statuses = {}
+    errors = {}
+    for sample in samples:
+        key = str(sample.status) if sample.status is not None else 'exception'
+        statuses[key] = statuses.get(key, 0) + 1
+        if not sample.ok and sample.error and len(errors) < 5:
+            errors.setdefault(sample.error, 0)
+            errors[sample.error] += 1
+
+    report = {
+        'route': scenario.path,
+        'app': scenario.app,
+        'stream': scenario.stream,
+        'requests': len(samples),
+        'ok': len(ok),
+        'errors': len(samples) - len(ok),
+        'error_rate': round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        'fallbacks': sum(1 for sample in ok if sample.fallback),
+        'duration_s': round(wall, 3),
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'latency_ms': summarize([sample.latency_ms for sample in ok]),
+        'statuses': statuses,
+        'error_samples': errors,
+    }
+    if scenario.stream:
+        report['ttfb_ms'] = summarize([sample.ttfb_ms for sample in ok if sample.ttfb_ms is not None])
+    return report
+
+
+def totals(reports, wall):
+    requests = sum(report['requests'] for report in reports.values())
+    errors = sum(report['errors'] for report in reports.values())
+    return {
+        'requests': requests,
+        'errors': errors,
+        'error_rate': round(errors / requests, 4) if requests else 0.0,
+        'fallbacks': sum(report['fallbacks'] for report in reports.values()),
+        'duration_s': round(wall, 3),
+    }
+
+
+# REGRESSION CHECK
+def compare(report, baseline, tolerance):
+    """Human-readable regressions of report against baseline"""
+    regressions = []
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        before, after = previous['latency_ms'].get('p95'), current['latency_ms'].get('p95')
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before}ms -> {after}ms")
+        before, after = previous.get('throughput_rps'), current.get('throughput_rps')
+        if before and after and after < before * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before} -> {after} req/s")
+        if current['error_rate'] > previous['error_rate'] + 0.01:
+            regressions.append(f"{name}: error rate {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_table(report):
+    print(f"\n{'scenario':<34}{'req':>6}{'err%':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'fb':>5}")
+    for name, row in report['scenarios'].items():
+        latency = row['latency_ms']
+        print(f"{name:<34}{row['requests']:>6}{row['error_rate'] * 100:>6.1f}%{row['throughput_rps'] or 0:>9.1f}"
+              f"{latency['p50'] or 0:>9.0f}{latency['p95'] or 0:>9.0f}{latency['p99'] or 0:>9.0f}{row['fallbacks']:>5}")
+    total = report['totals']
+    print(f"\n{total['requests']} requests, {total['error_rate']:.2%} errors, {total['fallbacks']} fallbacks "
+          f"in {total['duration_s']}s")
+
+
+# ENTRY POINT
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test against fake OpenAI and Firestore')
+    parser.add_argument('--concurrency', type=int, default=32, help='in-flight requests per scenario')
+    parser.add_argument('--requests', type=int, default=100, help='recorded requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='unrecorded requests per scenario')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run scenarios whose name contains this (repeatable)')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                        help='serve backend.py with threaded werkzeug or in-process through asgi.py')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--upstream', default='subprocess',
+                        help='fake OpenAI: subprocess, inprocess, or the base URL of one already running')
+    parser.add_argument('--latency', default='lognormal:800,0.4', help='fake OpenAI time to first token, ms')
+    parser.add_argument('--output-tokens', default='uniform:80,300', help='fake text reply length, words')
+    parser.add_argument('--stream-tps', type=float, default=80.0, help='fake streamed words per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls that fail')
+    parser.add_argument('--error-statuses', default='500,429')
+    parser.add_argument('--firestore-latency', default='lognormal:20,0.3', help='per round trip, ms ("" for none)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='report path (default benchmarks/results/loadtest-<time>.json)')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95/throughput regression')
+    parser.add_argument('--verbose', action='store_true', help='keep the backends\' INFO logging')
+    return parser.parse_args(argv)
+
+
+async def drive(args, scenarios, backend_target, warm_url, tokens):
+    import httpx
+
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(120.0)
+    async with httpx.AsyncClient(base_url=warm_url, limits=limits, timeout=timeout) as warm_client, \
+            httpx.AsyncClient(limits=limits, timeout=timeout, **backend_target) as backend_client:
+        reports = {}
+        for scenario in scenarios:
+            client = warm_client if scenario.app == 'warm' else backend_client
+            print(f"▶ {scenario.name}: {args.requests} requests at concurrency {args.concurrency}")
+            reports[scenario.name] = await run_scenario(client, scenario, args, tokens, rng)
+        return reports
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    upstream = Upstream(args)
+    atexit.register(upstream.stop)
+    base_url = upstream.base_url
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-loadtest',
+        'OPENAI_BASE_URL': base_url,
+        'LLM_BASE_URL': base_url,
+        'LLM_BACKEND': 'openai',
+        'CREDIT_LEDGER_PATH': os.path.join(workdir, 'credit_ledger.sqlite3'),
+        'RESPONSE_CACHE_PATH': os.path.join(workdir, 'response_cache.sqlite3'),
+    })
+
+    fake_db = FakeFirestore(args.firestore_latency or None)
+    backend, warm = load_apps(args, fake_db)
+
+    import jwt
+    tokens = []
+    for index in range(args.users):
+        uid = f'loadtest-{index}'
+        fake_db.seed_user(uid, credits=10 ** 9)
+        tokens.append(jwt.encode({'uid': uid, 'exp': int(time.time()) + 86400}, 'loadtest', algorithm='HS256'))
+
+    scenarios = build_scenarios(backend)
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if any(part in scenario.name for part in args.only)]
+    if not scenarios:
+        print("No scenarios match --only")
+        return 2
+
+    servers = [ServerThread(warm.app).start()]
+    if args.server == 'asgi':
+        import httpx
+        import asgi
+        backend_target = {'transport': httpx.ASGITransport(app=asgi.application), 'base_url': 'http://backend'}
+    else:
+        servers.append(ServerThread(backend.app).start())
+        backend_target = {'base_url': servers[-1].url}
+
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    started = time.perf_counter()
+    try:
+        reports = asyncio.run(drive(args, scenarios, backend_target, servers[0].url, tokens))
+        upstream_report = upstream.report()
+    finally:
+        for server in servers:
+            server.stop()
+        upstream.stop()
+    wall = time.perf_counter() - started
+
+    # Settle the ledger so the Firestore counters include the batched deductions
+    from credit_ledger import CREDIT_LEDGER_ENABLED, get_credit_ledger
+    if CREDIT_LEDGER_ENABLED:
+        get_credit_ledger(fake_db).flush()
+    charged = sum(10 ** 9 - (fake_db.document('users', f'loadtest-{index}') or {}).get('credits', 10 ** 9)
+                  for index in range(args.users))
+
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': vars(args),
+        },
+        'totals': totals(reports, wall),
+        'scenarios': reports,
+        'upstream': upstream_report,
+        'firestore': dict(fake_db.stats(), credits_charged=charged),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print_table(report)
+    print(f"📄 Report written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"❌ Regression: {line}")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
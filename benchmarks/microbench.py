@@ -0,0 +1,259 @@
+"""Microbenchmarks for the pure-Python helpers every request runs.
+
+    python -m benchmarks.microbench                                  # all cases
+    python -m benchmarks.microbench --only extract_key_terms --rounds 10
+    python -m benchmarks.microbench --baseline benchmarks/results/microbench-main.json   # exit 1 on regression
+
+Each case calls one helper on a corpus from benchmarks.corpus: recorded-style
+LLM replies (schema JSON, fenced json_object replies, replies cut off at
+max_tokens, prose for the fallback extractors) and conversations of 1 KB to
+200 KB. Timing follows pytest-benchmark: the call count per round is
+calibrated to --round-time, then --rounds rounds are timed and reported as
+min/max/mean/stddev/median/iqr seconds per call and ops per second.
+Allocations are measured on one extra call under tracemalloc: peak bytes
+allocated during the call and bytes still held after it (the result).
+
+The report (JSON, --output) keeps the same stats names as pytest-benchmark
+plus the memory figures. Compare with --baseline; a median time or peak
+allocation worse by more than --tolerance fails the run.
+"""
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+from benchmarks import corpus
+from benchmarks.loadtest import RESULTS_DIR, git_commit
+
+
+class Case:
+    def __init__(self, group, label, fn, *args):
+        self.group = group
+        self.name = f"{group}[{label}]"
+        self.fn = fn
+        self.args = args
+
+    def __call__(self):
+        return self.fn(*self.args)
+
+
+def swallow(fn):
+    """fn that returns its exception instead of raising (failed parses are part of the workload)"""
+    def call(*args):
+        try:
+            return fn(*args)
+        except ValueError as e:
+            return e
+    return call
+
+
+def build_cases():
+    """Every benchmark case, grouped by helper"""
+    # backend.py builds its app and clients at import; keep that quiet
+    logging.disable(logging.WARNING)
+    try:
+        import backend
+    finally:
+        logging.disable(logging.NOTSET)
+    from json_stream import JSONStreamParser, extract_json
+    from output_schemas import ACTIONS_SCHEMA, ENHANCEMENTS_SCHEMA, FOLLOWUPS_SCHEMA
+    from token_budget import count_tokens, trim_conversation
+
+    schemas = {'followups': FOLLOWUPS_SCHEMA, 'actions': ACTIONS_SCHEMA, 'enhancements': ENHANCEMENTS_SCHEMA}
+    recorded = {'followups': corpus.FOLLOWUPS_JSON, 'actions': corpus.ACTIONS_JSON,
+                'enhancements': corpus.ENHANCEMENTS_JSON}
+    conversations = {size: corpus.conversation(size) for size in corpus.CONVERSATION_SIZES}
+
+    def stream_parse(text, chunk=64):
+        parser = JSONStreamParser()
+        for start in range(0, len(text), chunk):
+            if parser.feed(text[start:start + chunk]):
+                break
+        return parser.value
+
+    cases = []
+
+    # JSON extraction (what parse_json_response_enhanced became) and schema validation
+    for kind, schema in schemas.items():
+        cases.append(Case('extract_json', f'{kind}-schema', extract_json, recorded[kind]))
+        cases.append(Case('extract_json', f'{kind}-fenced', extract_json, corpus.FENCED[kind]))
+        cases.append(Case('extract_json', f'{kind}-truncated', swallow(extract_json), corpus.TRUNCATED[kind]))
+        cases.append(Case('schema_parse', f'{kind}-gpt-4o', schema.parse, recorded[kind], 'gpt-4o'))
+        cases.append(Case('schema_parse', f'{kind}-fenced-gpt-3.5', schema.parse, corpus.FENCED[kind], 'gpt-3.5-turbo'))
+    cases.append(Case('json_stream_feed', 'followups-64B-chunks', stream_parse, corpus.FOLLOWUPS_JSON))
+
+    # Fallback extractors, on prose replies up to a max_tokens-sized body
+    for size in corpus.REPLY_SIZES:
+        label = corpus.size_label(size)
+        cases.append(Case('extract_questions_from_text', label, backend.extract_questions_from_text,
+                          corpus.scaled(corpus.PROSE['followups'], size)))
+        cases.append(Case('extract_suggestions_from_text_enhanced', label,
+                          backend.extract_suggestions_from_text_enhanced,
+                          corpus.scaled(corpus.PROSE['enhancements'], size)))
+        cases.append(Case('extract_action_prompts_from_text', label, backend.extract_action_prompts_from_text,
+                          corpus.scaled(corpus.PROSE['actions'], size), conversations[corpus.CONVERSATION_SIZES[0]]))
+
+    # Conversation-sized inputs
+    for size, text in conversations.items():
+        label = corpus.size_label(size)
+        cases.append(Case('extract_key_terms', label, backend.extract_key_terms, text))
+        cases.append(Case('detect_domain_context', label, backend.detect_domain_context, text))
+        cases.append(Case('count_tokens', label, count_tokens, text))
+        cases.append(Case('trim_conversation', label, trim_conversation, text, backend.MODES['smart_followups'].prompt_tokens or 2000))
+
+    # Persona building
+    for keyword in corpus.PERSONA_KEYWORDS[:3]:
+        cases.append(Case('detect_domain_context', keyword.replace(' ', '-'), backend.detect_domain_context, keyword))
+    cases.append(Case('build_persona_from_ai_analysis', 'analysis', backend.build_persona_from_ai_analysis,
+                      corpus.PERSONA_ANALYSIS, corpus.PERSONA_ANALYSIS['role_title']))
+    cases.append(Case('build_persona_from_ai_analysis', 'fallback', backend.build_persona_from_ai_analysis,
+                      None, 'beekeeper'))
+    return cases
+
+
+# MEASUREMENT
+def calibrate(timer, round_time):
+    """Calls per round so one round takes at least round_time seconds"""
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= round_time:
+            return number
+        number = max(number * 2, int(number * round_time / max(elapsed, 1e-9) * 1.2))
+
+
+def allocations(case):
+    """Peak and retained bytes for one call"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = case()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'peak_bytes': peak - before, 'retained_bytes': current - before}
+
+
+def measure(case, rounds, round_time):
+    timer = timeit.Timer(case)
+    case()  # warm regex and import caches outside the timed rounds
+    number = calibrate(timer, round_time)
+    times = [elapsed / number for elapsed in timer.repeat(repeat=rounds, number=number)]
+    quartiles = statistics.quantiles(times, n=4) if len(times) > 1 else [times[0]] * 3
+    median = statistics.median(times)
+    stats = {
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.fmean(times),
+        'stddev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'median': median,
+        'iqr': quartiles[2] - quartiles[0],
+        'ops': 1.0 / median if median else None,
+        'rounds': rounds,
+        'iterations': number,
+    }
+    return {'group': case.group, 'stats': stats, 'memory': allocations(case)}
+
+
+# REGRESSION CHECK
+def compare(report, baseline, tolerance):
+    """Human-readable regressions of report against baseline"""
+    regressions = []
+    for name, current in report['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        before, after = previous['stats']['median'], current['stats']['median']
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{name}: median {before * 1e6:.1f}µs -> {after * 1e6:.1f}µs")
+        before, after = previous['memory']['peak_bytes'], current['memory']['peak_bytes']
+        # A few hundred bytes of jitter is the allocator, not the code
+        if after > before * (1 + tolerance) + 512:
+            regressions.append(f"{name}: peak allocation {before} -> {after} bytes")
+    return regressions
+
+
+def print_row(name, result):
+    stats, memory = result['stats'], result['memory']
+    spread = stats['stddev'] / stats['mean'] * 100 if stats['mean'] else 0
+    print(f"{name:<58}{stats['median'] * 1e6:>12.1f}{stats['min'] * 1e6:>12.1f}{spread:>7.1f}%"
+          f"{stats['ops']:>12.0f}{memory['peak_bytes'] / 1024:>11.1f}")
+
+
+# ENTRY POINT
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the per-request helpers')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run cases whose name contains this (repeatable)')
+    parser.add_argument('--rounds', type=int, default=7, help='timed rounds per case')
+    parser.add_argument('--round-time', type=float, default=0.05, help='minimum seconds per round')
+    parser.add_argument('--list', action='store_true', help='list case names and exit')
+    parser.add_argument('--output', help='report path (default benchmarks/results/microbench-<time>.json)')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed median time/peak memory regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = build_cases()
+    if args.only:
+        cases = [case for case in cases if any(part in case.name for part in args.only)]
+    if args.list:
+        for case in cases:
+            print(case.name)
+        return 0
+    if not cases:
+        print("No cases match --only")
+        return 2
+
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    started = time.perf_counter()
+    print(f"\n{'case':<58}{'median µs':>12}{'min µs':>12}{'±':>8}{'ops/s':>12}{'peak KB':>11}")
+    results = {}
+    for case in cases:
+        results[case.name] = measure(case, args.rounds, args.round_time)
+        print_row(case.name, results[case.name])
+
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': vars(args),
+            'duration_s': round(time.perf_counter() - started, 3),
+        },
+        'benchmarks': results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"microbench-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\n📄 Report written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"❌ Regression: {line}")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Per-model circuit breakers with latency-aware health tracking.
+
+Every completion records its outcome against the model's breaker. A breaker
+opens when, over the last BREAKER_WINDOW calls, the share of failures - errors,
+timeouts, and calls slower than BREAKER_SLOW_CALL_SECONDS - reaches
+BREAKER_FAILURE_RATE. While open, calls to that model fail immediately with
+CircuitOpenError, so hedge policies skip straight to the fallback model and
+the smart endpoints serve their local fallback generators. After
+BREAKER_OPEN_SECONDS the breaker half-opens and lets a few probe calls through;
+enough successful probes close it again, a failed probe re-opens it.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from model_policy import RollingWindow
+
+# BREAKER CONFIGURATION
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '50'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '20'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', '2'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose breaker is open"""
+
+
+class CircuitBreaker:
+    """Rolling error-rate breaker for one model"""
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds=BREAKER_OPEN_SECONDS, half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)  # True = failure
+        self._latency = RollingWindow(window * 4)
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.total_calls = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def allow(self):
+        """Reserve permission to call the model; False while open"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record_success(self, latency):
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            self._latency.add(latency)
+            self.total_calls += 1
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if slow:
+                    self._trip()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(slow)
+            if slow:
+                self.total_failures += 1
+            self._evaluate()
+
+    def record_failure(self, latency, error=None):
+        with self._lock:
+            if latency is not None:
+                self._latency.add(latency)
+            self.total_calls += 1
+            self.total_failures += 1
+            self.last_error = str(error)[:200] if error is not None else self.last_error
+            if self.state == HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append(True)
+            self._evaluate()
+
+    def release(self):
+        """Call ended without a verdict (e.g. cancelled hedge loser that had answered)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _evaluate(self):
+        if len(self._outcomes) < self.min_calls:
+            return
+        if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+            self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._outcomes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+            state = self.state
+            if state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                state = HALF_OPEN
+            return {
+                'model': self.name,
+                'state': state,
+                'error_rate': round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0,
+                'window_calls': len(outcomes),
+                'latency_p50': self._latency.percentile(0.5),
+                'latency_p95': self._latency.percentile(0.95),
+                'latency_p99': self._latency.percentile(0.99),
+                'total_calls': self.total_calls,
+                'total_failures': self.total_failures,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+                'open_for_seconds': round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else None,
+            }
+
+
+class BreakerRegistry:
+    """One breaker per model name, created on first use"""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(model, CircuitBreaker(model, **self.settings))
+        return breaker
+
+    def snapshot(self):
+        return [breaker.snapshot() for breaker in list(self._breakers.values())]
@@ -0,0 +1,433 @@
+"""Local credit ledger with batched Firestore settlement.
+
+check_and_deduct_credits used to run a Firestore transaction (and write a
+transactions/ document) before any LLM work started. The ledger instead
+reserves credits in a local sqlite journal against a periodically synced copy
+of each user's balance, lets the request proceed immediately, and a
+background thread flushes the deductions plus their transaction log entries
+to Firestore in batched writes every CREDIT_LEDGER_FLUSH_MS.
+
+Overspend guarantee: a user may never hold more than CREDIT_LEDGER_FLOAT
+credits of unsettled deductions. A reservation that would exceed the float
+settles that user synchronously and re-reads the Firestore balance first, so
+writes made outside this ledger (purchases, other hosts) can be outrun by at
+most the float. The float is checked again under BEGIN IMMEDIATE, and if
+in-flight reservations still hold too much the request is refused (a single
+reservation larger than the float is allowed when nothing else is
+unsettled). The journal is shared by every worker process on the host.
+
+Two-phase use: reserve() holds credits without charging them, commit()
+marks the reservation for the next flush (a local UPDATE - the Firestore
+write is shared with every other commit in the batch) and release() drops it,
+so a request that fails never costs the user anything. Reservations nobody
+settles within CREDIT_RESERVATION_TTL (worker killed mid-request) are
+released by the flusher.
+
+Every worker process on the host flushes. A flusher claims its batch under
+BEGIN IMMEDIATE (COMMITTED -> FLUSHING, stamped with a claim id), so no
+entry is ever in two batches and charged twice.
+
+Reconciliation: a claim older than CREDIT_FLUSH_LEASE_SECONDS belongs to a
+flusher that died mid-batch. Its entries are checked against their
+transactions/{entry_id} document (written in the same atomic batch as the
+balance increment) and either marked settled or flushed again. Live
+claims of other workers are never touched.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from firebase_admin import firestore
+
+# LEDGER CONFIGURATION
+CREDIT_LEDGER_ENABLED = os.getenv('CREDIT_LEDGER_ENABLED', 'true').lower() in ('true', '1', 'yes')
+CREDIT_LEDGER_PATH = os.getenv('CREDIT_LEDGER_PATH', 'credit_ledger.sqlite3')
+CREDIT_LEDGER_FLUSH_MS = int(os.getenv('CREDIT_LEDGER_FLUSH_MS', '500'))
+CREDIT_LEDGER_FLOAT = int(os.getenv('CREDIT_LEDGER_FLOAT', '30'))
+CREDIT_LEDGER_SYNC_SECONDS = float(os.getenv('CREDIT_LEDGER_SYNC_SECONDS', '60'))
+CREDIT_RESERVATION_TTL = float(os.getenv('CREDIT_RESERVATION_TTL', '300'))
+# Must outlast a Firestore batch commit, retries included
+CREDIT_FLUSH_LEASE_SECONDS = float(os.getenv('CREDIT_FLUSH_LEASE_SECONDS', '300'))
+
+# Firestore allows 500 writes per batch; each entry is a transaction doc plus its share of a user update
+FIRESTORE_BATCH_WRITES = 450
+
+# Entry states
+RESERVED = 'reserved'     # held for an in-flight request, not charged yet
+COMMITTED = 'committed'   # deducted locally, waiting for the next flush
+FLUSHING = 'flushing'     # in a Firestore batch that has not been confirmed yet
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS balances (
+    uid TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id TEXT PRIMARY KEY,
+    uid TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    remaining INTEGER,
+    claimer TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS entries_by_user ON entries (uid, status);
+CREATE INDEX IF NOT EXISTS entries_by_status ON entries (status, created);
+'''
+
+# Journals created before flush claims existed
+MIGRATIONS = (
+    'ALTER TABLE entries ADD COLUMN claimer TEXT',
+    'ALTER TABLE entries ADD COLUMN claimed_at REAL',
+)
+
+
+class CreditLedger:
+    """Reserve credits locally; settle them with Firestore in batches"""
+
+    def __init__(self, db, path=CREDIT_LEDGER_PATH, flush_ms=CREDIT_LEDGER_FLUSH_MS,
+                 float_credits=CREDIT_LEDGER_FLOAT, sync_seconds=CREDIT_LEDGER_SYNC_SECONDS,
+                 reservation_ttl=CREDIT_RESERVATION_TTL, lease_seconds=CREDIT_FLUSH_LEASE_SECONDS):
+        self.db = db
+        self.path = path
+        self.flush_interval = flush_ms / 1000.0
+        self.float_credits = float_credits
+        self.sync_seconds = sync_seconds
+        self.reservation_ttl = reservation_ttl
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(entries)')}
+            for statement in MIGRATIONS:
+                if statement.split()[-2] not in columns:
+                    conn.execute(statement)
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_by_claim ON entries (claimer)')
+        self.reconcile()
+
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _unsettled(self, conn, uid, statuses=(RESERVED, COMMITTED, FLUSHING)):
+        marks = ','.join('?' * len(statuses))
+        row = conn.execute(
+            f'SELECT COALESCE(SUM(amount), 0) FROM entries WHERE uid = ? AND status IN ({marks})',
+            (uid, *statuses)
+        ).fetchone()
+        return row[0]
+
+
+    def _read_firestore_balance(self, uid):
+        user_doc = self.db.collection('users').document(uid).get()
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict().get('credits', 0)
+
+    def _needs_sync(self, uid):
+        row = self.conn.execute('SELECT synced_at FROM balances WHERE uid = ?', (uid,)).fetchone()
+        return row is None or time.time() - row[0] > self.sync_seconds
+
+    def pending(self, uid):
+        """Credits reserved or deducted locally but not yet settled in Firestore"""
+        return self._unsettled(self.conn, uid)
+
+    def sync_balance(self, uid, known_balance=None):
+        """Refresh the local balance from Firestore (or a value just read from it)"""
+        # Flushing entries may or may not be in Firestore yet - settle them first
+        if self._unsettled(self.conn, uid, (FLUSHING,)):
+            self.flush(uid)
+
+        # A caller-supplied balance is only trusted when nothing of ours is unsettled
+        if known_balance is None or self._unsettled(self.conn, uid):
+            known_balance = self._read_firestore_balance(uid)
+        balance = known_balance
+        if balance is None:
+            return None
+        self.conn.execute(
+            'INSERT OR REPLACE INTO balances (uid, balance, synced_at) VALUES (?, ?, ?)',
+            (uid, balance, time.time())
+        )
+        return balance
+
+
+    def reserve(self, uid, feature, amount, known_balance=None):
+        """Hold credits for a request; returns the same shape as check_and_deduct_credits"""
+        self.start()
+
+        if self._needs_sync(uid):
+            if self.sync_balance(uid, known_balance) is None:
+                return {'success': False, 'message': 'User not found'}
+
+        # Keep unsettled deductions within the float before taking more
+        if self._unsettled(self.conn, uid) + amount > self.float_credits:
+            self.flush(uid)
+            if self.sync_balance(uid) is None:
+                return {'success': False, 'message': 'User not found'}
+
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT balance FROM balances WHERE uid = ?', (uid,)).fetchone()
+            balance = row[0] if row else 0
+            unsettled = self._unsettled(conn, uid)
+            available = balance - unsettled
+
+            # Reservations still in flight can't be settled early - wait for them
+            if unsettled and unsettled + amount > self.float_credits:
+                conn.execute('ROLLBACK')
+                return {
+                    'success': False,
+                    'message': 'Too many requests in progress, please retry shortly',
+                    'current_credits': available
+                }
+
+            if available < amount:
+                conn.execute('ROLLBACK')
+                return {
+                    'success': False,
+                    'message': f'Insufficient credits. Need {amount}, have {available}',
+                    'current_credits': available
+                }
+
+            entry_id = uuid.uuid4().hex
+            remaining = available - amount
+            conn.execute(
+                'INSERT INTO entries (id, uid, feature, amount, status, created, remaining) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (entry_id, uid, feature, amount, RESERVED, time.time(), remaining)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return {
+            'success': True,
+            'credits_used': amount,
+            'remaining': remaining,
+            'reservation_id': entry_id
+        }
+
+    def commit(self, reservation_id):
+        """Charge a reservation; it reaches Firestore with the next batch"""
+        cursor = self.conn.execute(
+            'UPDATE entries SET status = ? WHERE id = ? AND status = ?',
+            (COMMITTED, reservation_id, RESERVED)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, reservation_id):
+        """Give reserved credits back; nothing was ever written to Firestore"""
+        cursor = self.conn.execute(
+            'DELETE FROM entries WHERE id = ? AND status = ?', (reservation_id, RESERVED)
+        )
+        return cursor.rowcount == 1
+
+    def expire_reservations(self):
+        """Release reservations whose request never settled them"""
+        cursor = self.conn.execute(
+            'DELETE FROM entries WHERE status = ? AND created < ?',
+            (RESERVED, time.time() - self.reservation_ttl)
+        )
+        if cursor.rowcount:
+            logging.warning(f"Credit ledger released {cursor.rowcount} abandoned reservations")
+        return cursor.rowcount
+
+
+    def flush(self, uid=None):
+        """Write committed deductions to Firestore in batches; returns entries settled"""
+        with self._flush_lock:
+            settled = 0
+            while True:
+                claim, rows = self._claim(uid)
+                if not rows:
+                    return settled
+                self._settle(claim, rows)
+                settled += len(rows)
+
+    def _claim(self, uid=None):
+        """Atomically move the next batch of committed entries to FLUSHING under a fresh claim id"""
+        claim = uuid.uuid4().hex
+        query = 'SELECT id FROM entries WHERE status = ?'
+        args = [COMMITTED]
+        if uid is not None:
+            query += ' AND uid = ?'
+            args.append(uid)
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                f'UPDATE entries SET status = ?, claimer = ?, claimed_at = ? '
+                f'WHERE status = ? AND id IN ({query} ORDER BY created LIMIT ?)',
+                (FLUSHING, claim, time.time(), COMMITTED, *args, FIRESTORE_BATCH_WRITES // 2)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        rows = conn.execute(
+            'SELECT id, uid, feature, amount, remaining FROM entries WHERE claimer = ? AND status = ?',
+            (claim, FLUSHING)
+        ).fetchall()
+        return claim, rows
+
+    def _settle(self, claim, rows):
+        totals = {}
+        batch = self.db.batch()
+        for entry_id, uid, feature, amount, remaining in rows:
+            totals[uid] = totals.get(uid, 0) + amount
+            batch.set(self.db.collection('transactions').document(entry_id), {
+                'userId': uid,
+                'feature': feature,
+                'creditsUsed': amount,
+                'timestamp': firestore.SERVER_TIMESTAMP,
+                'creditsRemaining': remaining
+            })
+        for uid, total in totals.items():
+            batch.update(self.db.collection('users').document(uid), {
+                'credits': firestore.Increment(-total),
+                'lastUpdated': firestore.SERVER_TIMESTAMP
+            })
+
+        try:
+            batch.commit()
+        except Exception as e:
+            # Nothing was applied (batches are atomic) - retry on the next flush
+            logging.warning(f"Credit ledger flush failed, will retry: {e}")
+            self._requeue(claim)
+            raise
+
+        self._mark_settled(claim)
+
+    def _requeue(self, claim, entry_id=None):
+        """Hand claimed entries back to the next flush"""
+        query = 'UPDATE entries SET status = ?, claimer = NULL, claimed_at = NULL WHERE claimer = ? AND status = ?'
+        args = [COMMITTED, claim, FLUSHING]
+        if entry_id is not None:
+            query += ' AND id = ?'
+            args.append(entry_id)
+        self.conn.execute(query, args)
+
+    def _mark_settled(self, claim):
+        """Drop the claim's entries and apply them to the local balances"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            totals = conn.execute(
+                'SELECT uid, SUM(amount) FROM entries WHERE claimer = ? AND status = ? GROUP BY uid',
+                (claim, FLUSHING)
+            ).fetchall()
+            conn.execute('DELETE FROM entries WHERE claimer = ? AND status = ?', (claim, FLUSHING))
+            for uid, total in totals:
+                conn.execute('UPDATE balances SET balance = balance - ? WHERE uid = ?', (total, uid))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def reconcile(self):
+        """Resolve entries whose flusher died mid-batch (claim lease expired)"""
+        now = time.time()
+        conn = self.conn
+        stale = conn.execute(
+            'SELECT 1 FROM entries WHERE status = ? AND (claimed_at IS NULL OR claimed_at < ?) LIMIT 1',
+            (FLUSHING, now - self.lease_seconds)
+        ).fetchone()
+        if stale is None:
+            return
+
+        claim = uuid.uuid4().hex
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'UPDATE entries SET claimer = ?, claimed_at = ? '
+                'WHERE status = ? AND (claimed_at IS NULL OR claimed_at < ?)',
+                (claim, now, FLUSHING, now - self.lease_seconds)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        rows = conn.execute('SELECT id FROM entries WHERE claimer = ? AND status = ?', (claim, FLUSHING)).fetchall()
+
+        for (entry_id,) in rows:
+            try:
+                applied = self.db.collection('transactions').document(entry_id).get().exists
+            except Exception as e:
+                # Still claimed; picked up again once this claim's lease runs out
+                logging.warning(f"Credit ledger reconcile deferred: {e}")
+                return
+            if not applied:
+                self._requeue(claim, entry_id)
+        # What is left under the claim reached Firestore
+        self._mark_settled(claim)
+        if rows:
+            logging.info(f"Credit ledger reconciled {len(rows)} abandoned in-flight entries")
+
+
+    def start(self):
+        if self._thread is None:
+            with self._flush_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='credit-ledger', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.expire_reservations()
+                self.reconcile()
+                self.flush()
+            except Exception as e:
+                logging.warning(f"Credit ledger background flush error: {e}")
+
+    def stop(self):
+        """Stop the flusher and settle everything still pending"""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.warning(f"Credit ledger final flush failed (kept in journal): {e}")
+
+    def stats(self):
+        rows = self.conn.execute(
+            'SELECT status, COUNT(*), COALESCE(SUM(amount), 0) FROM entries GROUP BY status'
+        ).fetchall()
+        return {status: {'entries': count, 'credits': total} for status, count, total in rows}
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_credit_ledger(db):
+    """Process-wide ledger bound to the Firestore client"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = CreditLedger(db)
+    return _ledger
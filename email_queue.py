@@ -0,0 +1,344 @@
+"""Durable background queue for Mailgun sends.
+
+/send-verification-email and /resend-verification used to call
+requests.post to Mailgun inside the request. Each one held a worker thread
+for the whole round trip, or for up to 30s when Mailgun was slow. Now the
+view builds the message, enqueue() writes it to a local sqlite journal, and
+the view answers 202 at once. EMAIL_WORKERS threads send the messages:
+  - Each worker has its own requests.Session with keep-alive, so the TLS
+    connection to Mailgun is reused across sends.
+  - Timeouts, connection errors, 429 and 5xx are retried with exponential
+    backoff and jitter, up to EMAIL_MAX_ATTEMPTS. Other 4xx (bad address,
+    bad key) fail at once.
+  - A job claimed by a worker that died mid-send goes back to the queue
+    once its EMAIL_LEASE_SECONDS lease runs out. Delivery is at-least-once.
+  - Every worker process on the host shares the journal. Claims are made
+    under BEGIN IMMEDIATE, so each job is sent by exactly one worker at a
+    time.
+  - Jobs left queued by an earlier process are sent once this process
+    starts its workers (on its first enqueue or status lookup).
+
+Only one job per dedupe_key can be waiting at a time (e.g. one per address).
+A double-clicked "resend" therefore sends one email.
+
+status(job_id) reports queued/sending/sent/failed. The frontend can poll it
+and fall back to Firebase's own verification email when a job has failed.
+EMAIL_QUEUE_ENABLED=false sends inline through the same pooled client.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# EMAIL QUEUE CONFIGURATION
+EMAIL_QUEUE_ENABLED = os.getenv('EMAIL_QUEUE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+EMAIL_QUEUE_PATH = os.getenv('EMAIL_QUEUE_PATH', 'email_queue.sqlite3')
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', '2'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', '2'))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv('EMAIL_RETRY_MAX_SECONDS', '300'))
+EMAIL_SEND_TIMEOUT = float(os.getenv('EMAIL_SEND_TIMEOUT', '10'))
+EMAIL_LEASE_SECONDS = float(os.getenv('EMAIL_LEASE_SECONDS', '120'))
+EMAIL_POLL_SECONDS = float(os.getenv('EMAIL_POLL_SECONDS', '1'))
+EMAIL_RETENTION_HOURS = float(os.getenv('EMAIL_RETENTION_HOURS', '72'))
+
+# Job states
+QUEUED = 'queued'     # waiting for next_attempt
+SENDING = 'sending'   # claimed by a worker until lease_until
+SENT = 'sent'
+FAILED = 'failed'     # gave up (permanent error or out of attempts)
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    dedupe_key TEXT,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt);
+CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (dedupe_key, status);
+'''
+
+
+class SendError(Exception):
+    """A Mailgun send that failed; `retryable` says whether to try again"""
+
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class MailgunClient:
+    """POST /messages over a pooled keep-alive session (one session per thread)"""
+
+    def __init__(self, api_key, domain, base_url, timeout=EMAIL_SEND_TIMEOUT):
+        self.api_key = api_key
+        self.domain = domain
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.auth = ('api', self.api_key)
+        return session
+
+    def send(self, message):
+        """Deliver one message (Mailgun form fields); raises SendError"""
+        if not self.api_key or not self.domain:
+            raise SendError('Mailgun API key or domain not configured', retryable=False)
+        try:
+            response = self.session.post(f"{self.base_url}/{self.domain}/messages", data=message,
+                                         timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            raise SendError('Email service timeout', retryable=True)
+        except requests.exceptions.ConnectionError:
+            raise SendError('Failed to connect to email service', retryable=True)
+        except requests.exceptions.RequestException as e:
+            raise SendError(f'Email service error: {e}', retryable=False)
+
+        if response.status_code == 200:
+            return response
+        raise SendError(f'Mailgun API error: {response.status_code} - {response.text[:200]}',
+                        retryable=response.status_code in RETRYABLE_STATUSES)
+
+    def close(self):
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            session.close()
+            self._local.session = None
+
+
+class EmailQueue:
+    """Journal outgoing emails in sqlite; a worker pool sends them with retries"""
+
+    def __init__(self, client, path=EMAIL_QUEUE_PATH, workers=EMAIL_WORKERS, max_attempts=EMAIL_MAX_ATTEMPTS,
+                 retry_base=EMAIL_RETRY_BASE_SECONDS, retry_max=EMAIL_RETRY_MAX_SECONDS,
+                 lease_seconds=EMAIL_LEASE_SECONDS, poll_seconds=EMAIL_POLL_SECONDS):
+        self.client = client
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_prune = 0.0
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def enqueue(self, message, dedupe_key=None):
+        """Journal a message for the workers; returns its job id"""
+        self.start()
+        now = time.time()
+        recipient = ', '.join(message['to']) if isinstance(message.get('to'), list) else str(message.get('to'))
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if dedupe_key:
+                row = conn.execute('SELECT id FROM jobs WHERE dedupe_key = ? AND status = ?',
+                                   (dedupe_key, QUEUED)).fetchone()
+                if row:
+                    # The waiting job gets the newest message (e.g. a fresh token)
+                    conn.execute('UPDATE jobs SET message = ?, updated = ? WHERE id = ?',
+                                 (json.dumps(message), now, row[0]))
+                    conn.execute('COMMIT')
+                    return row[0]
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO jobs (id, dedupe_key, recipient, message, status, next_attempt, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, dedupe_key, recipient, json.dumps(message), QUEUED, now, now, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def send_now(self, message):
+        """Send inline (queue disabled); returns {'success', 'message'}"""
+        try:
+            self.client.send(message)
+            return {'success': True, 'message': 'Email sent'}
+        except SendError as e:
+            logging.error(f"❌ Email send failed: {e}")
+            return {'success': False, 'message': str(e)}
+
+    def status(self, job_id):
+        self.start()
+        row = self.conn.execute(
+            'SELECT status, attempts, next_attempt, created, updated, last_error FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, attempts, next_attempt, created, updated, last_error = row
+        result = {'job_id': job_id, 'status': status, 'attempts': attempts, 'created': created, 'updated': updated}
+        if status == QUEUED and attempts:
+            result['next_attempt_in'] = round(max(0.0, next_attempt - time.time()), 1)
+        if last_error:
+            result['last_error'] = last_error
+        return result
+
+    def claim(self):
+        """Take the next due job (id, attempts, message) or None"""
+        now = time.time()
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose worker died mid-send go back to the queue
+            conn.execute('UPDATE jobs SET status = ?, lease_until = NULL WHERE status = ? AND lease_until < ?',
+                         (QUEUED, SENDING, now))
+            row = conn.execute(
+                'SELECT id, attempts, message FROM jobs WHERE status = ? AND next_attempt <= ? '
+                'ORDER BY next_attempt LIMIT 1', (QUEUED, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated = ? '
+                             'WHERE id = ?', (SENDING, now + self.lease_seconds, now, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], row[1] + 1, json.loads(row[2])
+
+    def backoff(self, attempts):
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay * (0.5 + random.random() / 2)
+
+    def process(self, job_id, attempts, message):
+        """Send one claimed job and record the outcome"""
+        now = time.time()
+        try:
+            self.client.send(message)
+        except SendError as e:
+            if e.retryable and attempts < self.max_attempts:
+                delay = self.backoff(attempts)
+                logging.warning(f"Email job {job_id} attempt {attempts} failed ({e}), retrying in {delay:.1f}s")
+                self.conn.execute(
+                    'UPDATE jobs SET status = ?, next_attempt = ?, lease_until = NULL, updated = ?, last_error = ? '
+                    'WHERE id = ?', (QUEUED, now + delay, now, str(e), job_id))
+            else:
+                logging.error(f"❌ Email job {job_id} failed after {attempts} attempt(s): {e}")
+                self.conn.execute(
+                    'UPDATE jobs SET status = ?, lease_until = NULL, updated = ?, last_error = ? WHERE id = ?',
+                    (FAILED, now, str(e), job_id))
+            return False
+
+        self.conn.execute('UPDATE jobs SET status = ?, lease_until = NULL, updated = ? WHERE id = ?',
+                          (SENT, time.time(), job_id))
+        return True
+
+    def prune(self):
+        """Drop finished jobs older than EMAIL_RETENTION_HOURS"""
+        cursor = self.conn.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?',
+            (SENT, FAILED, time.time() - EMAIL_RETENTION_HOURS * 3600)
+        )
+        return cursor.rowcount
+
+    def start(self):
+        if not self._threads:
+            with self._lock:
+                if not self._threads:
+                    for index in range(self.workers):
+                        thread = threading.Thread(target=self._run, name=f'email-worker-{index}', daemon=True)
+                        thread.start()
+                        self._threads.append(thread)
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.claim()
+                if job is None:
+                    if time.time() - self._last_prune > 3600:
+                        self._last_prune = time.time()
+                        self.prune()
+                    with self._wake:
+                        self._wake.wait(self.poll_seconds)
+                    continue
+                self.process(*job)
+            except Exception as e:
+                logging.warning(f"Email worker error: {e}")
+                self._stop.wait(self.poll_seconds)
+        self.client.close()
+
+    def stop(self, timeout=None):
+        """Stop the workers after their current send; queued jobs stay in the journal"""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout if timeout is not None else self.client.timeout + 1)
+
+    def stats(self):
+        rows = self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {'workers': len(self._threads), 'jobs': dict(rows)}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_email_queue(client):
+    """Process-wide queue sending through `client` (the first caller's client wins)"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = EmailQueue(client)
+    return _queue
+
+
+def stop_email_queue():
+    """Let in-flight sends finish (worker shutdown); does nothing if no queue was created"""
+    if _queue is not None:
+        _queue.stop()
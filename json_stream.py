@@ -0,0 +1,198 @@
+"""Incremental JSON extraction from LLM output.
+
+Models wrap their JSON in code fences or a sentence of prose, and the
+endpoints used to dig it out after the whole response had arrived: a brace
+counter that ignored strings (so a "}" inside a question broke it), a second
+string-aware copy, and find('{')/rfind('}') in the warm notification build.
+
+JSONStreamParser consumes the response as it streams in:
+  - everything before the first '{' (fences, prose) is skipped
+  - braces inside strings and escaped quotes are handled
+  - when the candidate object closes but is not valid JSON (e.g. a "{name}"
+    placeholder in a leading sentence) the search resumes after it
+  - each element of a watched top-level array (e.g. "questions") is
+    returned by feed() as soon as its closing bracket arrives, so a streamed
+    response can show the first follow-up before the model finishes
+
+    parser = JSONStreamParser(arrays=('questions',))
+    for delta in deltas:
+        for key, item in parser.feed(delta):
+            ...                         # ('questions', {"text": ..., "type": ...})
+    data = parser.close()               # the whole object, or JSONDecodeError
+
+extract_json(text) and find_json(text) are the one-shot versions.
+"""
+import json
+import re
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class _Frame:
+    """One open object or array"""
+
+    __slots__ = ('kind', 'key', 'expect_key', 'stream_key', 'item_start')
+
+    def __init__(self, kind, stream_key=None):
+        self.kind = kind
+        self.key = None
+        self.expect_key = kind == '{'
+        self.stream_key = stream_key   # set on a watched array
+        self.item_start = None         # where its current element began
+
+
+class JSONStreamParser:
+    """Finds the first complete JSON object in streamed text"""
+
+    def __init__(self, arrays=()):
+        self.arrays = set(arrays)
+        self.value = None
+        self.done = False
+        self._buffer = ''
+        self._pos = 0
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+
+    def feed(self, chunk):
+        """Add text; returns [(array_key, element), ...] completed by it"""
+        if self.done or not chunk:
+            return []
+        self._buffer += chunk
+        return self._scan()
+
+    def close(self):
+        """The parsed object; JSONDecodeError when none was completed"""
+        if self.done:
+            return self.value
+        if self._start is None:
+            raise json.JSONDecodeError("No JSON found", self._buffer, 0)
+        raise json.JSONDecodeError("Incomplete JSON", self._buffer, self._start)
+
+    def _scan(self):
+        events = []
+        buffer = self._buffer
+        i = self._pos
+        end = len(buffer)
+
+        while i < end:
+            if self._start is None:
+                i = buffer.find('{', i)
+                if i == -1:
+                    i = end
+                    break
+                self._start = i
+                self._stack = [_Frame('{')]
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(buffer, i)
+                if match is None:
+                    i = end
+                    break
+                i = match.start()
+                if buffer[i] == '\\':
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    self._string_closed(i, events)
+                i += 1
+                continue
+
+            char = buffer[i]
+            top = self._stack[-1]
+
+            if char == '"':
+                self._item_begins(top, i)
+                self._in_string = True
+                self._string_start = i
+
+            elif char == '{' or char == '[':
+                self._item_begins(top, i)
+                stream_key = None
+                if char == '[' and len(self._stack) == 1 and top.key in self.arrays:
+                    stream_key = top.key
+                self._stack.append(_Frame(char, stream_key))
+
+            elif char == '}' or char == ']':
+                frame = self._stack.pop()
+                if frame.stream_key and frame.item_start is not None:
+                    self._emit(frame, frame.item_start, i, events)
+                if not self._stack:
+                    if self._finish(i):
+                        self._pos = i + 1
+                        return events
+                    # Not JSON after all - look for the next object after its '{'
+                    i = self._start + 1
+                    self._start = None
+                    continue
+                parent = self._stack[-1]
+                if parent.stream_key and parent.item_start is not None:
+                    self._emit(parent, parent.item_start, i + 1, events)
+
+            elif char == ',':
+                if top.kind == '{':
+                    top.expect_key = True
+                elif top.stream_key and top.item_start is not None:
+                    self._emit(top, top.item_start, i, events)
+
+            elif char == ':':
+                top.expect_key = False
+
+            elif not char.isspace():
+                self._item_begins(top, i)
+
+            i += 1
+
+        self._pos = i
+        return events
+
+    def _item_begins(self, frame, index):
+        if frame.stream_key and frame.item_start is None:
+            frame.item_start = index
+
+    def _string_closed(self, index, events):
+        top = self._stack[-1]
+        if top.kind == '{' and top.expect_key:
+            try:
+                top.key = json.loads(self._buffer[self._string_start:index + 1])
+            except ValueError:
+                top.key = None
+        elif top.stream_key and top.item_start == self._string_start:
+            self._emit(top, top.item_start, index + 1, events)
+
+    def _emit(self, frame, start, stop, events):
+        frame.item_start = None
+        try:
+            events.append((frame.stream_key, json.loads(self._buffer[start:stop])))
+        except ValueError:
+            pass
+
+    def _finish(self, index):
+        try:
+            self.value = json.loads(self._buffer[self._start:index + 1])
+        except ValueError:
+            return False
+        self.done = True
+        return True
+
+
+def extract_json(text):
+    """First complete JSON object in text; raises json.JSONDecodeError"""
+    parser = JSONStreamParser()
+    parser.feed(text)
+    return parser.close()
+
+
+def find_json(text):
+    """First complete JSON object in text, or None"""
+    parser = JSONStreamParser()
+    parser.feed(text)
+    return parser.value
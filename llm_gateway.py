@@ -0,0 +1,593 @@
+"""Shared LLM gateway - every chat completion in backend.py goes through here.
+
+Completions run on one asyncio event loop in a background thread, backed by a
+single pooled HTTP/2 client. Flask worker threads hand their request to that
+loop and wait on a future, so one process can keep hundreds of completions in
+flight instead of one per thread. Async callers can await acomplete() directly.
+Identical concurrent requests are coalesced into one upstream call
+(see single_flight.py).
+
+The backend is swappable: LLM_BACKEND=local (or use_backend(LocalBackend()))
+replaces OpenAI with an in-process stand-in for offline load testing.
+"""
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import httpx
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+from circuit_breaker import BreakerRegistry, CircuitOpenError
+from model_policy import RollingWindow
+from single_flight import SingleFlight, fingerprint
+from tracing import KIND_CLIENT, span
+from usage_meter import record_usage
+
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# GATEWAY CONFIGURATION
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+LLM_BASE_URL = os.getenv('LLM_BASE_URL') or None
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '200'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '50'))
+LLM_DEFAULT_DEADLINE = float(os.getenv('LLM_DEFAULT_DEADLINE', '30'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_LOCAL_LATENCY_MS = float(os.getenv('LLM_LOCAL_LATENCY_MS', '50'))
+LLM_COALESCE = os.getenv('LLM_COALESCE', 'true').lower() in ('true', '1', 'yes')
+
+
+class LLMTimeoutError(Exception):
+    """Raised when a completion does not finish before its deadline"""
+
+
+class AllModelsFailedError(Exception):
+    """Raised when every model in a policy failed"""
+
+
+class LLMResult:
+    """Text and metadata of one finished completion"""
+
+    __slots__ = ('text', 'model', 'usage', 'latency', 'finish_reason')
+
+    def __init__(self, text, model, usage=None, latency=0.0, finish_reason=None):
+        self.text = text or ''
+        self.model = model
+        self.usage = usage
+        self.latency = latency
+        self.finish_reason = finish_reason
+
+
+class RetryPolicy:
+    """Shared retry policy: exponential backoff with jitter on transient errors"""
+
+    RETRYABLE = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+    def __init__(self, max_retries=LLM_MAX_RETRIES, base_delay=0.25, max_delay=4.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        return attempt < self.max_retries and isinstance(error, self.RETRYABLE)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+
+class OpenAIBackend:
+    """Async OpenAI client on a pooled HTTP/2 connection"""
+
+    def __init__(self, api_key=None, base_url=LLM_BASE_URL):
+        self.api_key = api_key if api_key is not None else os.getenv('OPENAI_API_KEY', '')
+        self.base_url = base_url
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so the connection pool lives on the gateway loop
+        if self._client is None:
+            http_client = DefaultAsyncHttpxClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                ),
+            )
+            # Retries are owned by the gateway so every call site shares one policy
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,
+            )
+        return self._client
+
+    async def complete(self, model, messages, params, timeout):
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout,
+            **params
+        )
+        choice = response.choices[0]
+        return LLMResult(
+            text=choice.message.content,
+            model=response.model or model,
+            usage=response.usage,
+            finish_reason=choice.finish_reason,
+        )
+
+    async def stream(self, model, messages, params, timeout, outcome=None):
+        """Yield text deltas as the model produces them; the final usage and finish
+        reason go in outcome['usage'] and outcome['finish_reason']"""
+        if outcome is not None:
+            params = dict(params, stream_options={'include_usage': True})
+        chunks = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout,
+            stream=True,
+            **params
+        )
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if outcome is not None:
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        outcome['finish_reason'] = chunk.choices[0].finish_reason
+                    if getattr(chunk, 'usage', None):
+                        outcome['usage'] = chunk.usage
+        finally:
+            await chunks.close()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class LocalBackend:
+    """Offline stand-in for OpenAI - answers after a simulated latency.
+
+    `responder(model, messages, params)` returns the completion text; the
+    default echoes the last user message so every endpoint gets a response.
+    Streams emit `chunk_size` characters every `chunk_delay` seconds.
+    """
+
+    def __init__(self, latency=LLM_LOCAL_LATENCY_MS / 1000.0, responder=None,
+                 chunk_size=16, chunk_delay=0.0):
+        self.latency = latency
+        self.responder = responder or self.echo
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+    @staticmethod
+    def echo(model, messages, params):
+        content = messages[-1]['content'] if messages else ''
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        return f"[local:{model}] {content[:500]}"
+
+    async def complete(self, model, messages, params, timeout):
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        return LLMResult(
+            text=self.responder(model, messages, params),
+            model=model,
+            finish_reason='stop',
+        )
+
+    async def stream(self, model, messages, params, timeout, outcome=None):
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        text = self.responder(model, messages, params)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        if outcome is not None:
+            outcome['finish_reason'] = 'stop'
+
+    async def close(self):
+        pass
+
+
+class LLMGateway:
+    """Runs completions on a background event loop with deadlines and retries"""
+
+    def __init__(self, backend, retry_policy=None, default_deadline=LLM_DEFAULT_DEADLINE,
+                 coalesce=LLM_COALESCE):
+        self.backend = backend
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.default_deadline = default_deadline
+        self.coalesce = coalesce
+        self.single_flight = SingleFlight()
+        self.first_token_latency = {}  # model name -> RollingWindow
+        self.breakers = BreakerRegistry()
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def use_backend(self, backend):
+        """Swap the upstream backend (e.g. LocalBackend for load tests)"""
+        old_backend, self.backend = self.backend, backend
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(old_backend.close(), self._loop)
+        return old_backend
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(
+                        target=loop.run_forever, name='llm-gateway', daemon=True
+                    )
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    async def _complete(self, model, messages, deadline, params):
+        """Call the backend through the model's circuit breaker"""
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{model} circuit is open")
+
+        started = time.monotonic()
+        try:
+            result = await self._complete_with_retries(model, messages, deadline, params)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record_failure(time.monotonic() - started, e)
+            raise
+        breaker.record_success(result.latency)
+        record_usage(model, result.usage, messages, result.text, result.latency)
+        return result
+
+    async def _complete_with_retries(self, model, messages, deadline, params):
+        """Call the backend, retrying transient errors until the deadline"""
+        started = time.monotonic()
+        expires = started + deadline
+        attempt = 0
+
+        while True:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeoutError(f"{model} exceeded {deadline:.1f}s deadline")
+
+            try:
+                result = await asyncio.wait_for(
+                    self.backend.complete(model, messages, params, remaining),
+                    timeout=remaining,
+                )
+                result.latency = time.monotonic() - started
+                return result
+
+            except asyncio.TimeoutError:
+                raise LLMTimeoutError(f"{model} exceeded {deadline:.1f}s deadline")
+
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+                if time.monotonic() + delay >= expires:
+                    raise
+                logging.warning(f"LLM call to {model} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _coalesced(self, model, messages, deadline, params):
+        """Identical concurrent requests share one upstream completion"""
+        if not self.coalesce:
+            return await self._complete(model, messages, deadline, params)
+        key = fingerprint(model, messages, params)
+        return await self.single_flight.do(
+            key, lambda: self._complete(model, messages, deadline, params)
+        )
+
+    async def _stream(self, model, messages, deadline, params, outcome=None):
+        """Yield deltas until the deadline; retries only happen before the first token.
+        A finished stream leaves its usage and finish reason in outcome"""
+        expires = time.monotonic() + deadline
+        attempt = 0
+
+        while True:
+            emitted = False
+            started = time.monotonic()
+            reported = {}
+            text = []
+            chunks = self.backend.stream(model, messages, params, max(expires - time.monotonic(), 0.001), reported)
+            try:
+                while True:
+                    remaining = expires - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMTimeoutError(f"{model} exceeded {deadline:.1f}s deadline")
+                    try:
+                        delta = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                    except StopAsyncIteration:
+                        if outcome is not None:
+                            outcome.update(reported)
+                        return
+                    except asyncio.TimeoutError:
+                        raise LLMTimeoutError(f"{model} exceeded {deadline:.1f}s deadline")
+                    emitted = True
+                    text.append(delta)
+                    yield delta
+
+            except LLMTimeoutError:
+                raise
+
+            except Exception as e:
+                if emitted or not self.retry_policy.should_retry(e, attempt):
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+                if time.monotonic() + delay >= expires:
+                    raise
+                logging.warning(f"LLM stream from {model} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+            finally:
+                await chunks.aclose()
+                # Cut-off streams (hedge losers, clients gone) are billed for what they produced
+                if emitted or reported:
+                    record_usage(model, reported.get('usage'), messages, ''.join(text), time.monotonic() - started)
+
+    async def _guarded_stream(self, model, messages, deadline, params, outcome=None):
+        """_stream through the model's circuit breaker, as _complete does for completions"""
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{model} circuit is open")
+
+        started = time.monotonic()
+        try:
+            async for delta in self._stream(model, messages, deadline, params, outcome):
+                yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            # The caller stopped reading (client gone) - no verdict on the model
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record_failure(time.monotonic() - started, e)
+            raise
+        breaker.record_success(time.monotonic() - started)
+
+    def _first_token_window(self, model):
+        window = self.first_token_latency.get(model)
+        if window is None:
+            window = self.first_token_latency.setdefault(model, RollingWindow())
+        return window
+
+    async def _collect(self, option, messages, expires, first_token):
+        """Stream one model to completion, flagging its first token"""
+        with span('llm.attempt', KIND_CLIENT, model=option.name):
+            return await self._collect_model(option, messages, expires, first_token)
+
+    async def _collect_model(self, option, messages, expires, first_token):
+        breaker = self.breakers.get(option.name)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{option.name} circuit is open")
+
+        started = time.monotonic()
+        chunks = []
+        outcome = {}
+        try:
+            async for delta in self._stream(option.name, messages, expires - started, option.params, outcome):
+                if not chunks:
+                    self._first_token_window(option.name).add(time.monotonic() - started)
+                    first_token.set()
+                chunks.append(delta)
+        except asyncio.CancelledError:
+            # Another model won (or the caller gave up) - no verdict on this one, unless
+            # the deadline ran out before it said anything
+            if not chunks and time.monotonic() >= expires:
+                breaker.record_failure(time.monotonic() - started, 'no first token before deadline')
+            else:
+                breaker.release()
+            raise
+        except Exception as e:
+            breaker.record_failure(time.monotonic() - started, e)
+            raise
+
+        breaker.record_success(time.monotonic() - started)
+        return LLMResult(
+            text=''.join(chunks),
+            model=option.name,
+            usage=outcome.get('usage'),
+            latency=time.monotonic() - started,
+            finish_reason=outcome.get('finish_reason'),
+        )
+
+    async def _hedged(self, policy, messages, deadline):
+        """Race the policy's models: hedge to the next one when no token has arrived in time"""
+        expires = time.monotonic() + deadline
+        pending = list(policy.models)
+        running = {}  # task -> model name
+        errors = []
+        circuits_open = True
+        first_token = asyncio.Event()
+        token_waiter = asyncio.ensure_future(first_token.wait())
+        hedge_at = None
+
+        def launch():
+            option = pending.pop(0)
+            task = asyncio.ensure_future(self._collect(option, messages, expires, first_token))
+            running[task] = option.name
+            delay = policy.hedge_delay(self.first_token_latency.get(option.name))
+            logging.info(f"Launching {option.name} (next hedge in {delay:.2f}s)")
+            return time.monotonic() + delay
+
+        try:
+            while True:
+                if not running:
+                    if not pending:
+                        if errors and circuits_open:
+                            raise CircuitOpenError('; '.join(errors))
+                        raise AllModelsFailedError('; '.join(errors) or 'No models configured')
+                    # Everything launched so far failed - fall back immediately
+                    hedge_at = launch()
+
+                now = time.monotonic()
+                if now >= expires:
+                    raise LLMTimeoutError(f"No model finished within {deadline:.1f}s")
+
+                can_hedge = bool(pending) and not first_token.is_set()
+                timeout = expires - now
+                wait_on = set(running)
+                if can_hedge:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+                    wait_on.add(token_waiter)
+
+                done, _ = await asyncio.wait(wait_on, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task is token_waiter:
+                        continue
+                    model = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    errors.append(f"{model}: {error}")
+                    if not isinstance(error, CircuitOpenError):
+                        circuits_open = False
+                        logging.warning(f"Model {model} failed: {error}")
+
+                if can_hedge and not first_token.is_set() and time.monotonic() >= hedge_at:
+                    hedge_at = launch()
+
+        finally:
+            # Cancel the losers (and anything still running on timeout)
+            for task in running:
+                task.cancel()
+            token_waiter.cancel()
+
+    async def _hedged_coalesced(self, policy, messages, deadline):
+        if not self.coalesce:
+            return await self._hedged(policy, messages, deadline)
+        key = fingerprint([option.name for option in policy.models], messages,
+                          [option.params for option in policy.models])
+        return await self.single_flight.do(key, lambda: self._hedged(policy, messages, deadline))
+
+    def complete_with_policy(self, policy, messages, deadline=None):
+        """Blocking hedged completion; result.model is the model that won"""
+        deadline = deadline or self.default_deadline
+        with span('llm', KIND_CLIENT, policy=policy.models[0].name) as current:
+            result = self.submit(self._hedged_coalesced(policy, messages, deadline)).result()
+            current.set(model=result.model)
+        return result
+
+    async def acomplete_with_policy(self, policy, messages, deadline=None):
+        with span('llm', KIND_CLIENT, policy=policy.models[0].name) as current:
+            coro = self._hedged_coalesced(policy, messages, deadline or self.default_deadline)
+            result = await asyncio.wrap_future(self.submit(coro))
+            current.set(model=result.model)
+        return result
+
+    def submit(self, coro):
+        """Schedule a coroutine on the gateway loop and return its future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def acomplete(self, model, messages, deadline=None, **params):
+        """Await a completion from any event loop"""
+        with span('llm', KIND_CLIENT, model=model):
+            coro = self._coalesced(model, messages, deadline or self.default_deadline, params)
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._loop:
+                return await coro
+            return await asyncio.wrap_future(self.submit(coro))
+
+    def complete(self, model, messages, deadline=None, **params):
+        """Blocking completion for synchronous Flask views"""
+        deadline = deadline or self.default_deadline
+        with span('llm', KIND_CLIENT, model=model):
+            future = self.submit(self._coalesced(model, messages, deadline, params))
+            return future.result()
+
+    def stream(self, model, messages, deadline=None, outcome=None, **params):
+        """Blocking iterator of text deltas for synchronous Flask views.
+        A finished stream leaves its usage and finish reason in outcome"""
+        deadline = deadline or self.default_deadline
+        deltas = queue.Queue()
+        finished = object()
+
+        async def pump():
+            # A task with its own copy of the caller's context, so the span can live here
+            with span('llm', KIND_CLIENT, model=model, stream=True) as current:
+                try:
+                    async for delta in self._guarded_stream(model, messages, deadline, params, outcome):
+                        deltas.put(delta)
+                    deltas.put(finished)
+                except Exception as e:
+                    current.fail(e)
+                    deltas.put(e)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                try:
+                    item = deltas.get(timeout=deadline + 5)
+                except queue.Empty:
+                    raise LLMTimeoutError(f"{model} stream stalled past {deadline:.1f}s deadline")
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Client went away or we finished - stop pulling tokens upstream
+            future.cancel()
+
+    def close(self):
+        if self._loop is None:
+            return
+        self.submit(self.backend.close()).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+        self._thread = None
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def create_backend(name=LLM_BACKEND):
+    if name == 'local':
+        return LocalBackend()
+    return OpenAIBackend()
+
+
+def get_gateway():
+    """Process-wide gateway shared by every endpoint"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(create_backend())
+    return _gateway
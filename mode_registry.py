@@ -0,0 +1,101 @@
+"""Declarative registry of feature modes.
+
+One entry per mode the extension can send: what it costs, which handler
+/generate dispatches it to (or which dedicated endpoint serves it), the
+prompt template builder, the model policy, how responses are cached, the
+prompt_tokens input budget, the max_tokens output ceiling (output_budget.py
+picks each request's budget below it) and, for JSON endpoints, the reply
+schema (output_schemas.py). Built once at import; credit checks
+and dispatch are both dict lookups.
+
+Credit costs match the extension exactly, so unknown modes keep the 6-credit
+default. Dispatch is more forgiving: an unknown mode with a known family
+prefix (e.g. a new `reframe_*` tone) goes to that family's handler, as the
+old startswith chain did.
+"""
+
+DEFAULT_CREDITS = 6
+
+# Cache policies
+CACHE_NONE = None
+CACHE_EXACT = 'exact'        # response_cache keyed on normalized input + prompt
+CACHE_SEMANTIC = 'semantic'  # semantic_cache near-duplicate conversations
+
+
+class Mode:
+    """Everything the backend needs to know about one feature mode"""
+
+    __slots__ = ('name', 'credits', 'handler', 'endpoint', 'template', 'policy', 'cache', 'max_tokens',
+                 'prompt_tokens', 'scales_output', 'schema')
+
+    def __init__(self, name, credits, handler=None, endpoint=None, template=None, policy=None,
+                 cache=CACHE_NONE, max_tokens=None, prompt_tokens=None, scales_output=False,
+                 schema=None):
+        self.name = name
+        self.credits = credits
+        self.handler = handler
+        self.endpoint = endpoint
+        self.template = template
+        self.policy = policy
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.prompt_tokens = prompt_tokens
+        self.scales_output = scales_output  # output length grows with the input (rewrites)
+        self.schema = schema
+
+    def describe(self):
+        return {
+            'mode': self.name,
+            'credits': self.credits,
+            'handler': getattr(self.handler, '__name__', None),
+            'endpoint': self.endpoint,
+            'template': getattr(self.template, '__name__', None),
+            'policy': [option.name for option in self.policy.models] if self.policy else None,
+            'cache': self.cache,
+            'max_tokens': self.max_tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'scales_output': self.scales_output,
+            'schema': getattr(self.schema, 'name', None),
+        }
+
+
+class ModeRegistry:
+    """mode name -> Mode, plus family defaults for /generate dispatch"""
+
+    def __init__(self, default_credits=DEFAULT_CREDITS):
+        self.default_credits = default_credits
+        self._modes = {}
+        self._families = {}
+
+    def add(self, name, credits, **options):
+        if name in self._modes:
+            raise ValueError(f"Mode {name} registered twice")
+        mode = self._modes[name] = Mode(name, credits, **options)
+        return mode
+
+    def add_family(self, prefix, **options):
+        """Dispatch settings for unregistered `prefix_*` modes (credits stay at the default)"""
+        self._families[prefix] = Mode(f'{prefix}_*', self.default_credits, **options)
+
+    def get(self, name):
+        return self._modes.get(name)
+
+    def __getitem__(self, name):
+        return self._modes[name]
+
+    def __contains__(self, name):
+        return name in self._modes
+
+    def credits(self, name):
+        mode = self._modes.get(name)
+        return mode.credits if mode is not None else self.default_credits
+
+    def resolve(self, name):
+        """The Mode that should handle `name` in /generate, or None for the default path"""
+        mode = self._modes.get(name)
+        if mode is None and '_' in name:
+            mode = self._families.get(name.split('_', 1)[0])
+        return mode
+
+    def describe(self):
+        return [mode.describe() for mode in self._modes.values()]
@@ -0,0 +1,75 @@
+"""Hedged model fallback policies.
+
+Instead of walking a models_to_try list one full timeout at a time, an
+endpoint declares a HedgePolicy: the primary model is fired first and, if no
+model has produced a first token within the hedge delay, the next fallback is
+launched in parallel. Whichever finishes first wins and the others are
+cancelled (see LLMGateway.complete_with_policy).
+
+The hedge delay is derived from the primary model's observed p95
+time-to-first-token, clamped to [min_delay, max_delay]; until enough samples
+exist the default delay is used.
+"""
+import os
+import threading
+from collections import deque
+
+# HEDGING CONFIGURATION
+HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', '2.5'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.5'))
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '8.0'))
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+
+
+class RollingWindow:
+    """Last N latency samples with percentile lookup"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+
+    def percentile(self, p):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(p * (len(ordered) - 1)))))
+        return ordered[index]
+
+
+class ModelOption:
+    """One model a policy may call, with its sampling params"""
+
+    __slots__ = ('name', 'params')
+
+    def __init__(self, name, params=None):
+        self.name = name
+        self.params = params or {}
+
+
+class HedgePolicy:
+    """Ordered models plus the rule for when to launch the next one"""
+
+    def __init__(self, models, percentile=HEDGE_PERCENTILE, default_delay=HEDGE_DEFAULT_DELAY,
+                 min_delay=HEDGE_MIN_DELAY, max_delay=HEDGE_MAX_DELAY, min_samples=HEDGE_MIN_SAMPLES):
+        self.models = [ModelOption(name, params) for name, params in models]
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+
+    def hedge_delay(self, first_token_latencies):
+        """Seconds to wait for a first token before launching the next model"""
+        if first_token_latencies is None or len(first_token_latencies) < self.min_samples:
+            return self.default_delay
+        observed = first_token_latencies.percentile(self.percentile)
+        return min(self.max_delay, max(self.min_delay, observed))
@@ -0,0 +1,180 @@
+"""Per-request max_tokens and model choice from input size and observed outputs.
+
+Endpoints used to hard-code max_tokens (2500 for smart_enhancements, 400 for
+explain, nothing for convert) whatever the input. The provider sizes its work
+and our deadlines around that reservation, and a runaway generation can use
+all of it, so the tail latency follows the ceiling instead of the typical
+answer.
+
+For every mode we keep a rolling window of how many tokens completions
+actually used (and, for modes whose output grows with the input, the
+output/input ratio). Once a mode has OUTPUT_MIN_SAMPLES observations its
+max_tokens becomes
+
+    p99 of observed outputs (or p99 ratio x input tokens) x OUTPUT_HEADROOM
+
+rounded up to a multiple of 64 and never above the configured ceiling. Until
+then the ceiling is used, as before. A completion cut off by a dynamic
+budget is recorded at the ceiling, so a mode whose answers grow gets its
+budget back within a few requests.
+
+Model choice: models whose context window cannot hold the prompt plus the
+budget are dropped from a policy (or swapped for the first model that fits),
+instead of failing upstream.
+"""
+import logging
+import math
+import os
+import threading
+
+from model_policy import HedgePolicy, RollingWindow
+from token_budget import count_tokens
+
+# OUTPUT BUDGET CONFIGURATION
+OUTPUT_BUDGET_ENABLED = os.getenv('OUTPUT_BUDGET_ENABLED', 'true').lower() in ('true', '1', 'yes')
+OUTPUT_PERCENTILE = float(os.getenv('OUTPUT_PERCENTILE', '0.99'))
+OUTPUT_HEADROOM = float(os.getenv('OUTPUT_HEADROOM', '1.3'))
+OUTPUT_MIN_SAMPLES = int(os.getenv('OUTPUT_MIN_SAMPLES', '30'))
+OUTPUT_MIN_TOKENS = int(os.getenv('OUTPUT_MIN_TOKENS', '64'))
+OUTPUT_DEFAULT_CEILING = int(os.getenv('OUTPUT_DEFAULT_CEILING', '2000'))
+OUTPUT_WINDOW = int(os.getenv('OUTPUT_WINDOW', '500'))
+
+# Budgets are rounded up to this step so concurrent requests still coalesce
+BUDGET_STEP = 64
+
+# Template, framing and images on top of the counted request text
+PROMPT_MARGIN_TOKENS = 2048
+
+MODEL_CONTEXT_TOKENS = {
+    'chatgpt-4o-latest': 128000,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4.1-mini': 1047576,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 128000
+
+
+def fits(model, input_tokens, max_tokens):
+    """Whether the model's context window holds the prompt plus the output budget"""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return input_tokens + PROMPT_MARGIN_TOKENS + max_tokens <= context
+
+
+def output_tokens(result):
+    """Completion tokens used, from the provider's usage when it reports it"""
+    used = getattr(getattr(result, 'usage', None), 'completion_tokens', None)
+    if used is None:
+        used = count_tokens(getattr(result, 'text', result) or '')
+    return used
+
+
+class ModeOutputs:
+    """Observed output lengths for one mode"""
+
+    def __init__(self, size=OUTPUT_WINDOW):
+        self.tokens = RollingWindow(size)
+        self.ratios = RollingWindow(size)
+        self.truncated = 0
+
+    def add(self, input_tokens, tokens, truncated):
+        self.tokens.add(tokens)
+        self.ratios.add(tokens / max(input_tokens, 1))
+        if truncated:
+            self.truncated += 1
+
+
+class OutputBudgets:
+    """Learns per-mode output lengths and sizes max_tokens from them"""
+
+    def __init__(self, enabled=OUTPUT_BUDGET_ENABLED, percentile=OUTPUT_PERCENTILE, headroom=OUTPUT_HEADROOM,
+                 min_samples=OUTPUT_MIN_SAMPLES, min_tokens=OUTPUT_MIN_TOKENS,
+                 default_ceiling=OUTPUT_DEFAULT_CEILING):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.default_ceiling = default_ceiling
+        self._modes = {}
+        self._lock = threading.Lock()
+
+    def _outputs(self, mode):
+        outputs = self._modes.get(mode)
+        if outputs is None:
+            with self._lock:
+                outputs = self._modes.setdefault(mode, ModeOutputs())
+        return outputs
+
+    def max_tokens(self, mode, input_tokens, ceiling=None, scales=False):
+        """Output budget for one request of this mode"""
+        ceiling = ceiling or self.default_ceiling
+        outputs = self._modes.get(mode)
+        if not self.enabled or outputs is None or len(outputs.tokens) < self.min_samples:
+            return ceiling
+
+        if scales:
+            expected = outputs.ratios.percentile(self.percentile) * max(input_tokens, 1)
+        else:
+            expected = outputs.tokens.percentile(self.percentile)
+        budget = math.ceil(expected * self.headroom / BUDGET_STEP) * BUDGET_STEP
+        return min(ceiling, max(self.min_tokens, budget))
+
+    def observe(self, mode, input_tokens, max_tokens, tokens, truncated=False, ceiling=None):
+        """Record one finished completion; a cut-off answer counts at the ceiling"""
+        if truncated:
+            ceiling = ceiling or self.default_ceiling
+            if max_tokens and max_tokens < ceiling:
+                logging.info(f"Output budget for {mode} truncated at {max_tokens} tokens")
+                tokens = ceiling
+        self._outputs(mode).add(input_tokens, tokens, truncated)
+
+    def size_completion(self, mode, completion, input_tokens, ceiling=None, scales=False):
+        """Copy of completion kwargs with max_tokens (and if needed the model) chosen"""
+        ceilings = [value for value in (completion.get('max_tokens'), ceiling) if value]
+        ceiling = min(ceilings) if ceilings else None
+        sized = dict(completion, max_tokens=self.max_tokens(mode, input_tokens, ceiling, scales))
+
+        model = sized.get('model')
+        if model and not fits(model, input_tokens, sized['max_tokens']):
+            larger = [name for name in MODEL_CONTEXT_TOKENS if fits(name, input_tokens, sized['max_tokens'])]
+            if larger:
+                logging.info(f"{model} context too small for {input_tokens} input tokens, using {larger[0]}")
+                sized['model'] = larger[0]
+        return sized
+
+    def size_policy(self, mode, policy, input_tokens, ceiling=None, scales=False):
+        """Policy whose models fit the input, each capped at the mode's output budget"""
+        models = []
+        for option in policy.models:
+            caps = [value for value in (option.params.get('max_tokens'), ceiling) if value]
+            budget = self.max_tokens(mode, input_tokens, min(caps) if caps else None, scales)
+            if fits(option.name, input_tokens, budget):
+                models.append((option.name, dict(option.params, max_tokens=budget)))
+        if not models:
+            # Nothing fits - let the provider reject it rather than failing here
+            return policy
+        return HedgePolicy(models, policy.percentile, policy.default_delay,
+                           policy.min_delay, policy.max_delay, policy.min_samples)
+
+    def stats(self):
+        stats = {}
+        for mode, outputs in list(self._modes.items()):
+            stats[mode] = {
+                'samples': len(outputs.tokens),
+                'p50_tokens': outputs.tokens.percentile(0.5),
+                'p99_tokens': outputs.tokens.percentile(self.percentile),
+                'truncated': outputs.truncated,
+            }
+        return stats
+
+
+_output_budgets = None
+
+
+def get_output_budgets():
+    global _output_budgets
+    if _output_budgets is None:
+        _output_budgets = OutputBudgets()
+    return _output_budgets
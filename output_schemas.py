@@ -0,0 +1,209 @@
+"""JSON schemas for the structured smart endpoints, plus a local validator.
+
+smart-followups, smart-actions and smart-enhancements ask the model for JSON
+and used to trust the prompt's "JSON format:" example. When the reply did not
+parse, extract_questions_from_text / extract_action_prompts_from_text /
+create_gpt41_fallback_prompts_clean scanned it line by line and usually
+returned canned defaults, so the user paid 15 credits for boilerplate.
+
+Each endpoint now has a schema. It is attached to the policy's models once at
+import (structured_models), as whatever the model supports:
+  - json_schema with strict: true (SCHEMA_MODELS): decoding is constrained
+    to the schema, so the reply always parses and has every field
+  - json_object (JSON_MODE_MODELS): the reply is valid JSON, shape per prompt
+  - nothing for other models: the prompt alone, as before
+
+OutputSchema.parse() checks every reply against the same schema locally
+before the view uses it: types and structure always, and completeness when the
+model was asked for the schema (JSON-mode and prompt-only models only saw the
+prompt's example, so the views keep their defaults for missing fields).
+Anything that fails is counted (GET /debug-modes) and still goes to the text
+fallback.
+
+The validator covers the subset strict mode accepts: type, properties,
+required, additionalProperties, items and enum.
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from json_stream import extract_json
+from tracing import traced
+
+# STRUCTURED OUTPUT CONFIGURATION
+STRUCTURED_OUTPUTS_ENABLED = os.getenv('STRUCTURED_OUTPUTS_ENABLED', 'true').lower() in ('true', '1', 'yes')
+SCHEMA_MODELS = set(filter(None, os.getenv(
+    'SCHEMA_MODELS', 'gpt-4o,gpt-4o-mini,gpt-4.1,gpt-4.1-mini,gpt-4.1-nano').split(',')))
+JSON_MODE_MODELS = set(filter(None, os.getenv('JSON_MODE_MODELS', 'gpt-3.5-turbo,gpt-4-turbo').split(',')))
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'number': (int, float),
+    'integer': int,
+    'boolean': bool,
+    'null': type(None),
+}
+
+# Responses name the dated snapshot (gpt-4o-2024-08-06) of the model requested
+_SNAPSHOT = re.compile(r'-\d{4}-\d{2}-\d{2}$')
+
+
+class SchemaError(ValueError):
+    """Raised when a reply does not match its endpoint's schema"""
+
+
+def _is_type(value, name):
+    if isinstance(value, bool) and name in ('number', 'integer'):
+        return False
+    return isinstance(value, _TYPES[name])
+
+
+def validate(value, schema, path='$', complete=True):
+    """List of places where value breaks schema (empty when it matches);
+    complete=False skips the required-property checks"""
+    types = schema.get('type')
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if not any(_is_type(value, name) for name in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"]
+
+    if 'enum' in schema and value not in schema['enum']:
+        return [f"{path}: {value!r} not one of {schema['enum']}"]
+
+    errors = []
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        for key in schema.get('required', []) if complete else ():
+            if key not in value:
+                errors.append(f"{path}: missing {key}")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate(item, properties[key], f"{path}.{key}", complete))
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}: unexpected {key}")
+    elif isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema['items'], f"{path}[{index}]", complete))
+    return errors
+
+
+def strict_object(properties):
+    """Object schema in strict-mode form: every property required, nothing else allowed"""
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties),
+        'additionalProperties': False,
+    }
+
+
+class OutputSchema:
+    """One endpoint's reply schema: request format per model and local validation"""
+
+    def __init__(self, name, schema):
+        self.name = name
+        self.schema = schema
+        self.parsed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._json_schema = {
+            'type': 'json_schema',
+            'json_schema': {'name': name, 'strict': True, 'schema': schema},
+        }
+
+    def response_format(self, model):
+        """The strongest response_format the model accepts, or None"""
+        if not STRUCTURED_OUTPUTS_ENABLED or not model:
+            return None
+        model = _SNAPSHOT.sub('', model)
+        if model in SCHEMA_MODELS:
+            return self._json_schema
+        if model in JSON_MODE_MODELS:
+            return {'type': 'json_object'}
+        return None
+
+    @traced('parse')
+    def parse(self, text, model=None):
+        """The reply as a dict; SchemaError (a ValueError) when it does not match"""
+        try:
+            value = extract_json(text)
+        except json.JSONDecodeError as e:
+            self._count(False)
+            raise SchemaError(f"{self.name}: {e}") from e
+
+        constrained = self.response_format(model) is self._json_schema
+        errors = validate(value, self.schema, complete=constrained)
+        self._count(not errors)
+        if errors:
+            raise SchemaError(f"{self.name}: {'; '.join(errors[:3])}")
+        return value
+
+    def _count(self, ok):
+        with self._lock:
+            if ok:
+                self.parsed += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        return {'parsed': self.parsed, 'failed': self.failed}
+
+
+def structured_models(schema, models):
+    """HedgePolicy model list with each model's response_format for schema added"""
+    structured = []
+    for name, params in models:
+        response_format = schema.response_format(name)
+        if response_format is not None:
+            params = dict(params, response_format=response_format)
+        else:
+            logging.info(f"{name} has no structured output support - {schema.name} relies on the prompt")
+        structured.append((name, params))
+    return structured
+
+
+# ENDPOINT SCHEMAS
+FOLLOWUPS_SCHEMA = OutputSchema('smart_followups', strict_object({
+    'questions': {
+        'type': 'array',
+        'items': strict_object({
+            'text': {'type': 'string'},
+            'type': {'type': 'string'},
+        }),
+    },
+    'analysis': {'type': 'string'},
+}))
+
+ACTIONS_SCHEMA = OutputSchema('smart_actions', strict_object({
+    'action_prompts': {
+        'type': 'array',
+        'items': strict_object({
+            'prompt': {'type': 'string'},
+            'focus': {'type': 'string'},
+            'context': {'type': 'string'},
+        }),
+    },
+    'analysis': {'type': 'string'},
+}))
+
+ENHANCEMENTS_SCHEMA = OutputSchema('smart_enhancements', strict_object({
+    'content_analysis': strict_object({
+        'type': {'type': 'string'},
+        'purpose': {'type': 'string'},
+        'current_quality': {'type': 'string'},
+        'improvement_potential': {'type': 'string'},
+    }),
+    'enhancement_prompts': {
+        'type': 'array',
+        'items': strict_object({
+            'prompt': {'type': 'string'},
+            'focus_area': {'type': 'string'},
+            'expected_impact': {'type': 'string'},
+            'priority': {'type': 'string'},
+        }),
+    },
+}))
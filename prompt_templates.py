@@ -0,0 +1,92 @@
+"""Precompiled prompt templates: static instructions first, request text last.
+
+The big prompts (cot framework, universal image analysis, convert_*, smart
+follow-ups/actions/enhancements) used to be f-strings rebuilt per request
+with the user's text interpolated near the top. Every request then had a
+different prefix, so OpenAI's automatic prompt caching (which reuses the
+longest previously seen prefix, from 1024 tokens up) never applied.
+
+Each template is now split once at import into:
+  - static: the system message and instruction body, identical for every
+    request. Built, hashed and token-counted here, never per request.
+  - dynamic: a short str.format suffix holding the per-request fields
+    (highlighted text, conversation, focus). It always goes last.
+
+render() only formats the suffix. Token counts come from token_budget.py.
+GET /debug-prompts lists each template's prefix tokens and fingerprint; a
+fingerprint change means the provider-side cache for that template has been
+reset.
+"""
+import hashlib
+from string import Formatter
+
+from token_budget import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from tracing import traced
+
+# OpenAI only caches prompts whose shared prefix is at least this long
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+class PromptTemplate:
+    """One prompt: precomputed static prefix + per-request suffix"""
+
+    __slots__ = ('name', 'system', 'static', 'dynamic', 'prefix_tokens', 'fixed_tokens', 'fingerprint')
+
+    def __init__(self, name, static, dynamic='', system=None):
+        self.name = name
+        self.system = system
+        self.static = static
+        self.dynamic = dynamic
+        prefix = (system or '') + static
+        self.prefix_tokens = count_tokens(prefix)
+        # Everything but the field values: prefix, suffix scaffolding and message framing
+        scaffolding = ''.join(literal for literal, _, _, _ in Formatter().parse(dynamic))
+        messages = 2 if system else 1
+        self.fixed_tokens = self.prefix_tokens + count_tokens(scaffolding) + MESSAGE_OVERHEAD_TOKENS * messages
+        self.fingerprint = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:12]
+
+    @traced('prompt')
+    def render(self, **fields):
+        """Static body followed by the formatted suffix"""
+        return self.static + self.dynamic.format(**fields) if self.dynamic else self.static
+
+    def messages(self, **fields):
+        """Chat messages with every static part ahead of the request text"""
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.append({"role": "user", "content": self.render(**fields)})
+        return messages
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'prefix_tokens': self.prefix_tokens,
+            'fixed_tokens': self.fixed_tokens,
+            'provider_cacheable': self.prefix_tokens >= PROMPT_CACHE_MIN_TOKENS,
+            'fingerprint': self.fingerprint,
+            'fields': [field for _, field, _, _ in Formatter().parse(self.dynamic) if field],
+        }
+
+
+class TemplateRegistry:
+    """template name -> PromptTemplate, built once at import"""
+
+    def __init__(self):
+        self._templates = {}
+
+    def add(self, name, static, dynamic='', system=None):
+        if name in self._templates:
+            raise ValueError(f"Prompt template {name} registered twice")
+        template = self._templates[name] = PromptTemplate(name, static, dynamic, system)
+        return template
+
+    def get(self, name, default=None):
+        return self._templates.get(name, default)
+
+    def __getitem__(self, name):
+        return self._templates[name]
+
+    def __contains__(self, name):
+        return name in self._templates
+
+    def describe(self):
+        return [template.describe() for template in self._templates.values()]
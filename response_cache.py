@@ -0,0 +1,234 @@
+"""Exact-match response cache for the deterministic-ish text modes.
+
+Reframe, explain and convert completions are keyed on a hash of
+mode + normalized input + model + sampling params (+ system prompt), so the
+same highlighted term explained by many users costs one OpenAI call.
+
+Two tiers:
+  - an in-process LRU with TTL (always on)
+  - an optional shared tier (RESPONSE_CACHE_BACKEND=sqlite or redis) so
+    every worker process sees the same entries
+Credits are still deducted on hits - the cache only replaces the LLM call.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from tracing import cache_result, traced
+
+# CACHE CONFIGURATION
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '5000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', str(6 * 3600)))
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', '')  # '', 'sqlite' or 'redis'
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+RESPONSE_CACHE_URL = os.getenv('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+
+# Bump when prompt templates change so shared-tier entries are not reused
+CACHE_VERSION = 'v2'
+
+
+def normalize_input(text):
+    """Collapse whitespace and unicode variants so trivially different inputs share a key"""
+    return ' '.join(unicodedata.normalize('NFC', text or '').split())
+
+
+def make_cache_key(mode, text, completion):
+    """Hash of mode + normalized input + model + sampling params + system prompt"""
+    # max_tokens is sized per request (output_budget.py) and truncated answers are never cached
+    params = {k: v for k, v in completion.items() if k not in ('model', 'messages', 'deadline', 'max_tokens')}
+    system_prompt = [m['content'] for m in completion.get('messages', []) if m.get('role') == 'system']
+    material = json.dumps([
+        CACHE_VERSION,
+        mode,
+        normalize_input(text),
+        completion.get('model'),
+        params,
+        system_prompt,
+    ], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class MemoryTier:
+    """Thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteTier:
+    """Shared tier in a local sqlite file (works across worker processes)"""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path=RESPONSE_CACHE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM response_cache WHERE key = ? AND expires >= ?',
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, expires) VALUES (?, ?, ?)',
+                (key, value, time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute('DELETE FROM response_cache WHERE expires < ?', (time.time(),))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM response_cache')
+            self._conn.commit()
+
+
+class RedisTier:
+    """Shared tier in any Redis-compatible server (needs the `redis` package)"""
+
+    def __init__(self, url=RESPONSE_CACHE_URL, prefix='solthron:response:'):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class ResponseCache:
+    """In-process LRU in front of an optional shared tier"""
+
+    def __init__(self, memory=None, shared=None, ttl=RESPONSE_CACHE_TTL, enabled=RESPONSE_CACHE_ENABLED):
+        self.memory = memory or MemoryTier()
+        self.shared = shared
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @traced('cache', cache_result, tier='exact')
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logging.warning(f"Shared response cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value, self.ttl)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled or not value:
+            return
+        self.memory.set(key, value, self.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                logging.warning(f"Shared response cache write failed: {e}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'memory_entries': len(self.memory),
+            'shared_tier': type(self.shared).__name__ if self.shared else None,
+        }
+
+
+def create_shared_tier(name=RESPONSE_CACHE_BACKEND):
+    try:
+        if name == 'sqlite':
+            return SqliteTier()
+        if name == 'redis':
+            return RedisTier()
+    except Exception as e:
+        logging.warning(f"Shared response cache '{name}' unavailable, using memory only: {e}")
+    return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide response cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(shared=create_shared_tier())
+    return _cache
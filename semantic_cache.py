@@ -0,0 +1,211 @@
+"""Semantic (embedding-similarity) cache for /smart-followups and /smart-actions.
+
+Users re-open the panel or double click while the conversation is
+unchanged, or only the assistant's latest reply has grown. Both endpoints
+answer the latest exchange, so that is what the cache matches on:
+
+  - Entries are scoped to the user (the caller passes the uid) and keyed on
+    the exact text of the latest user turn. A conversation that moved on by
+    one exchange never gets the answer for the previous turn, and one user
+    is never served another user's generated content.
+  - Within that key, the latest exchange (user turn plus the replies after
+    it) is embedded. A request whose embedding is close enough
+    (cosine >= SEMANTIC_CACHE_THRESHOLD) gets the stored question/action set
+    back without an LLM call. The shared history is never embedded, because
+    it would drown out the part that changed.
+
+The default embedding is a local hashed character-trigram vector, so the cache
+works offline. Pass any `embed(text) -> list[float]` to SemanticCache to use a
+real embedding model instead.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+
+from token_budget import split_turns
+from tracing import cache_result, traced
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# SEMANTIC CACHE CONFIGURATION
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', '1800'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+EMBEDDING_DIM = 256
+
+USER_ROLES = ('user', 'human')
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def latest_exchange(text):
+    """(latest user turn, that turn plus the replies after it) of a conversation"""
+    turns = split_turns(text)
+    if not turns:
+        return '', ''
+    start = len(turns) - 1
+    for i in range(len(turns) - 1, -1, -1):
+        if turns[i].lstrip().split(':', 1)[0].strip().lower() in USER_ROLES:
+            start = i
+            break
+    return turns[start], '\n\n'.join(turns[start:])
+
+
+def entry_key(scope, text):
+    """Exact-match part of a cache key: who asked, and their latest turn"""
+    user_turn, _ = latest_exchange(text)
+    digest = hashlib.blake2b(normalize(user_turn).encode('utf-8'), digest_size=16).hexdigest()
+    return f'{scope}:{digest}'
+
+
+def hashed_ngram_embedding(text, dim=EMBEDDING_DIM, n=3):
+    """Local embedding: L2-normalized counts of hashed character n-grams"""
+    vector = [0.0] * dim
+    normalized = normalize(text)
+    for i in range(max(1, len(normalized) - n + 1)):
+        gram = normalized[i:i + n]
+        digest = hashlib.blake2b(gram.encode('utf-8'), digest_size=4).digest()
+        bucket = int.from_bytes(digest, 'little')
+        # Signed hashing keeps unrelated n-grams from only ever adding up
+        vector[bucket % dim] += 1.0 if bucket & 0x80000000 else -1.0
+
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return vector
+    return [v / norm for v in vector]
+
+
+class VectorIndex:
+    """Bounded in-memory nearest-neighbour index over normalized vectors"""
+
+    def __init__(self, max_entries=SEMANTIC_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._vectors = []
+        self._values = []
+        self._expires = []
+        self._keys = []
+        self._matrix = None  # numpy cache of _vectors, rebuilt lazily
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def add(self, vector, value, expires, key=None):
+        if len(self._vectors) >= self.max_entries:
+            self._evict()
+        self._vectors.append(vector)
+        self._values.append(value)
+        self._expires.append(expires)
+        self._keys.append(key)
+        self._matrix = None
+
+    def _evict(self):
+        now = time.time()
+        keep = [i for i, expires in enumerate(self._expires) if expires >= now]
+        if len(keep) >= self.max_entries:
+            keep = keep[len(keep) - self.max_entries + 1:]
+        self._vectors = [self._vectors[i] for i in keep]
+        self._values = [self._values[i] for i in keep]
+        self._expires = [self._expires[i] for i in keep]
+        self._keys = [self._keys[i] for i in keep]
+        self._matrix = None
+
+    def nearest(self, vector, key=None):
+        """Return (similarity, value) of the closest live entry stored under key, or (0.0, None)"""
+        if not self._vectors:
+            return 0.0, None
+
+        if numpy is not None:
+            if self._matrix is None:
+                self._matrix = numpy.array(self._vectors, dtype=numpy.float32)
+            scores = self._matrix @ numpy.array(vector, dtype=numpy.float32)
+            order = numpy.argsort(-scores)
+            candidates = ((float(scores[i]), int(i)) for i in order)
+        else:
+            scores = [sum(a * b for a, b in zip(stored, vector)) for stored in self._vectors]
+            candidates = sorted(((score, i) for i, score in enumerate(scores)), reverse=True)
+
+        now = time.time()
+        for score, i in candidates:
+            if self._expires[i] >= now and self._keys[i] == key:
+                return score, self._values[i]
+        return 0.0, None
+
+
+class SemanticCache:
+    """Per-endpoint vector indexes with a similarity threshold"""
+
+    def __init__(self, embed=None, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 ttl=SEMANTIC_CACHE_TTL, max_entries=SEMANTIC_CACHE_SIZE,
+                 enabled=SEMANTIC_CACHE_ENABLED):
+        self.embed = embed or hashed_ngram_embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @traced('cache', cache_result, tier='semantic')
+    def lookup(self, namespace, text, scope):
+        """Cached value for scope's conversation if its latest exchange is close enough, else None"""
+        if not self.enabled or not text or not scope:
+            return None
+
+        key = entry_key(scope, text)
+        vector = self.embed(latest_exchange(text)[1])
+        with self._lock:
+            index = self._indexes.get(namespace)
+            similarity, value = index.nearest(vector, key) if index else (0.0, None)
+
+            if value is not None and similarity >= self.threshold:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def store(self, namespace, text, value, scope):
+        if not self.enabled or not text or not scope:
+            return
+
+        key = entry_key(scope, text)
+        vector = self.embed(latest_exchange(text)[1])
+        with self._lock:
+            index = self._indexes.setdefault(namespace, VectorIndex(self.max_entries))
+            index.add(vector, value, time.time() + self.ttl, key)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': {name: len(index) for name, index in self._indexes.items()},
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Process-wide semantic cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache()
+    return _cache
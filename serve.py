@@ -0,0 +1,146 @@
+"""Production entry point for the Flask app.
+
+    python serve.py                           # gunicorn, else waitress, else threaded werkzeug
+    gunicorn -c serve.py backend:application  # this file doubles as a gunicorn config
+
+PythonAnywhere keeps using `application = app` from backend.py; this module
+is for hosts where we run the server ourselves. The debug reloader is never
+enabled here - `python backend.py` is for local development only.
+
+SIZING FOR LLM TRAFFIC
+Requests spend almost all their time waiting on OpenAI (1-10s, streams up to a
+minute). The waiting happens on the gateway's event loop, so a request thread
+costs a little memory and no CPU while it waits. Size for concurrency, not
+cores (Little's law): in-flight requests = requests/sec x average latency.
+
+  - SERVE_WORKERS: one per core is plenty - the CPU work is JSON and prompt
+    building. Each worker holds its own gateway loop, response cache memory
+    tier and Firebase client (~150MB). The credit ledger is shared on disk.
+  - SERVE_THREADS: in-flight requests per worker. 50 req/s x 6s average is
+    300 in flight -> 4 workers x 75 threads. Every open stream pins a thread
+    for its whole duration, so add headroom if most traffic streams.
+  - SERVE_TIMEOUT: must exceed the slowest legitimate request - the LLM
+    deadline (LLM_DEFAULT_DEADLINE, 30s) plus hedging and streaming - or
+    healthy workers get killed mid-completion.
+  - SERVE_GRACEFUL_TIMEOUT: on SIGTERM workers stop accepting connections and
+    get this long to finish in-flight completions, then flush the credit
+    ledger and close the OpenAI connection pool.
+  - SERVE_KEEPALIVE: the extension polls several endpoints per page; keeping
+    connections open saves a TLS handshake per call behind a proxy.
+"""
+import logging
+import os
+
+# SERVER CONFIGURATION
+SERVE_HOST = os.getenv('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.getenv('SERVE_PORT', os.getenv('PORT', '8000')))
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', str(os.cpu_count() or 2)))
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', '64'))
+SERVE_TIMEOUT = int(os.getenv('SERVE_TIMEOUT', '120'))
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv('SERVE_GRACEFUL_TIMEOUT', '60'))
+SERVE_KEEPALIVE = int(os.getenv('SERVE_KEEPALIVE', '5'))
+SERVE_MAX_REQUESTS = int(os.getenv('SERVE_MAX_REQUESTS', '0'))  # recycle workers after N requests (0 = never)
+
+# GUNICORN SETTINGS (read when this file is passed as `gunicorn -c serve.py`)
+bind = f'{SERVE_HOST}:{SERVE_PORT}'
+workers = SERVE_WORKERS
+worker_class = 'gthread'
+threads = SERVE_THREADS
+timeout = SERVE_TIMEOUT
+graceful_timeout = SERVE_GRACEFUL_TIMEOUT
+keepalive = SERVE_KEEPALIVE
+max_requests = SERVE_MAX_REQUESTS
+max_requests_jitter = SERVE_MAX_REQUESTS // 10
+# Each worker imports backend itself so its gateway loop and flusher threads survive the fork
+preload_app = False
+accesslog = '-'
+
+
+def shutdown_app():
+    """Flush credits, usage, spans and logs, let in-flight emails finish, close the LLM connection pool"""
+    import backend
+    from credit_ledger import CREDIT_LEDGER_ENABLED, get_credit_ledger
+    from email_queue import stop_email_queue
+    from structured_logging import stop_logging
+    from tracing import get_exporter
+    from usage_meter import get_usage_meter
+
+    if backend.FIREBASE_ENABLED and CREDIT_LEDGER_ENABLED:
+        get_credit_ledger(backend.db).stop()
+    try:
+        backend.llm.close()
+    except Exception as e:
+        logging.warning(f"LLM gateway close failed: {e}")
+    get_usage_meter().stop()
+    stop_email_queue()
+    get_exporter().stop()
+    stop_logging()
+
+
+def worker_exit(server, worker):
+    shutdown_app()
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': bind, 'workers': workers, 'worker_class': worker_class,
+                'threads': threads, 'timeout': timeout, 'graceful_timeout': graceful_timeout,
+                'keepalive': keepalive, 'max_requests': max_requests,
+                'max_requests_jitter': max_requests_jitter, 'preload_app': preload_app,
+                'accesslog': accesslog, 'worker_exit': worker_exit,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Called inside each worker - Firebase/gRPC clients are not fork-safe
+            return load_application()
+
+    Server().run()
+
+
+def run_waitress(app):
+    import atexit
+    from waitress import serve
+
+    # Waitress is a single process; scale with threads only
+    atexit.register(shutdown_app)
+    serve(app, host=SERVE_HOST, port=SERVE_PORT, threads=SERVE_WORKERS * SERVE_THREADS,
+          channel_timeout=SERVE_TIMEOUT, connection_limit=SERVE_WORKERS * SERVE_THREADS * 2)
+
+
+def load_application():
+    from backend import application
+    return application
+
+
+def main():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        print(f"🚀 gunicorn on {bind}: {workers} workers x {threads} threads")
+        run_gunicorn()
+        return
+
+    app = load_application()
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        print("⚠️ gunicorn/waitress not installed - falling back to threaded werkzeug (no debug)")
+        try:
+            app.run(host=SERVE_HOST, port=SERVE_PORT, debug=False, use_reloader=False, threaded=True)
+        finally:
+            shutdown_app()
+    else:
+        print(f"🚀 waitress on {bind}: {SERVE_WORKERS * SERVE_THREADS} threads")
+        run_waitress(app)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Single-flight coalescing for identical in-flight LLM calls.
+
+When the extension retries after its 15s AbortController fires, or a user
+double clicks, the same prompt arrives again while the first completion is
+still running. Callers with the same fingerprint await one shared upstream
+call instead of starting a second one. Credits are still charged per request
+by the endpoints - only the OpenAI call is shared.
+"""
+import asyncio
+import hashlib
+import json
+
+
+def fingerprint(model, messages, params):
+    """Stable hash of everything that determines a completion"""
+    material = json.dumps([model, messages, params], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """Share one task per key among concurrent awaiters (event-loop local)"""
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, factory):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            task.waiters = 0
+            self._calls[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        # One caller giving up (client disconnect) must not cancel the others,
+        # but once every caller has gone the upstream call is wasted work
+        task.waiters += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.waiters == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            task.waiters -= 1
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'started': self.started,
+            'coalesced': self.coalesced,
+        }
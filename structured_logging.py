@@ -0,0 +1,249 @@
+"""Non-blocking, structured, sampled logging for the request path.
+
+Views used to print() full AI responses, Mailgun debug lines and per-request
+banners straight to stdout. Every worker thread then took the same stream
+lock, and one long response could hold it for the whole write. Now:
+
+  - The root logger has a single QueueHandler. The calling thread only
+    filters, cuts and enqueues a record. A QueueListener thread formats it and
+    does the write. The queue is bounded (LOG_QUEUE_SIZE). When it is full,
+    records are dropped and counted instead of blocking the request.
+  - Loggers are named by category: solthron.request, solthron.payload,
+    solthron.mailgun, solthron.auth and so on (get_logger('request')). Below
+    WARNING, each category keeps only its LOG_SAMPLE_RATES share of requests.
+    The decision is made once per request, from its trace id (see
+    tracing.py), so a sampled request keeps all of its lines. Warnings and
+    errors are always kept.
+  - Messages are cut to LOG_MAX_CHARS and tracebacks to LOG_MAX_TRACE_CHARS.
+  - log_payload() is for response bodies. It checks sampling before it
+    serializes anything, so unsampled requests pay almost nothing. It cuts
+    the body to LOG_PAYLOAD_CHARS.
+  - Output is one JSON object per line (LOG_FORMAT=json): ts, level, logger,
+    msg, trace_id/span_id and any fields. LOG_FORMAT=text keeps the old
+    `LEVEL:logger:message` lines.
+
+LOG_ASYNC=false falls back to a plain synchronous handler, same format and filters.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+import tracing
+
+# LOGGING CONFIGURATION
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()  # 'json' or 'text'
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() in ('true', '1', 'yes')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', '2000'))
+LOG_MAX_TRACE_CHARS = int(os.getenv('LOG_MAX_TRACE_CHARS', '8000'))
+LOG_PAYLOAD_CHARS = int(os.getenv('LOG_PAYLOAD_CHARS', '4000'))
+# category=rate pairs; categories not listed keep every record
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'request=0.1,payload=0.01')
+
+LOGGER_PREFIX = 'solthron'
+
+
+def parse_rates(spec):
+    """'request=0.1,payload=0.01' -> {'request': 0.1, 'payload': 0.01}"""
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+SAMPLE_RATES = parse_rates(LOG_SAMPLE_RATES)
+
+
+def get_logger(category):
+    """Logger for one sampling category (solthron.<category>)"""
+    return logging.getLogger(f'{LOGGER_PREFIX}.{category}')
+
+
+def category_of(name):
+    prefix, _, rest = name.partition('.')
+    return rest.split('.', 1)[0] if prefix == LOGGER_PREFIX and rest else None
+
+
+def sampled(rate):
+    """Whether the current request is in a `rate` share (every line of a request agrees)"""
+    if rate >= 1.0:
+        return True
+    if rate <= 0.0:
+        return False
+    span = tracing.current_span()
+    if span is None:
+        return random.random() < rate
+    return int(span.trace_id[-8:], 16) / 0xffffffff < rate
+
+
+def truncate(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}… [{len(text)} chars]"
+    return text
+
+
+def log_payload(logger, message, payload, level=logging.INFO, **fields):
+    """Log a response body for a sampled share of requests, cut to LOG_PAYLOAD_CHARS"""
+    if not logger.isEnabledFor(level) or not sampled(SAMPLE_RATES.get('payload', 1.0)):
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    fields['payload'] = truncate(text, LOG_PAYLOAD_CHARS)
+    logger.log(level, message, extra={'fields': fields, 'sampled': True})
+
+
+class RequestFilter(logging.Filter):
+    """Runs in the calling thread: sample, cut and tag records with the current trace"""
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and not getattr(record, 'sampled', False):
+            rate = SAMPLE_RATES.get(category_of(record.name), 1.0)
+            if not sampled(rate):
+                return False
+
+        record.msg = truncate(record.getMessage(), LOG_MAX_CHARS)
+        record.args = None
+        span = tracing.current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry['trace_id'] = trace_id
+            entry['span_id'] = record.span_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = truncate(self.formatException(record.exc_info), LOG_MAX_TRACE_CHARS)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """basicConfig's `LEVEL:logger:message`, plus fields"""
+
+    def __init__(self):
+        super().__init__('%(levelname)s:%(name)s:%(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Tracebacks are rendered here, while the exception is still alive
+        if record.exc_info:
+            record.exc_text = truncate(logging.Formatter().formatException(record.exc_info), LOG_MAX_TRACE_CHARS)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BackgroundWriter(logging.handlers.QueueListener):
+    """QueueListener whose stop waits (briefly) for room in a full queue instead of raising"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """Route the root logger through the pipeline (idempotent; replaces basicConfig)"""
+    global _handler, _listener
+    with _lock:
+        if _handler is not None:
+            return _handler
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JSONFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+        if LOG_ASYNC:
+            _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _listener = BackgroundWriter(_handler.queue, output)
+            _listener.start()
+            atexit.register(stop_logging)
+        else:
+            _handler = output
+        _handler.addFilter(RequestFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        return _handler
+
+
+def stop_logging():
+    """Write out whatever is still queued (worker shutdown); later records are written directly"""
+    global _handler, _listener
+    with _lock:
+        listener, _listener = _listener, None
+        if listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(_handler)
+        _handler = listener.handlers[0]
+        _handler.addFilter(RequestFilter())
+        root.addHandler(_handler)
+    listener.stop()
+
+
+def log_stats():
+    return {
+        'async': _listener is not None,
+        'queued': _handler.queue.qsize() if isinstance(_handler, DroppingQueueHandler) else 0,
+        'dropped': getattr(_handler, 'dropped', 0),
+        'sample_rates': SAMPLE_RATES,
+    }
+
+
+def render_log_metrics():
+    """Prometheus lines for the pipeline's dropped records"""
+    return '\n'.join([
+        f"# HELP {tracing.METRICS_NAMESPACE}_log_records_dropped_total Log records dropped because the queue was full",
+        f"# TYPE {tracing.METRICS_NAMESPACE}_log_records_dropped_total counter",
+        f"{tracing.METRICS_NAMESPACE}_log_records_dropped_total {getattr(_handler, 'dropped', 0)}",
+    ]) + '\n'
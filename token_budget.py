@@ -0,0 +1,156 @@
+"""Token counting and input trimming for prompt budgets.
+
+Request text used to be cut by characters (`conversation[:1800]`) or not at
+all. Character cuts keep the oldest part of a conversation and drop the most
+recent answer, which is the part follow-ups are about. Uncut text can blow
+up a request's cost and latency.
+
+Each mode now has a prompt_tokens budget (see MODES in backend.py). The
+template's fixed cost is counted once at import (PromptTemplate.fixed_tokens),
+so a request only tokenizes its own text. Whatever the template leaves goes
+to the user content:
+  - conversations keep the opening turn (usually the question) and as many
+    of the most recent turns as fit. Dropped middle turns are replaced by a
+    marker. A single oversized turn is cut in the middle.
+  - free text (highlighted text, convert input) keeps its beginning and end.
+
+Counts are exact with tiktoken installed. Otherwise an offline approximation
+is used that overestimates slightly, so a trimmed prompt stays within budget.
+"""
+import logging
+import math
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# TOKENIZER CONFIGURATION
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')  # gpt-4o / gpt-4.1 family
+
+# Chat framing per message (role, separators) on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+# Never squeeze user content below this, whatever the template costs
+MIN_USER_TOKENS = 64
+
+TRIM_MARKER = '\n[…]\n'
+
+_encoding = None
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_TURN_BREAK = re.compile(r"\n\s*\n(?=(?:User|AI|Assistant|Human|ChatGPT|Claude|Gemini)\s*:)")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def get_encoding():
+    """The tiktoken encoding, or None when counting falls back to the approximation"""
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                # Encodings are downloaded on first use; offline hosts fall back
+                logging.warning(f"tiktoken encoding {TOKENIZER_ENCODING} unavailable: {e}")
+    return _encoding or None
+
+
+def approximate_tokens(text):
+    """BPE-like estimate: ~4 chars per ASCII word piece, one per punctuation mark
+    and one per non-ASCII character"""
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        tokens += math.ceil(len(piece) / 4) if piece.isascii() else len(piece)
+    return tokens
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return approximate_tokens(text)
+
+
+def user_budget(template, prompt_tokens, reserved=0):
+    """Tokens left for request text once the template's fixed cost is paid"""
+    return max(MIN_USER_TOKENS, prompt_tokens - template.fixed_tokens - reserved)
+
+
+def trim_middle(text, max_tokens, head_share=0.4):
+    """Keep the beginning and end of text within max_tokens, dropping the middle"""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    keep = max(0, max_tokens - count_tokens(TRIM_MARKER))
+    encoding = get_encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        head = int(keep * head_share)
+        tail = keep - head
+        return encoding.decode(ids[:head]) + TRIM_MARKER + (encoding.decode(ids[-tail:]) if tail else '')
+
+    # Approximate counts: cut by the character ratio, then tighten until it fits
+    chars = int(len(text) * keep / total)
+    while True:
+        head = int(chars * head_share)
+        tail = chars - head
+        trimmed = text[:head] + TRIM_MARKER + (text[-tail:] if tail else '')
+        if chars == 0 or count_tokens(trimmed) <= max_tokens:
+            return trimmed
+        chars = int(chars * 0.9)
+
+
+def split_turns(text):
+    """Conversation text -> turns ('User: ...', 'AI: ...'), else paragraphs"""
+    turns = _TURN_BREAK.split(text)
+    if len(turns) == 1:
+        turns = _PARAGRAPH_BREAK.split(text)
+    return [turn for turn in turns if turn.strip()]
+
+
+def trim_turns(turns, max_tokens, separator='\n\n'):
+    """Keep the first turn and the most recent turns that fit in max_tokens"""
+    counts = [count_tokens(turn) for turn in turns]
+    gap = count_tokens(separator)
+    if sum(counts) + gap * max(0, len(turns) - 1) <= max_tokens:
+        return list(turns)
+
+    last = len(turns) - 1
+    if last == 0:
+        return [trim_middle(turns[0], max_tokens)]
+
+    # First and last turns alone are too big: share the budget, favouring the latest
+    marker = '[… earlier messages omitted …]'
+    reserve = count_tokens(marker) + gap * 2
+    if counts[0] + counts[last] + reserve > max_tokens:
+        first_budget = min(counts[0], max(MIN_USER_TOKENS, (max_tokens - reserve) // 3))
+        kept = [trim_middle(turns[0], first_budget),
+                trim_middle(turns[last], max(0, max_tokens - reserve - first_budget))]
+        if last > 1:
+            kept.insert(1, marker)
+        return kept
+
+    # Walk back from the newest turn while turns still fit
+    remaining = max_tokens - counts[0] - counts[last] - reserve
+    start = last
+    while start - 1 > 0 and counts[start - 1] + gap <= remaining:
+        start -= 1
+        remaining -= counts[start] + gap
+
+    kept = [turns[0]]
+    if start > 1:
+        kept.append(marker)
+    kept.extend(turns[start:])
+    return kept
+
+
+def trim_conversation(text, max_tokens):
+    """Fit a conversation into max_tokens, keeping the opening and most recent turns"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    return '\n\n'.join(trim_turns(split_turns(text), max_tokens))
@@ -0,0 +1,405 @@
+"""Token usage and cost accounting per request, user, mode and model.
+
+Every completion the LLM gateway finishes is recorded with the
+`response.usage` OpenAI returned. The fields kept are prompt, cached-prompt
+and completion tokens, plus the call's latency and its cost from PRICES.
+Streams ask for usage in their final chunk (stream_options.include_usage).
+Some completions carry no usage:
+  - a stream cancelled before its final chunk (a hedge loser, a client that
+    went away)
+  - LocalBackend output
+These are estimated with token_budget.count_tokens and flagged as estimated.
+Calls that failed before any output are not billed, so they are not recorded.
+
+Credits are recorded when a request's charge is committed (record_credits),
+so refunded and released reservations, free stand-in answers and
+unauthenticated requests add nothing, and cache hits that made no LLM call
+still count. They are not tied to a model: they land on model 'none' rows.
+
+Attribution comes from the request. begin_usage(endpoint) runs in
+before_request. optional_credit_check adds mode and user through
+attribute_usage(). The gateway's tasks copy the caller's context, so hedged
+attempts are charged to the request that started them, and so are coalesced
+calls (charged once, to the leader).
+
+Records are summed in memory. A background thread flushes them every
+USAGE_FLUSH_SECONDS: into a sqlite table that every worker on the host
+shares (USAGE_DB_PATH), and, when a Firestore client is attached and
+USAGE_FIRESTORE_COLLECTION is set, into one Increment-ed document per
+day/mode/model/user, in batched writes. report() reads the sqlite table for
+GET /usage-report.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from token_budget import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# USAGE CONFIGURATION
+USAGE_ENABLED = os.getenv('USAGE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', 'usage.sqlite3')
+USAGE_FLUSH_SECONDS = float(os.getenv('USAGE_FLUSH_SECONDS', '10'))
+USAGE_FIRESTORE_COLLECTION = os.getenv('USAGE_FIRESTORE_COLLECTION', '')  # e.g. 'usage_daily'; empty = sqlite only
+USAGE_REPORT_TOKEN = os.getenv('USAGE_REPORT_TOKEN', '')  # X-Admin-Token for /usage-report; unset disables it
+
+# USD per 1M tokens: (input, cached input, output). Dated snapshots match by prefix.
+PRICES = {
+    'chatgpt-4o-latest': (5.00, 5.00, 15.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1-nano': (0.10, 0.025, 0.40),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+    'gpt-4-turbo': (10.00, 10.00, 30.00),
+    'gpt-4': (30.00, 30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 0.50, 1.50),
+}
+# Overrides/additions as JSON: USAGE_PRICES='{"gpt-4o": [2.5, 1.25, 10]}'
+PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv('USAGE_PRICES', '{}')).items()})
+
+# Firestore allows 500 writes per batch
+FIRESTORE_BATCH_WRITES = 450
+
+KEY_COLUMNS = ('day', 'endpoint', 'mode', 'model', 'user')
+SUM_COLUMNS = ('requests', 'calls', 'estimated_calls', 'prompt_tokens', 'cached_tokens',
+               'completion_tokens', 'cost_usd', 'latency_total', 'credits_charged')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    model TEXT NOT NULL,
+    user TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    estimated_calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    latency_total REAL NOT NULL DEFAULT 0,
+    latency_max REAL NOT NULL DEFAULT 0,
+    credits_charged INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, endpoint, mode, model, user)
+);
+'''
+
+# Tables created before credits were recorded
+MIGRATIONS = (
+    ('credits_charged', 'ALTER TABLE usage ADD COLUMN credits_charged INTEGER NOT NULL DEFAULT 0'),
+)
+
+_attribution = contextvars.ContextVar('usage_attribution', default=None)
+
+
+# ATTRIBUTION
+def begin_usage(endpoint):
+    """Start attributing LLM usage in this context to a request on `endpoint`"""
+    _attribution.set({'endpoint': endpoint})
+
+
+def attribute_usage(**attributes):
+    """Set mode/user on the current request's usage (first value wins)"""
+    current = _attribution.get()
+    if current is not None:
+        for key, value in attributes.items():
+            if value:
+                current.setdefault(key, value)
+
+
+# PRICING
+def price_for(model):
+    """(input, cached input, output) USD per 1M tokens, or None for unknown models"""
+    if model in PRICES:
+        return PRICES[model]
+    # Longest prefix first so 'gpt-4o-mini-2024-07-18' is not priced as gpt-4o
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return PRICES[name]
+    return None
+
+
+def cost_of(model, prompt_tokens, cached_tokens, completion_tokens):
+    price = price_for(model)
+    if price is None:
+        return 0.0
+    return ((prompt_tokens - cached_tokens) * price[0] + cached_tokens * price[1]
+            + completion_tokens * price[2]) / 1_000_000
+
+
+def usage_numbers(usage):
+    """(prompt, cached, completion) tokens from an OpenAI usage object or dict"""
+    if isinstance(usage, dict):
+        details = usage.get('prompt_tokens_details') or {}
+        cached = details.get('cached_tokens') if isinstance(details, dict) else getattr(details, 'cached_tokens', 0)
+        return usage.get('prompt_tokens') or 0, cached or 0, usage.get('completion_tokens') or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return (getattr(usage, 'prompt_tokens', 0) or 0, getattr(details, 'cached_tokens', 0) or 0,
+            getattr(usage, 'completion_tokens', 0) or 0)
+
+
+def estimate_prompt_tokens(messages):
+    tokens = 0
+    for message in messages or ():
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        tokens += count_tokens(content or '') + MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+
+class UsageMeter:
+    """Sum usage in memory; flush it to sqlite (and optionally Firestore) in batches"""
+
+    def __init__(self, path=USAGE_DB_PATH, flush_seconds=USAGE_FLUSH_SECONDS, db=None,
+                 collection=USAGE_FIRESTORE_COLLECTION):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.db = db
+        self.collection = collection
+        self._pending = {}            # key -> [sums..., latency_max]
+        self._firestore_pending = {}  # deltas not yet mirrored to Firestore
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(usage)')}
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    conn.execute(statement)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def attach_firestore(self, db):
+        """Mirror flushed totals to Firestore (only when USAGE_FIRESTORE_COLLECTION is set)"""
+        self.db = db
+
+    def record(self, model, usage=None, messages=None, text='', latency=0.0):
+        """Add one completion; without `usage` the tokens are estimated from messages/text"""
+        if usage is not None:
+            prompt_tokens, cached_tokens, completion_tokens = usage_numbers(usage)
+            estimated = 0
+        else:
+            prompt_tokens, cached_tokens, completion_tokens = estimate_prompt_tokens(messages), 0, count_tokens(text)
+            estimated = 1
+
+        attribution = _attribution.get()
+        if attribution is None:
+            attribution, first_call = {}, True
+        else:
+            first_call = not attribution.get('counted')
+            attribution['counted'] = True
+
+        values = (1 if first_call else 0, 1, estimated, prompt_tokens, cached_tokens, completion_tokens,
+                  cost_of(model or '', prompt_tokens, cached_tokens, completion_tokens), latency, 0)
+        self._add(self._key(attribution, model or 'unknown'), values, latency)
+
+    def record_credits(self, amount, user=None):
+        """Add credits actually charged to the current request (on commit, never on reserve)"""
+        attribution = _attribution.get() or {}
+        if user and not attribution.get('user'):
+            attribution = dict(attribution, user=user)
+        values = (0,) * (len(SUM_COLUMNS) - 1) + (amount,)
+        self._add(self._key(attribution, 'none'), values, 0.0)
+
+    @staticmethod
+    def _key(attribution, model):
+        return (
+            datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d'),
+            attribution.get('endpoint', 'none'),
+            attribution.get('mode', 'none'),
+            model,
+            attribution.get('user', ''),
+        )
+
+    def _add(self, key, values, latency):
+        self.start()
+        with self._lock:
+            totals = self._pending.get(key)
+            if totals is None:
+                totals = self._pending[key] = [0] * len(SUM_COLUMNS) + [0.0]
+            for index, value in enumerate(values):
+                totals[index] += value
+            totals[-1] = max(totals[-1], latency)
+
+    def flush(self):
+        """Write everything summed so far; returns the number of rows touched"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self._write_sqlite(pending)
+                if self.db is not None and self.collection:
+                    for key, totals in pending.items():
+                        merged = self._firestore_pending.setdefault(key, [0] * len(SUM_COLUMNS) + [0.0])
+                        for index, value in enumerate(totals[:-1]):
+                            merged[index] += value
+                        merged[-1] = max(merged[-1], totals[-1])
+            if self._firestore_pending and self.db is not None and self.collection:
+                self._write_firestore()
+            return len(pending)
+
+    def _write_sqlite(self, pending):
+        columns = KEY_COLUMNS + SUM_COLUMNS + ('latency_max',)
+        updates = ', '.join(f'{name} = {name} + excluded.{name}' for name in SUM_COLUMNS)
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                f'INSERT INTO usage ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                f'ON CONFLICT ({", ".join(KEY_COLUMNS)}) DO UPDATE SET {updates}, '
+                f'latency_max = MAX(latency_max, excluded.latency_max)',
+                [key + tuple(totals) for key, totals in pending.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write_firestore(self):
+        from firebase_admin import firestore
+
+        items = list(self._firestore_pending.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_WRITES):
+            chunk = items[start:start + FIRESTORE_BATCH_WRITES]
+            batch = self.db.batch()
+            for key, totals in chunk:
+                doc_id = '_'.join(part.replace('/', '-') or 'anonymous' for part in (key[0], key[2], key[3], key[4]))
+                document = dict(zip(KEY_COLUMNS, key))
+                document.update({name: firestore.Increment(value) for name, value in zip(SUM_COLUMNS, totals)})
+                document['lastUpdated'] = firestore.SERVER_TIMESTAMP
+                batch.set(self.db.collection(self.collection).document(doc_id), document, merge=True)
+            try:
+                batch.commit()
+            except Exception as e:
+                # Kept for the next flush; sqlite already has these totals
+                logging.warning(f"Usage mirror to Firestore failed, will retry: {e}")
+                return
+            for key, _ in chunk:
+                del self._firestore_pending[key]
+
+    def start(self):
+        if self._thread is None:
+            with self._flush_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='usage-meter', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"Usage meter background flush error: {e}")
+
+    def stop(self):
+        """Stop the flusher and write what is still pending"""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.warning(f"Usage meter final flush failed: {e}")
+
+    def report(self, since=None, until=None, group_by=('mode', 'model'), user=None, limit=200):
+        """Totals per group_by columns between two UTC days (inclusive), most expensive first.
+
+        USD per credit is only given for rows not split by model (credits have no model).
+        """
+        self.flush()
+        group_by = [column for column in group_by if column in KEY_COLUMNS]
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        since = since or (today - datetime.timedelta(days=6)).isoformat()
+        until = until or today.isoformat()
+
+        where, args = 'day BETWEEN ? AND ?', [since, until]
+        if user is not None:
+            where += ' AND user = ?'
+            args.append(user)
+        sums = ', '.join(f'SUM({name})' for name in SUM_COLUMNS)
+        select = ', '.join(group_by + [sums, 'MAX(latency_max)'])
+        query = f'SELECT {select} FROM usage WHERE {where}'
+        if group_by:
+            query += f' GROUP BY {", ".join(group_by)}'
+        query += ' ORDER BY SUM(cost_usd) DESC LIMIT ?'
+
+        rows = []
+        for values in self.conn.execute(query, (*args, limit)).fetchall():
+            row = dict(zip(group_by + list(SUM_COLUMNS) + ['latency_max'], values))
+            if row['calls'] is None:
+                continue  # no usage in the window (ungrouped query)
+            rows.append(self._describe(row, 'model' not in group_by))
+
+        totals = {name: sum(row[name] for row in rows) for name in SUM_COLUMNS if name != 'latency_total'}
+        totals['cost_usd'] = round(totals['cost_usd'], 6)
+        return {'since': since, 'until': until, 'group_by': group_by, 'rows': rows, 'totals': totals}
+
+    @staticmethod
+    def _describe(row, per_credit):
+        calls, requests = row['calls'], row['requests']
+        latency_total = row.pop('latency_total')
+        row['avg_latency_ms'] = round(latency_total / calls * 1000, 1) if calls else 0.0
+        row['max_latency_ms'] = round(row.pop('latency_max') * 1000, 1)
+        row['cost_usd'] = round(row['cost_usd'], 6)
+        row['cost_per_request_usd'] = round(row['cost_usd'] / requests, 6) if requests else None
+        row['tokens_per_request'] = (round((row['prompt_tokens'] + row['completion_tokens']) / requests)
+                                     if requests else None)
+        if per_credit:
+            row['usd_per_credit'] = (round(row['cost_usd'] / row['credits_charged'], 6)
+                                     if row['credits_charged'] else None)
+        return row
+
+
+_meter = None
+_meter_lock = threading.Lock()
+
+
+def get_usage_meter():
+    """Process-wide meter shared by the gateway and the report endpoint"""
+    global _meter
+    if _meter is None:
+        with _meter_lock:
+            if _meter is None:
+                _meter = UsageMeter()
+    return _meter
+
+
+def record_usage(model, usage=None, messages=None, text='', latency=0.0):
+    """Record one completion on the process-wide meter (no-op when USAGE_ENABLED is off)"""
+    if not USAGE_ENABLED:
+        return
+    try:
+        get_usage_meter().record(model, usage, messages, text, latency)
+    except Exception as e:
+        logging.warning(f"Usage recording failed: {e}")
+
+
+def record_credits(amount, user=None):
+    """Record credits charged to the current request (no-op when USAGE_ENABLED is off)"""
+    if not USAGE_ENABLED or not amount:
+        return
+    try:
+        get_usage_meter().record_credits(amount, user)
+    except Exception as e:
+        logging.warning(f"Credit usage recording failed: {e}")
@@ -0,0 +1,224 @@
+"""Views that run both as blocking Flask views and as awaitable ASGI handlers.
+
+An LLM-bound view is written as a generator that yields every slow call
+instead of making it:
+
+    @app.route('/explain-meaning', methods=['POST'])
+    @flow_view
+    def explain_meaning():
+        credit_result = yield Call(optional_credit_check, None, 'explain_meaning')
+        response = yield Call(llm.complete, llm.acomplete, model=..., messages=...)
+        return jsonify(...)
+
+Under Flask (WSGI) run_sync makes each call blocking, exactly as before.
+asgi.py drives the same generator with run_async, awaiting the call on the
+server's event loop, so route definitions, validation, prompts and JSON
+contracts exist once. Exceptions raised by a call are thrown back into the
+generator, so the view's own try/except handles them unchanged.
+
+Optimistic credits: when a view yields a CreditCheck, the drivers start the
+check in the background and hand the view a PendingCredit that reads as
+successful, so prompt building and the LLM call start straight away instead
+of after the JWT decode and Firestore round trips. If the check fails while
+a call is in flight the call is cancelled; either way the view is closed
+and the check's rejection (the usual 402) is returned, so nothing generated
+for an unpaid request ever leaves the server.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import wraps
+
+# OPTIMISTIC CREDIT CHECKS
+OPTIMISTIC_CREDITS = os.getenv('OPTIMISTIC_CREDITS', 'true').lower() in ('true', '1', 'yes')
+
+# endpoint name -> generator function, for asgi.py
+FLOWS = {}
+
+
+class Call:
+    """One slow operation a flow view wants performed.
+
+    `async_fn` is awaited under ASGI; when it is None the blocking function
+    runs in a worker thread instead (Firestore, sqlite).
+    """
+
+    __slots__ = ('sync_fn', 'async_fn', 'args', 'kwargs')
+
+    def __init__(self, sync_fn, async_fn, *args, **kwargs):
+        self.sync_fn = sync_fn
+        self.async_fn = async_fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.sync_fn(*self.args, **self.kwargs)
+
+    async def arun(self):
+        if self.async_fn is not None:
+            return await self.async_fn(*self.args, **self.kwargs)
+        # to_thread copies the context, so Flask's request/g stay visible
+        return await asyncio.to_thread(self.sync_fn, *self.args, **self.kwargs)
+
+
+class CreditCheck(Call):
+    """A Call whose unsuccessful result ends the request with reject(result)"""
+
+    __slots__ = ('reject',)
+
+    def __init__(self, sync_fn, reject, *args, **kwargs):
+        super().__init__(sync_fn, None, *args, **kwargs)
+        self.reject = reject
+
+
+class PendingCredit(dict):
+    """Stand-in result for a credit check still running in the background.
+
+    Reads as successful; any other key waits for the real result. The drivers
+    resolve it as soon as the check finishes, so only views that read credit
+    info before their first LLM call (cache hits, local templates) ever wait.
+    """
+
+    def __init__(self, future):
+        super().__init__(success=True)
+        self.future = future
+        self.resolved = False
+
+    def resolve(self):
+        if not self.resolved:
+            outcome = self.future.result()
+            self.clear()
+            self.update(outcome)
+            self.resolved = True
+        return self
+
+    def __getitem__(self, key):
+        if key != 'success':
+            self.resolve()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key != 'success':
+            self.resolve()
+        return super().get(key, default)
+
+
+# Credit checks run here so both drivers can wait on a plain future
+_check_pool = ThreadPoolExecutor(max_workers=int(os.getenv('CREDIT_CHECK_THREADS', '32')),
+                                 thread_name_prefix='credit-check')
+
+# Loop the blocking driver runs calls on when it may have to cancel them
+_call_loop = None
+
+
+def set_call_loop(get_loop):
+    """Give run_sync an event loop (e.g. the LLM gateway's) for optimistic mode"""
+    global _call_loop
+    _call_loop = get_loop
+
+
+def _in_context(schedule, fn, *args):
+    """schedule(fn, ...) with fn running in a copy of the caller's context,
+    so Flask's request and g stay visible to it"""
+    return schedule(contextvars.copy_context().run, fn, *args)
+
+
+def _advance(flow, value=None, error=None):
+    """Resume the flow; returns (next_call, None) or (None, return_value)"""
+    try:
+        if error is not None:
+            return flow.throw(error), None
+        return flow.send(value), None
+    except StopIteration as stop:
+        return None, stop.value
+
+
+def _rejection(check, placeholder, flow):
+    """The check's rejection response if it failed, else None"""
+    if placeholder.resolve().get('success'):
+        return None
+    flow.close()
+    return check.reject(dict(placeholder))
+
+
+def run_sync(flow):
+    optimistic = OPTIMISTIC_CREDITS and _call_loop is not None
+    check = placeholder = None
+
+    call, result = _advance(flow)
+    while call is not None:
+        if optimistic and isinstance(call, CreditCheck) and check is None:
+            check, placeholder = call, PendingCredit(_in_context(_check_pool.submit, call.run))
+            call, result = _advance(flow, placeholder)
+            continue
+
+        try:
+            if placeholder is None or placeholder.resolved:
+                value = call.run()
+            else:
+                future = contextvars.copy_context().run(asyncio.run_coroutine_threadsafe, call.arun(), _call_loop())
+                wait([placeholder.future, future], return_when=FIRST_COMPLETED)
+                if placeholder.future.done() and not future.done():
+                    rejection = _rejection(check, placeholder, flow)
+                    if rejection is not None:
+                        future.cancel()
+                        return rejection
+                value = future.result()
+        except Exception as e:
+            call, result = _advance(flow, error=e)
+        else:
+            call, result = _advance(flow, value)
+
+    if check is not None:
+        rejection = _rejection(check, placeholder, flow)
+        if rejection is not None:
+            return rejection
+    return result
+
+
+async def run_async(flow):
+    check = placeholder = None
+
+    call, result = _advance(flow)
+    while call is not None:
+        if OPTIMISTIC_CREDITS and isinstance(call, CreditCheck) and check is None:
+            check, placeholder = call, PendingCredit(_in_context(_check_pool.submit, call.run))
+            call, result = _advance(flow, placeholder)
+            continue
+
+        try:
+            if placeholder is None or placeholder.resolved:
+                value = await call.arun()
+            else:
+                task = asyncio.ensure_future(call.arun())
+                checked = asyncio.wrap_future(placeholder.future)
+                await asyncio.wait([checked, task], return_when=asyncio.FIRST_COMPLETED)
+                if checked.done() and not task.done():
+                    rejection = _rejection(check, placeholder, flow)
+                    if rejection is not None:
+                        task.cancel()
+                        return rejection
+                value = await task
+        except Exception as e:
+            call, result = _advance(flow, error=e)
+        else:
+            call, result = _advance(flow, value)
+
+    if check is not None:
+        await asyncio.wrap_future(placeholder.future)
+        rejection = _rejection(check, placeholder, flow)
+        if rejection is not None:
+            return rejection
+    return result
+
+
+def flow_view(func):
+    """Register a generator view for asgi.py and expose a blocking Flask view"""
+    FLOWS[func.__name__] = func
+
+    @wraps(func)
+    def view(*args, **kwargs):
+        return run_sync(func(*args, **kwargs))
+
+    return view